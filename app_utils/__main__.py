@@ -1,37 +1,102 @@
+import importlib
 import logging
+import sys
+from pathlib import Path
+from typing import TYPE_CHECKING
 
-from piou import Cli
+from app_utils.daemon import run_client
+from app_utils.metrics import metrics
 
-from app_utils.jobs import (
-    run_changelog, run_crop, run_update_version, run_icons,
-    android_group
-)
-from app_utils.logs import init_logging, logger
+if TYPE_CHECKING:
+    from piou import Cli
 
-cli = Cli('Cli utilities for React Native')
+# Command name -> (module, attribute), the module is only imported when the command is run
+COMMANDS = {
+    'changelog': ('app_utils.jobs.changelog', 'run_changelog'),
+    'crop': ('app_utils.jobs.crop', 'run_crop'),
+    'update-version': ('app_utils.jobs.update_version', 'run_update_version'),
+    'update-versions': ('app_utils.jobs.update_version', 'run_update_versions'),
+    'resize-icons': ('app_utils.jobs.icons', 'run_icons'),
+    'serve': ('app_utils.jobs.serve', 'run_serve'),
+}
+COMMAND_GROUPS = {
+    'android': ('app_utils.jobs.android', 'android_group'),
+}
 
-cli.add_option('-v', '--verbose', help='Verbosity')
-cli.add_option('-vv', '--verbose2', help='Increased verbosity')
 
-cli.add_command('changelog', run_changelog)
-cli.add_command('crop', run_crop)
-cli.add_command('update-version', run_update_version)
-cli.add_command('resize-icons', run_icons)
-cli.add_command_group(android_group)
+# Root options followed by a value
+_VALUE_OPTIONS = {'--metrics-json'}
 
 
-def on_process(verbose: bool = False, verbose2: bool = False):
+def on_process(verbose: bool = False, verbose2: bool = False, metrics_json: str | None = None):
+    # Import here so that `client` does not load rich
+    from app_utils.logs import init_logging, logger
+
     init_logging()
     logger.setLevel(logging.DEBUG if verbose2 else
                     logging.INFO if verbose else
                     logging.WARNING)
+    metrics.reset(Path(metrics_json) if metrics_json else None)
+
+
+def get_command_name(args: list[str]) -> str | None:
+    _args = iter(args)
+    for arg in _args:
+        if arg in _VALUE_OPTIONS:
+            next(_args, None)
+        elif not arg.startswith('-'):
+            return arg
+    return None
+
+
+def _load(module: str, name: str):
+    return getattr(importlib.import_module(module), name)
+
+
+def get_cli(args: list[str] | None = None) -> 'Cli':
+    """
+    Creates the cli with only the command called in `args`.
+    All the commands are loaded when no (or an unknown) command is given, to print the help.
+    """
+    # Import here so that `client` does not load piou / rich
+    from piou import Cli
+
+    command = get_command_name(args) if args is not None else None
+    load_all = command not in COMMANDS and command not in COMMAND_GROUPS
+
+    cli = Cli('Cli utilities for React Native')
+
+    cli.add_option('-v', '--verbose', help='Verbosity')
+    cli.add_option('-vv', '--verbose2', help='Increased verbosity')
+    cli.add_option('--metrics-json', help='Writes the durations of the stages and the counters of the job to this file',
+                   data_type=str, default=None)
+
+    for name, (module, attr) in COMMANDS.items():
+        if load_all or name == command:
+            cli.add_command(name, _load(module, attr))
+    for name, (module, attr) in COMMAND_GROUPS.items():
+        if load_all or name == command:
+            cli.add_command_group(_load(module, attr))
+
+    cli.set_options_processor(on_process)
+    return cli
 
 
-cli.set_options_processor(on_process)
+def __getattr__(name: str):
+    # `cli` with all the commands
+    if name == 'cli':
+        return get_cli()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 def run():
-    cli.run()
+    if sys.argv[1:2] == ['client']:
+        # Forwards the command to the daemon (see `serve`) without loading the commands
+        run_client(sys.argv[2:])
+    try:
+        get_cli(sys.argv[1:]).run()
+    finally:
+        metrics.flush()
 
 
 if __name__ == '__main__':
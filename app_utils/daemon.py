@@ -0,0 +1,127 @@
+"""
+Runs the cli commands in a long-lived process (see `app_utils.jobs.serve`) and forwards them from a thin client.
+Only depends on the standard library so that the client starts quickly.
+
+Protocol: the client sends one JSON line `{"args": [...], "cwd": "..."}` over the Unix socket and receives
+one JSON line `{"code": 0, "stdout": "...", "stderr": "..."}` once the command is done.
+"""
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+import tempfile
+import traceback
+from contextlib import redirect_stdout, redirect_stderr
+from pathlib import Path
+
+DEFAULT_SOCKET = Path(tempfile.gettempdir()) / f'app-utils-{os.getuid()}.sock'
+
+# Commands that cannot be run by the daemon
+_EXCLUDED_COMMANDS = {'serve', 'client'}
+
+
+def run_job(args: list[str], cwd: str) -> dict:
+    """
+    Runs the command `args` from `cwd`, capturing its output and exit code
+    """
+    # Import here to avoid circular import
+    from app_utils.__main__ import get_cli, get_command_name
+    from app_utils.metrics import metrics
+
+    command = get_command_name(args)
+    if command in _EXCLUDED_COMMANDS:
+        return {'code': 1, 'stdout': '', 'stderr': f'Command {command!r} cannot be run by the daemon\n'}
+
+    stdout, stderr = io.StringIO(), io.StringIO()
+    code = 0
+    previous_cwd = os.getcwd()
+    try:
+        os.chdir(cwd)
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            try:
+                get_cli(args).run_with_args(*args)
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else int(e.code is not None)
+            except Exception:
+                traceback.print_exc()
+                code = 1
+            finally:
+                metrics.flush()
+    except OSError as e:
+        stderr.write(f'{e}\n')
+        code = 1
+    finally:
+        os.chdir(previous_cwd)
+    return {'code': code, 'stdout': stdout.getvalue(), 'stderr': stderr.getvalue()}
+
+
+class _JobHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            response = run_job(list(request['args']), request.get('cwd') or os.getcwd())
+        except (json.JSONDecodeError, KeyError, TypeError) as e:
+            response = {'code': 1, 'stdout': '', 'stderr': f'Invalid request: {e}\n'}
+        self.wfile.write(json.dumps(response).encode() + b'\n')
+
+
+class JobServer(socketserver.UnixStreamServer):
+    """
+    Runs the jobs one at a time: commands change the working directory and the log level of the process.
+    Each job still uses its own pool of threads / processes.
+    """
+
+    def __init__(self, socket_path: Path = DEFAULT_SOCKET):
+        if socket_path.exists():
+            if is_running(socket_path):
+                raise RuntimeError(f'A server is already listening on {socket_path}')
+            # Left by a server that was killed
+            socket_path.unlink()
+        self.socket_path = socket_path
+        super().__init__(str(socket_path), _JobHandler)
+        socket_path.chmod(0o600)
+
+    def server_close(self):
+        super().server_close()
+        self.socket_path.unlink(missing_ok=True)
+
+
+def is_running(socket_path: Path = DEFAULT_SOCKET) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        try:
+            s.connect(str(socket_path))
+        except OSError:
+            return False
+    return True
+
+
+def send_job(args: list[str], socket_path: Path = DEFAULT_SOCKET, cwd: str | None = None) -> dict:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(str(socket_path))
+        s.sendall(json.dumps({'args': args, 'cwd': cwd or os.getcwd()}).encode() + b'\n')
+        s.shutdown(socket.SHUT_WR)
+        with s.makefile('rb') as f:
+            return json.loads(f.readline())
+
+
+def run_client(argv: list[str]):
+    """
+    Forwards a command to the daemon:
+        cli client [--socket PATH] changelog -p CHANGELOG.md -l
+    """
+    socket_path = DEFAULT_SOCKET
+    if argv[:1] == ['--socket'] and len(argv) > 1:
+        socket_path, argv = Path(argv[1]), argv[2:]
+    if not argv:
+        sys.stderr.write('Usage: client [--socket PATH] <command> [options]\n')
+        sys.exit(1)
+    try:
+        response = send_job(argv, socket_path)
+    except OSError as e:
+        sys.stderr.write(f'Could not reach the daemon @{socket_path} ({e}), please run `serve` first\n')
+        sys.exit(1)
+    sys.stdout.write(response['stdout'])
+    sys.stderr.write(response['stderr'])
+    sys.exit(response['code'])
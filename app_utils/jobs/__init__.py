@@ -1,5 +1,31 @@
-from .changelog import run_changelog
-from .crop import run_crop
-from .update_version import run_update_version
-from .icons import run_icons
-from .android import android_group
+import importlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .android import android_group
+    from .changelog import run_changelog
+    from .crop import run_crop
+    from .icons import run_icons
+    from .serve import run_serve
+    from .update_version import run_update_version, run_update_versions
+
+# Commands are imported on first access so that running one of them does not load
+# the dependencies of the others (httpx, jwt, cairosvg, ...)
+_COMMANDS = {
+    'run_changelog': '.changelog',
+    'run_crop': '.crop',
+    'run_update_version': '.update_version',
+    'run_update_versions': '.update_version',
+    'run_icons': '.icons',
+    'android_group': '.android',
+    'run_serve': '.serve',
+}
+
+__all__ = ['run_changelog', 'run_crop', 'run_update_version', 'run_update_versions', 'run_icons',
+           'android_group', 'run_serve']
+
+
+def __getattr__(name: str):
+    if name not in _COMMANDS:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    return getattr(importlib.import_module(_COMMANDS[name], __name__), name)
@@ -1 +1,2 @@
 from .run import android_group
+from .client import PlayPublisherClient, AsyncPlayPublisherClient, ServiceAccount
@@ -0,0 +1,373 @@
+import asyncio
+import json
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import AsyncIterable, Iterable, TypeVar
+
+import httpx
+import jwt
+from httpx import codes
+
+from app_utils.logs import logger
+from app_utils.metrics import span, incr
+from .token import Token, TokenCache, token_cache, EXPIRY_MARGIN
+from .transport import TransportConfig, RETRYABLE_ERRORS, UNSENT_ERRORS, DEFAULT_TIMEOUT
+
+# https://developers.google.com/identity/protocols/oauth2/scopes#androidpublisher
+SCOPE = 'https://www.googleapis.com/auth/androidpublisher'
+TOKEN_URL = 'https://oauth2.googleapis.com/token'
+
+URL = 'https://www.googleapis.com/androidpublisher/v3/applications/{PACKAGE_NAME}'
+UPLOAD_URL = 'https://www.googleapis.com/upload/androidpublisher/v3/applications/{PACKAGE_NAME}'
+COMMIT_URL = 'https://androidpublisher.googleapis.com/androidpublisher/v3/applications/{PACKAGE_NAME}'
+
+
+def get_package_urls(package_name: str) -> tuple[str, str, str]:
+    """
+    Returns the (API, upload, commit) URLs of a package
+    """
+    return (URL.format(PACKAGE_NAME=package_name),
+            UPLOAD_URL.format(PACKAGE_NAME=package_name),
+            COMMIT_URL.format(PACKAGE_NAME=package_name))
+
+
+# Connection pools kept for the lifetime of the process by the daemon (see `serve`), by pool settings.
+# None outside of the daemon.
+_shared_http: dict[tuple[int, int, bool], httpx.Client] | None = None
+
+
+def _get_pool(pools: dict[tuple[int, int, bool], httpx.Client], transport: TransportConfig) -> httpx.Client:
+    key = (transport.max_connections, transport.max_keepalive_connections, transport.http2)
+    if key not in pools:
+        pools[key] = httpx.Client(**transport.get_client_kwargs())
+    return pools[key]
+
+
+def enable_shared_http() -> httpx.Client:
+    """
+    Keeps the connection pools of the process, returns the one of the default transport
+    """
+    global _shared_http
+    if _shared_http is None:
+        _shared_http = {}
+    return _get_pool(_shared_http, TransportConfig())
+
+
+def get_shared_http(transport: TransportConfig | None = None) -> httpx.Client | None:
+    """
+    Returns the shared pool with the limits and HTTP version of `transport` (created on first use), or None
+    outside of the daemon. Timeouts are set on each request by the clients, not by the pool.
+    """
+    if _shared_http is None:
+        return None
+    return _get_pool(_shared_http, transport or TransportConfig())
+
+
+@dataclass
+class ServiceAccount:
+    client_email: str
+    private_key_id: str
+    private_key: str | bytes = field(repr=False)
+    _jwt: tuple[str, float] | None = field(default=None, init=False, repr=False, compare=False)
+
+    @classmethod
+    def from_file(cls, path: Path) -> 'ServiceAccount':
+        """
+        Loads the service account from its JSON key file
+        """
+        config = json.loads(path.read_text())
+        return cls(client_email=config['client_email'],
+                   private_key_id=config['private_key_id'],
+                   private_key=config['private_key'])
+
+    def gen_jwt(self) -> str:
+        """
+        Returns a signed JWT for the token request.
+        The signed JWT is valid for 1 hour and reused until it is about to expire.
+        """
+        if self._jwt:
+            signed_jwt, exp = self._jwt
+            if exp - EXPIRY_MARGIN > time.time():
+                return signed_jwt
+
+        iat = time.time()
+        exp = iat + 3600
+
+        payload = {'iss': self.client_email,
+                   'sub': self.client_email,
+                   'aud': TOKEN_URL,
+                   'scope': SCOPE,
+                   'iat': iat,
+                   'exp': exp}
+
+        additional_headers = {'kid': self.private_key_id}
+        signed_jwt = jwt.encode(payload, self.private_key, headers=additional_headers,
+                                algorithm='RS256')
+        self._jwt = (signed_jwt, exp)
+        return signed_jwt
+
+    @property
+    def token_data(self) -> dict:
+        return {
+            'grant_type': 'urn:ietf:params:oauth:grant-type:jwt-bearer',
+            'assertion': self.gen_jwt()
+        }
+
+
+C = TypeVar('C', bound='_BasePlayPublisherClient')
+
+
+class _BasePlayPublisherClient:
+    """
+    Holds the configuration of a client: package, URLs, service account, token and transport.
+    Without service account, the client uses the `token` it is given (or any valid cached one)
+    and cannot refresh it.
+    """
+
+    def __init__(self,
+                 package_name: str,
+                 account: ServiceAccount | None = None,
+                 *,
+                 token: str | None = None,
+                 cache: TokenCache = token_cache,
+                 transport: TransportConfig | None = None):
+        self.package_name = package_name
+        self.account = account
+        self.cache = cache
+        self.transport = transport or TransportConfig()
+        self.url, self.upload_url, self.commit_url = get_package_urls(package_name)
+        if token is None:
+            cached_token = cache.get(account.client_email if account else None)
+            token = cached_token.access_token if cached_token else None
+        self.token = token
+
+    def _get_headers(self, headers: dict | None = None) -> dict:
+        headers = dict(headers or {})
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        return headers
+
+    def _get_account(self) -> ServiceAccount:
+        if not self.account:
+            raise ValueError('A service account is required to refresh the token, please specify a config file')
+        return self.account
+
+    def _copy_for(self: C, package_name: str, **kwargs) -> C:
+        return type(self)(package_name, self.account, token=self.token, cache=self.cache,
+                          transport=self.transport, **kwargs)
+
+    def _get_request_kwargs(self, upload: bool, kwargs: dict) -> dict:
+        # Set on each request, the connection pool may be shared with other transports (see `get_shared_http`)
+        kwargs.setdefault('timeout', self.transport.upload_timeout if upload else self.transport.timeout)
+        return kwargs
+
+    def _get_retry_delay(self, attempt: int, resp: httpx.Response | None = None,
+                         error: Exception | None = None, idempotent: bool = True) -> float | None:
+        """
+        Returns the delay before sending the request again, or None if it should not be retried.
+        Non idempotent requests are only sent again when the previous attempt never reached the server.
+        """
+        if not idempotent and not isinstance(error, UNSENT_ERRORS):
+            return None
+        delay = self.transport.retry.get_retry_delay(attempt, resp)
+        if delay is not None:
+            reason = f'code: {resp.status_code}' if resp is not None else type(error).__name__
+            logger.warning(f'Request failed ({reason}), retrying in {delay:.1f}s...')
+            incr('android.retries')
+        return delay
+
+
+def _get_transport(transport: TransportConfig | None, timeout: float) -> TransportConfig:
+    # `timeout` only applies to the metadata calls, uploads keep their longer timeouts
+    return transport or TransportConfig(read_timeout=timeout, write_timeout=timeout)
+
+
+# Request body
+Content = str | bytes | Iterable[bytes] | AsyncIterable[bytes]
+
+
+class PlayPublisherClient(_BasePlayPublisherClient):
+    """
+    Client of the Play Publisher API for one package.
+    The underlying `httpx.Client` (and its connection pool) is closed with the client, unless
+    it was given through `http`. Clients created with `with_package` share it.
+    The pool limits, timeouts and retry policy are set by `transport` (`timeout` is a shortcut for the
+    timeouts of the metadata calls).
+    """
+
+    def __init__(self,
+                 package_name: str,
+                 account: ServiceAccount | None = None,
+                 *,
+                 http: httpx.Client | None = None,
+                 timeout: float = DEFAULT_TIMEOUT,
+                 transport: TransportConfig | None = None,
+                 token: str | None = None,
+                 cache: TokenCache = token_cache):
+        super().__init__(package_name, account, token=token, cache=cache,
+                         transport=_get_transport(transport, timeout))
+        self._owns_http = http is None
+        self.http = http or httpx.Client(**self.transport.get_client_kwargs())
+
+    def with_package(self, package_name: str) -> 'PlayPublisherClient':
+        return self._copy_for(package_name, http=self.http)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._owns_http:
+            self.http.close()
+
+    def fetch_access_token(self) -> Token:
+        resp = self.http.post(TOKEN_URL, data=self._get_account().token_data,
+                              timeout=self.transport.timeout)
+        return Token.from_response(resp.json())
+
+    def refresh_token(self, force: bool = False) -> str:
+        """
+        Fetches a new token if the cached one is missing or about to expire
+        (or, with `force`, if the current one was rejected by the API)
+        """
+
+        def _refresh() -> Token:
+            logger.info('Refreshing token...')
+            with span('android.token_refresh'):
+                _token = self.fetch_access_token()
+            logger.info('Token refreshed !')
+            return _token
+
+        token = self.cache.get_or_refresh(self._get_account().client_email, _refresh,
+                                          rejected=self.token if force else None)
+        self.token = token.access_token
+        return self.token
+
+    def ensure_token(self):
+        """
+        Refreshes the token before it expires
+        """
+        if self.account:
+            self.refresh_token()
+
+    def request(self, method: str, url: str, *,
+                headers: dict | None = None,
+                content: Content | None = None,
+                upload: bool = False,
+                idempotent: bool = True,
+                **kwargs) -> httpx.Response:
+        """
+        Sends the request with a valid token and retries once with a new token if it is still `UNAUTHORIZED`.
+        Throttled (429), failed (5xx) and interrupted requests are sent again following `transport.retry`,
+        unless the request is not `idempotent` (commits, non resumable uploads): those are only sent again
+        after a connection error, when they could not have been received.
+        `upload` requests use the upload timeouts.
+        """
+        self.ensure_token()
+        kwargs = self._get_request_kwargs(upload, kwargs)
+        attempt, auth_retried = 0, False
+        while True:
+            try:
+                resp = self.http.request(method, url, headers=self._get_headers(headers),
+                                         content=content, **kwargs)
+            except RETRYABLE_ERRORS as e:
+                if (delay := self._get_retry_delay(attempt, error=e, idempotent=idempotent)) is None:
+                    raise
+            else:
+                if resp.status_code == codes.UNAUTHORIZED and self.account and not auth_retried:
+                    auth_retried = True
+                    incr('android.auth_retries')
+                    self.refresh_token(force=True)
+                    continue
+                if (delay := self._get_retry_delay(attempt, resp, idempotent=idempotent)) is None:
+                    return resp
+            attempt += 1
+            time.sleep(delay)
+
+
+class AsyncPlayPublisherClient(_BasePlayPublisherClient):
+    """
+    Same as `PlayPublisherClient` with an `httpx.AsyncClient`.
+    Clients created with `with_package` share the connection pool. Clients sharing a token cache refresh
+    the token of an account only once when concurrent requests are rejected.
+    """
+
+    def __init__(self,
+                 package_name: str,
+                 account: ServiceAccount | None = None,
+                 *,
+                 http: httpx.AsyncClient | None = None,
+                 timeout: float = DEFAULT_TIMEOUT,
+                 transport: TransportConfig | None = None,
+                 token: str | None = None,
+                 cache: TokenCache = token_cache):
+        super().__init__(package_name, account, token=token, cache=cache,
+                         transport=_get_transport(transport, timeout))
+        self._owns_http = http is None
+        self.http = http or httpx.AsyncClient(**self.transport.get_client_kwargs())
+
+    def with_package(self, package_name: str) -> 'AsyncPlayPublisherClient':
+        return self._copy_for(package_name, http=self.http)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.aclose()
+
+    async def aclose(self):
+        if self._owns_http:
+            await self.http.aclose()
+
+    async def fetch_access_token(self) -> Token:
+        resp = await self.http.post(TOKEN_URL, data=self._get_account().token_data,
+                                    timeout=self.transport.timeout)
+        return Token.from_response(resp.json())
+
+    async def refresh_token(self, force: bool = False) -> str:
+        async def _refresh() -> Token:
+            logger.info('Refreshing token...')
+            with span('android.token_refresh'):
+                _token = await self.fetch_access_token()
+            logger.info('Token refreshed !')
+            return _token
+
+        rejected = self.token if force else None
+        token = await self.cache.async_get_or_refresh(self._get_account().client_email, _refresh,
+                                                      rejected=rejected)
+        self.token = token.access_token
+        return self.token
+
+    async def ensure_token(self):
+        if self.account:
+            await self.refresh_token()
+
+    async def request(self, method: str, url: str, *,
+                      headers: dict | None = None,
+                      content: Content | None = None,
+                      upload: bool = False,
+                      idempotent: bool = True,
+                      **kwargs) -> httpx.Response:
+        await self.ensure_token()
+        kwargs = self._get_request_kwargs(upload, kwargs)
+        attempt, auth_retried = 0, False
+        while True:
+            try:
+                resp = await self.http.request(method, url, headers=self._get_headers(headers),
+                                               content=content, **kwargs)
+            except RETRYABLE_ERRORS as e:
+                if (delay := self._get_retry_delay(attempt, error=e, idempotent=idempotent)) is None:
+                    raise
+            else:
+                if resp.status_code == codes.UNAUTHORIZED and self.account and not auth_retried:
+                    auth_retried = True
+                    incr('android.auth_retries')
+                    await self.refresh_token(force=True)
+                    continue
+                if (delay := self._get_retry_delay(attempt, resp, idempotent=idempotent)) is None:
+                    return resp
+            attempt += 1
+            await asyncio.sleep(delay)
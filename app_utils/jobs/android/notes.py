@@ -0,0 +1,99 @@
+from dataclasses import dataclass
+from pathlib import Path
+
+from app_utils.jobs.changelog import load_changelog, Changelog, Release
+from app_utils.logs import logger
+from app_utils.metrics import span, incr
+from .client import PlayPublisherClient
+from .utils import check_response, fetch_insert_edit, fetch_commit
+
+
+@dataclass
+class NotesChange:
+    track: str
+    version: str
+    # Languages whose notes are added, changed or removed
+    languages: list[str]
+
+
+def fetch_list_tracks(client: PlayPublisherClient, edit_id: str):
+    resp = client.request('GET', f'{client.url}/edits/{edit_id}/tracks')
+    return resp
+
+
+def fetch_update_track(client: PlayPublisherClient, edit_id: str, track: dict):
+    resp = client.request('PUT', f'{client.url}/edits/{edit_id}/tracks/{track["track"]}', json=track)
+    return resp
+
+
+def _find_release(release: dict, changelog: Changelog) -> Release | None:
+    # The API returns the version codes as strings
+    for version_code in release.get('versionCodes', []):
+        if (_release := changelog.get_by_version_code(int(version_code))) is not None:
+            return _release
+    return None
+
+
+def _get_notes(release_notes: list[dict]) -> dict[str, str]:
+    return {x['language']: x['text'] for x in release_notes}
+
+
+def diff_release_notes(tracks: list[dict], changelog: Changelog) -> tuple[list[dict], list[NotesChange]]:
+    """
+    Compares the notes of the releases of `tracks` (from `edits.tracks.list`) with the changelog.
+    Returns the tracks to update, with the notes of their changed releases replaced, and the changes.
+    Releases that are not in the changelog are left untouched.
+    """
+    updated_tracks, changes = [], []
+    for track in tracks:
+        releases, changed = [], False
+        for release in track.get('releases', []):
+            if (version := _find_release(release, changelog)) is not None:
+                current = _get_notes(release.get('releaseNotes', []))
+                expected = _get_notes([x.data for x in version.release_notes])
+                if current != expected:
+                    languages = sorted(x for x in current.keys() | expected.keys() if current.get(x) != expected.get(x))
+                    changes.append(NotesChange(track['track'], version.version, languages))
+                    release = {**release, 'releaseNotes': [x.data for x in version.release_notes]}
+                    changed = True
+            releases.append(release)
+        if changed:
+            updated_tracks.append({**track, 'releases': releases})
+    return updated_tracks, changes
+
+
+def sync_release_notes(client: PlayPublisherClient,
+                       changelog: Path,
+                       tracks: list[str] | None = None,
+                       dry_run: bool = False) -> list[NotesChange]:
+    """
+    Sends the release notes of the changelog for every release on the tracks (all of them if `tracks` is None)
+    whose notes differ, in a single edit: the tracks are listed once and only the changed ones are updated.
+    Nothing is committed when no notes changed (or with `dry_run`).
+    """
+    _changelog = load_changelog(changelog)
+
+    with span('android.insert_edit'):
+        edit_id = check_response(fetch_insert_edit(client, 30))['id']
+    with span('android.list_tracks'):
+        current_tracks = check_response(fetch_list_tracks(client, edit_id)).get('tracks', [])
+    if tracks is not None:
+        current_tracks = [x for x in current_tracks if x['track'] in tracks]
+
+    updated_tracks, changes = diff_release_notes(current_tracks, _changelog)
+    for change in changes:
+        logger.info(f'{change.track}: release notes of {change.version} changed ({", ".join(change.languages)})')
+    if not changes:
+        logger.info('Release notes are up to date')
+        return changes
+    if dry_run:
+        return changes
+
+    for track in updated_tracks:
+        with span('android.patch_release'):
+            check_response(fetch_update_track(client, edit_id, track))
+    with span('android.commit'):
+        check_response(fetch_commit(client, edit_id))
+    incr('android.notes_synced', len(changes))
+    logger.info(f'Release notes sent for {len(changes)} release(s) on {len(updated_tracks)} track(s) !')
+    return changes
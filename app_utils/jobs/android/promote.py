@@ -0,0 +1,109 @@
+import json
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import get_args
+
+from app_utils.jobs.changelog import get_last_release
+from app_utils.logs import logger
+from app_utils.metrics import span
+from .client import PlayPublisherClient
+from .utils import (Track, Status, Release, UploadFailedException, DEFAULT_COUNTRIES, check_response,
+                    fetch_insert_edit, fetch_patch_release, fetch_commit)
+
+
+@dataclass
+class TrackRollout:
+    """
+    Entry of the rollout config, see `load_rollout`
+    """
+    track: Track
+    status: Status = Status.completed
+    user_fraction: float | None = None
+    countries: list[str] | None = field(default_factory=lambda: list(DEFAULT_COUNTRIES))
+
+
+@dataclass
+class Rollout:
+    tracks: list[TrackRollout]
+    # Defaults to the version code of the last changelog release
+    version_codes: list[int] | None = None
+
+
+def load_rollout(path: Path) -> Rollout:
+    """
+    Loads a JSON rollout config of the form:
+        {
+            "version_codes": [1010004],
+            "tracks": [
+                {"track": "internal"},
+                {"track": "beta", "countries": ["France", "Belgium"]},
+                {"track": "production", "status": "in_progress", "user_fraction": 0.1, "countries": null}
+            ]
+        }
+    `status` is the name of a `Status` (defaults to completed), in_progress and halted releases require
+    a `user_fraction` between 0 and 1. `countries` defaults to `DEFAULT_COUNTRIES` and `null` makes the release
+    available in every country.
+    """
+    data = json.loads(path.read_text())
+    tracks = []
+    for x in data['tracks']:
+        if x['track'] not in get_args(Track):
+            raise ValueError(f'Unknown track {x["track"]!r}, expected one of {", ".join(get_args(Track))}')
+        try:
+            status = Status[x.get('status', Status.completed.name)]
+        except KeyError:
+            raise ValueError(f'Unknown status {x["status"]!r} for track {x["track"]!r}, '
+                             f'expected one of {", ".join(Status.__members__)}') from None
+        user_fraction = x.get('user_fraction')
+        if status in (Status.in_progress, Status.halted):
+            if user_fraction is None:
+                raise ValueError(f'user_fraction is required by the {status.name} status (track {x["track"]!r})')
+            if not 0 < user_fraction < 1:
+                raise ValueError(f'user_fraction must be between 0 and 1 (track {x["track"]!r})')
+        elif user_fraction is not None:
+            raise ValueError(f'user_fraction requires an in_progress or halted status (track {x["track"]!r})')
+        tracks.append(TrackRollout(track=x['track'],
+                                   status=status,
+                                   user_fraction=user_fraction,
+                                   countries=x.get('countries', DEFAULT_COUNTRIES)))
+    if len({x.track for x in tracks}) != len(tracks):
+        raise ValueError('Each track can only be updated once')
+    return Rollout(tracks=tracks, version_codes=data.get('version_codes'))
+
+
+def promote(client: PlayPublisherClient,
+            rollout: Rollout,
+            changelog: Path,
+            edit_id: str | None = None) -> str:
+    """
+    Updates every track of the rollout with the last release of the changelog in a single edit,
+    committed once all the tracks are updated. Returns the edit id.
+    """
+    last_release = get_last_release(changelog)
+
+    if not edit_id:
+        with span('android.insert_edit'):
+            _edit_id = check_response(fetch_insert_edit(client, 30))['id']
+        logger.info(f'Edit created with id {_edit_id!r}')
+    else:
+        _edit_id = edit_id
+
+    for track in rollout.tracks:
+        release = Release(track.track, last_release,
+                          status=track.status,
+                          version_codes=rollout.version_codes,
+                          user_fraction=track.user_fraction,
+                          countries=track.countries)
+        with span('android.patch_release'):
+            try:
+                check_response(fetch_patch_release(client, _edit_id, release))
+            except UploadFailedException as e:
+                raise UploadFailedException(f'{track.track}: {e.message}', e.status_code) from e
+        logger.info(f'Track {track.track} updated (status: {track.status.name}'
+                    f'{f", user fraction: {track.user_fraction}" if track.user_fraction is not None else ""})')
+
+    with span('android.commit'):
+        check_response(fetch_commit(client, _edit_id))
+
+    logger.info(f'Release {last_release.version} promoted to {", ".join(x.track for x in rollout.tracks)} !')
+    return _edit_id
@@ -1,15 +1,29 @@
+import asyncio
 import sys
 from pathlib import Path
 
-import httpx
 from piou import CommandGroup, Option
+from rich.console import Console
+from rich.table import Table
 
 from app_utils.logs import logger
-from .utils import upload_bundle, Track, UploadFailedException, init_token
+from .client import PlayPublisherClient, AsyncPlayPublisherClient, ServiceAccount, get_shared_http
+from .transport import TransportConfig
+from .notes import sync_release_notes
+from .promote import load_rollout, promote
+from .upload_many import load_manifest, upload_packages, publish, Artifact, UploadResult, DEFAULT_CONCURRENCY
+from .utils import upload_bundle, Track, UploadFailedException
 
 android_group = CommandGroup('android')
 
 
+def get_transport(timeout: int, upload_timeout: int, http2: bool, max_connections: int = 10) -> TransportConfig:
+    return TransportConfig(read_timeout=timeout, write_timeout=timeout,
+                           upload_read_timeout=upload_timeout, upload_write_timeout=upload_timeout,
+                           max_connections=max_connections, max_keepalive_connections=max_connections,
+                           http2=http2)
+
+
 @android_group.command('upload')
 def run_upload(
         package_name: str = Option(..., '--package',
@@ -21,16 +35,159 @@ def run_upload(
         skip_upload: bool = Option(False, '--no-upload', help='Skips the bundle upload'),
         changelog_path: Path = Option(..., '--changelog', help='Path to the CHANGELOG file'),
         track: Track = Option(..., '--track', help='Track to upload to'),
-        timeout: int = Option(60, '--timeout', help='Fetch timeout')
+        timeout: int = Option(60, '--timeout', help='Fetch timeout'),
+        upload_timeout: int = Option(600, '--upload-timeout', help='Read / write timeout of the uploads'),
+        http2: bool = Option(False, '--http2', help='Uses HTTP/2 (requires the h2 package)'),
+        resumable: bool = Option(False, '--resumable',
+                                 help='Uploads the bundle in chunks and resumes interrupted uploads'),
+        chunk_size: int = Option(8, '--chunk-size', help='Chunk size in MiB (resumable upload only)')
 ):
-    with httpx.Client(timeout=timeout) as client:
-        init_token(client, package_name, config)
+    account = ServiceAccount.from_file(config) if config else None
+    transport = get_transport(timeout, upload_timeout, http2)
+    with PlayPublisherClient(package_name, account, http=get_shared_http(transport), transport=transport) as client:
         try:
             upload_bundle(client, path=bundle_path,
                           changelog=changelog_path,
                           track=track,
                           edit_id=edit_id,
-                          skip_upload=skip_upload)
+                          skip_upload=skip_upload,
+                          resumable=resumable,
+                          chunk_size=chunk_size * 1024 * 1024)
         except UploadFailedException as e:
             logger.error(f'Upload failed. {e.message} (code: {e.status_code})')
             sys.exit(-1)
+
+
+def print_upload_results(results: list[UploadResult]):
+    table = Table('Package', 'Version codes', 'Edit', 'Duration', 'Status')
+    for result in results:
+        table.add_row(result.package_name,
+                      ', '.join(str(x) for x in result.version_codes),
+                      result.edit_id or '',
+                      f'{result.duration:.1f}s',
+                      '[green]OK[/green]' if result.ok else f'[red]{result.error}[/red]')
+    Console().print(table)
+
+
+@android_group.command('upload-many')
+def run_upload_many(
+        manifest: Path = Option(..., '-m', '--manifest', help='Path to the JSON manifest listing the packages to publish'),
+        config: Path | None = Option(None, '--config', help='Path to the JSON config file'),
+        concurrency: int = Option(DEFAULT_CONCURRENCY, '-j', '--concurrency',
+                                  help='Maximum number of packages published at the same time'),
+        timeout: int = Option(60, '--timeout', help='Fetch timeout'),
+        upload_timeout: int = Option(600, '--upload-timeout', help='Read / write timeout of the uploads'),
+        http2: bool = Option(False, '--http2', help='Uses HTTP/2 (requires the h2 package)')
+):
+    """
+    Publishes several packages concurrently, each one in its own edit
+    """
+
+    account = ServiceAccount.from_file(config) if config else None
+    # The packages share the connection pool, each one uploads its bundles concurrently
+    transport = get_transport(timeout, upload_timeout, http2, max_connections=max(concurrency * 4, 10))
+
+    async def _run():
+        # The client is only used as a template for the clients of each package
+        async with AsyncPlayPublisherClient('', account, transport=transport) as client:
+            return await upload_packages(client, load_manifest(manifest), concurrency=concurrency)
+
+    results = asyncio.run(_run())
+    print_upload_results(results)
+    if not all(x.ok for x in results):
+        sys.exit(-1)
+
+
+@android_group.command('publish')
+def run_publish(
+        package_name: str = Option(..., '--package', help='Package Name (eg: com.myapp)'),
+        config: Path | None = Option(None, '--config', help='Path to the JSON config file'),
+        bundle_paths: list[Path] = Option(..., '-p', '--path', help='Path(s) of the bundle(s) to upload'),
+        mappings: list[Path] | None = Option(None, '--mapping',
+                                             help='ProGuard / R8 mapping file of each bundle (same order as --path)'),
+        native_symbols: list[Path] | None = Option(None, '--native-symbols',
+                                                   help='Native debug symbols of each bundle (same order as --path)'),
+        changelog_path: Path = Option(..., '--changelog', help='Path to the CHANGELOG file'),
+        track: Track = Option(..., '--track', help='Track to upload to'),
+        timeout: int = Option(60, '--timeout', help='Fetch timeout'),
+        upload_timeout: int = Option(600, '--upload-timeout', help='Read / write timeout of the uploads'),
+        http2: bool = Option(False, '--http2', help='Uses HTTP/2 (requires the h2 package)'),
+):
+    """
+    Uploads the bundles and their deobfuscation files concurrently into a single edit, then updates the track
+    and commits. The changelog is parsed and the bundles hashed while the edit is being created.
+    """
+    for name, paths in (('--mapping', mappings), ('--native-symbols', native_symbols)):
+        if paths and len(paths) != len(bundle_paths):
+            logger.error(f'Expected one {name} file per bundle ({len(bundle_paths)}), got {len(paths)}')
+            sys.exit(1)
+
+    artifacts = [Artifact(bundle,
+                          mapping=mappings[i] if mappings else None,
+                          native_symbols=native_symbols[i] if native_symbols else None)
+                 for i, bundle in enumerate(bundle_paths)]
+    account = ServiceAccount.from_file(config) if config else None
+    transport = get_transport(timeout, upload_timeout, http2)
+
+    async def _run():
+        async with AsyncPlayPublisherClient(package_name, account, transport=transport) as client:
+            return await publish(client, artifacts, changelog_path, track)
+
+    result = asyncio.run(_run())
+    print_upload_results([result])
+    if not result.ok:
+        sys.exit(-1)
+
+
+@android_group.command('promote')
+def run_promote(
+        package_name: str = Option(..., '--package', help='Package Name (eg: com.myapp)'),
+        config: Path | None = Option(None, '--config', help='Path to the JSON config file'),
+        rollout_path: Path = Option(..., '-r', '--rollout',
+                                    help='Path to the JSON config of the tracks to update (status, user fraction, '
+                                         'countries)'),
+        changelog_path: Path = Option(..., '--changelog', help='Path to the CHANGELOG file'),
+        edit_id: str | None = Option(None, '--edit-id',
+                                     help="Edit ID for the release, if not specified, a new one will be generated"),
+        timeout: int = Option(60, '--timeout', help='Fetch timeout'),
+):
+    """
+    Releases the last version of the changelog on several tracks within a single edit and commit
+    """
+    try:
+        rollout = load_rollout(rollout_path)
+    except (ValueError, KeyError) as e:
+        logger.error(f'Invalid rollout config {rollout_path}: {e}')
+        sys.exit(1)
+
+    account = ServiceAccount.from_file(config) if config else None
+    transport = TransportConfig(read_timeout=timeout, write_timeout=timeout)
+    with PlayPublisherClient(package_name, account, http=get_shared_http(transport), transport=transport) as client:
+        try:
+            promote(client, rollout, changelog_path, edit_id=edit_id)
+        except UploadFailedException as e:
+            logger.error(f'Promotion failed. {e.message} (code: {e.status_code})')
+            sys.exit(-1)
+
+
+@android_group.command('sync-notes')
+def run_sync_notes(
+        package_name: str = Option(..., '--package', help='Package Name (eg: com.myapp)'),
+        config: Path | None = Option(None, '--config', help='Path to the JSON config file'),
+        changelog_path: Path = Option(..., '--changelog', help='Path to the CHANGELOG file'),
+        tracks: list[str] | None = Option(None, '--tracks', help='Tracks to update (default: all)'),
+        dry_run: bool = Option(False, '--dry-run', help='Only prints the releases whose notes changed'),
+        timeout: int = Option(60, '--timeout', help='Fetch timeout'),
+):
+    """
+    Sends the release notes of the changelog for the releases already on the tracks, only updating
+    the releases whose notes changed, in a single edit
+    """
+    account = ServiceAccount.from_file(config) if config else None
+    transport = TransportConfig(read_timeout=timeout, write_timeout=timeout)
+    with PlayPublisherClient(package_name, account, http=get_shared_http(transport), transport=transport) as client:
+        try:
+            sync_release_notes(client, changelog_path, tracks=tracks, dry_run=dry_run)
+        except UploadFailedException as e:
+            logger.error(f'Sync failed. {e.message} (code: {e.status_code})')
+            sys.exit(-1)
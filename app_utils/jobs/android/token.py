@@ -0,0 +1,160 @@
+import asyncio
+import fcntl
+import json
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from json import JSONDecodeError
+from pathlib import Path
+from typing import Callable, Awaitable, Iterator
+
+TOKEN_FILE = Path.home() / '.android_play_api'
+
+# Tokens are refreshed when they expire in less than `EXPIRY_MARGIN` seconds
+EXPIRY_MARGIN = 120
+
+
+@dataclass
+class Token:
+    access_token: str
+    expires_at: float
+
+    def is_valid(self, margin: float = EXPIRY_MARGIN) -> bool:
+        return self.expires_at - margin > time.time()
+
+    @classmethod
+    def from_response(cls, data: dict) -> 'Token':
+        """
+        Creates a token from the response of https://oauth2.googleapis.com/token
+        """
+        return cls(access_token=data['access_token'],
+                   expires_at=time.time() + int(data.get('expires_in', 3600)))
+
+
+class TokenCache:
+    """
+    Access tokens keyed by service account (client email), kept in memory and stored in `path`.
+    Refreshes hold an exclusive lock on `<path>.lock` so that concurrent processes
+    sharing the same account only refresh the token once.
+    """
+
+    def __init__(self, path: Path = TOKEN_FILE):
+        self.path = path
+        self._tokens: dict[str, Token] = {}
+        self._lock = threading.Lock()
+        # Serializes the async refreshes, asyncio locks are bound to their event loop
+        self._async_locks: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Lock] = \
+            weakref.WeakKeyDictionary()
+
+    @property
+    def lock_path(self) -> Path:
+        return self.path.with_name(f'{self.path.name}.lock')
+
+    @contextmanager
+    def _file_lock(self, shared: bool = False) -> Iterator[None]:
+        with open(self.lock_path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read(self) -> dict[str, Token]:
+        if not self.path.exists():
+            return {}
+        try:
+            data = json.loads(self.path.read_text())
+        except JSONDecodeError:
+            # Tokens stored by older versions (bare token without expiry)
+            return {}
+        return {account: Token(**token) for account, token in data.items()}
+
+    def _write(self, tokens: dict[str, Token]):
+        tmp_path = self.path.with_name(f'{self.path.name}.tmp')
+        tmp_path.write_text(json.dumps({account: asdict(token) for account, token in tokens.items()}))
+        tmp_path.chmod(0o600)
+        tmp_path.replace(self.path)
+
+    def get(self, account: str | None) -> Token | None:
+        """
+        Returns a valid token for `account` (or for any account if `account` is None)
+        """
+        if account and (token := self._tokens.get(account)) and token.is_valid():
+            return token
+        if self.path.exists():
+            with self._file_lock(shared=True):
+                self._tokens.update(self._read())
+        if account is None:
+            return next((x for x in self._tokens.values() if x.is_valid()), None)
+        token = self._tokens.get(account)
+        return token if token and token.is_valid() else None
+
+    def _store(self, account: str, token: Token):
+        tokens = self._read()
+        tokens[account] = token
+        self._write(tokens)
+        self._tokens[account] = token
+
+    def _get_usable(self, account: str, rejected: str | None, from_file: bool = False) -> Token | None:
+        token = self._read().get(account) if from_file else self._tokens.get(account)
+        if token and token.is_valid() and token.access_token != rejected:
+            self._tokens[account] = token
+            return token
+        return None
+
+    def get_or_refresh(self,
+                       account: str,
+                       refresh: Callable[[], Token],
+                       rejected: str | None = None) -> Token:
+        """
+        Returns the cached token of `account`, calling `refresh` if it is missing, about to expire
+        or equal to `rejected` (a token refused by the API)
+        """
+        if token := self._get_usable(account, rejected):
+            return token
+        with self._lock, self._file_lock():
+            # Another process may have refreshed the token while we were waiting for the lock
+            if token := self._get_usable(account, rejected, from_file=True):
+                return token
+            token = refresh()
+            self._store(account, token)
+            return token
+
+    def _get_async_lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if (lock := self._async_locks.get(loop)) is None:
+            lock = self._async_locks[loop] = asyncio.Lock()
+        return lock
+
+    def _read_usable(self, account: str, rejected: str | None) -> Token | None:
+        with self._file_lock(shared=True):
+            return self._get_usable(account, rejected, from_file=True)
+
+    def _store_locked(self, account: str, token: Token):
+        with self._file_lock():
+            self._store(account, token)
+
+    async def async_get_or_refresh(self,
+                                   account: str,
+                                   refresh: Callable[[], Awaitable[Token]],
+                                   rejected: str | None = None) -> Token:
+        """
+        Same as `get_or_refresh` with an async `refresh`, serialized by a lock of the cache shared by all the
+        clients of the event loop. The file lock is only taken in threads and never held while `refresh` runs:
+        concurrent processes may both refresh the token of an account.
+        """
+        if token := self._get_usable(account, rejected):
+            return token
+        async with self._get_async_lock():
+            # Another coroutine (or process) may have refreshed the token while we were waiting for the lock
+            if token := self._get_usable(account, rejected):
+                return token
+            if token := await asyncio.to_thread(self._read_usable, account, rejected):
+                return token
+            token = await refresh()
+            await asyncio.to_thread(self._store_locked, account, token)
+            return token
+
+token_cache = TokenCache()
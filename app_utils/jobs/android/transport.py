@@ -0,0 +1,100 @@
+import importlib.util
+import random
+import time
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+
+import httpx
+from httpx import codes
+
+DEFAULT_TIMEOUT = 60
+
+# Errors after which the request can be sent again (connection reset, timeout...)
+RETRYABLE_ERRORS = (httpx.NetworkError, httpx.TimeoutException, httpx.RemoteProtocolError)
+# Errors raised before the request was sent, the only ones after which a non idempotent request is sent again
+UNSENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+@dataclass
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter on `statuses` and connection errors.
+    The `Retry-After` header of the response is used when present (capped to `max_delay`).
+    """
+    max_retries: int = 5
+    backoff_base: float = 1
+    max_delay: float = 120
+    statuses: frozenset[int] = frozenset({codes.TOO_MANY_REQUESTS, codes.INTERNAL_SERVER_ERROR,
+                                          codes.BAD_GATEWAY, codes.SERVICE_UNAVAILABLE, codes.GATEWAY_TIMEOUT})
+
+    def is_retryable(self, resp: httpx.Response) -> bool:
+        return resp.status_code in self.statuses
+
+    def get_delay(self, attempt: int, resp: httpx.Response | None = None) -> float:
+        """
+        Seconds to wait before the retry number `attempt` (starting at 0)
+        """
+        if resp is not None and (retry_after := _parse_retry_after(resp.headers.get('Retry-After'))) is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.backoff_base * 2 ** attempt))
+
+    def get_retry_delay(self, attempt: int, resp: httpx.Response | None = None) -> float | None:
+        """
+        Returns the delay before retrying a request that failed (with `resp`, or a connection error if None),
+        or None if it should not be retried
+        """
+        if attempt >= self.max_retries or (resp is not None and not self.is_retryable(resp)):
+            return None
+        return self.get_delay(attempt, resp)
+
+
+def _parse_retry_after(value: str | None) -> float | None:
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass
+class TransportConfig:
+    """
+    Connection pool, timeouts (s) and retry policy of the Play Publisher clients.
+    Uploads use longer read / write timeouts than the metadata calls.
+    HTTP/2 requires the `h2` package (pip install httpx[http2]).
+    """
+    connect_timeout: float = 10
+    read_timeout: float = DEFAULT_TIMEOUT
+    write_timeout: float = DEFAULT_TIMEOUT
+    pool_timeout: float = 30
+    upload_read_timeout: float = 300
+    upload_write_timeout: float = 600
+    max_connections: int = 10
+    max_keepalive_connections: int = 5
+    http2: bool = False
+    retry: RetryPolicy = field(default_factory=RetryPolicy)
+
+    @property
+    def timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(connect=self.connect_timeout, read=self.read_timeout,
+                             write=self.write_timeout, pool=self.pool_timeout)
+
+    @property
+    def upload_timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(connect=self.connect_timeout, read=self.upload_read_timeout,
+                             write=self.upload_write_timeout, pool=self.pool_timeout)
+
+    @property
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(max_connections=self.max_connections,
+                            max_keepalive_connections=self.max_keepalive_connections)
+
+    def get_client_kwargs(self) -> dict:
+        if self.http2 and importlib.util.find_spec('h2') is None:
+            raise ImportError('Please install httpx[http2] to use HTTP/2')
+        return {'timeout': self.timeout, 'limits': self.limits, 'http2': self.http2}
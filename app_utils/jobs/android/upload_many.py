@@ -0,0 +1,335 @@
+import asyncio
+import json
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Awaitable, Literal, TypeVar
+from uuid import uuid4
+
+import httpx
+from httpx import codes
+
+from app_utils.jobs.changelog import get_last_release
+from app_utils.logs import logger
+from app_utils.metrics import span, incr
+from app_utils.utils import get_file_hash
+from .client import AsyncPlayPublisherClient
+from .utils import (Track, Release, UploadFailedException, DEFAULT_CHUNK_SIZE, check_response,
+                    find_uploaded_bundle, get_upload_offset, raise_for_chunk)
+
+DEFAULT_CONCURRENCY = 4
+
+# See https://developers.google.com/android-publisher/api-ref/rest/v3/edits.deobfuscationfiles
+DeobfuscationFileType = Literal['proguard', 'nativeCode']
+
+T = TypeVar('T')
+
+
+@dataclass
+class Artifact:
+    """
+    Bundle to upload, with its ProGuard / R8 mapping and native debug symbols
+    """
+    bundle: Path
+    mapping: Path | None = None
+    native_symbols: Path | None = None
+
+    @property
+    def deobfuscation_files(self) -> list[tuple[DeobfuscationFileType, Path]]:
+        files: tuple[tuple[DeobfuscationFileType, Path | None], ...] = (('proguard', self.mapping),
+                                                                        ('nativeCode', self.native_symbols))
+        return [(file_type, path) for file_type, path in files if path is not None]
+
+
+@dataclass
+class PackageUpload:
+    """
+    Entry of the upload manifest, see `load_manifest`
+    """
+    package_name: str
+    bundles: list[Path]
+    changelog: Path
+    track: Track
+
+
+@dataclass
+class UploadResult:
+    package_name: str
+    version_codes: list[int] = field(default_factory=list)
+    edit_id: str | None = None
+    error: str | None = None
+    duration: float = 0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def load_manifest(path: Path) -> list[PackageUpload]:
+    """
+    Loads a JSON manifest of the form:
+        {
+            "packages": [
+                {"package": "com.myapp", "bundles": ["app.aab"], "changelog": "CHANGELOG.md", "track": "internal"}
+            ]
+        }
+    Relative paths are resolved from the manifest folder.
+    """
+    data = json.loads(path.read_text())
+    return [PackageUpload(package_name=x['package'],
+                          bundles=[path.parent / _bundle for _bundle in x['bundles']],
+                          changelog=path.parent / x['changelog'],
+                          track=x['track'])
+            for x in data['packages']]
+
+
+async def async_fetch_insert_edit(client: AsyncPlayPublisherClient, expiry: int = 60 * 10):
+    resp = await client.request('POST', f'{client.url}/edits', json={
+        'id': str(uuid4()),
+        'expiryTimeSeconds': expiry
+    })
+    return resp
+
+
+async def async_fetch_start_resumable_upload(client: AsyncPlayPublisherClient, url: str, size: int):
+    resp = await client.request('POST', url,
+                                params={'uploadType': 'resumable'},
+                                headers={'X-Upload-Content-Type': 'application/octet-stream',
+                                         'X-Upload-Content-Length': str(size)})
+    return resp
+
+
+async def async_fetch_upload_status(client: AsyncPlayPublisherClient, session_uri: str, size: int):
+    # The session URI identifies the upload, no token is required
+    resp = await client.http.put(session_uri, headers={'Content-Range': f'bytes */{size}'},
+                                 timeout=client.transport.timeout)
+    return resp
+
+
+async def async_fetch_upload_chunk(client: AsyncPlayPublisherClient,
+                                   session_uri: str,
+                                   chunk: bytes,
+                                   offset: int,
+                                   size: int):
+    resp = await client.http.put(session_uri,
+                                 headers={'Content-Type': 'application/octet-stream',
+                                          'Content-Range': f'bytes {offset}-{offset + len(chunk) - 1}/{size}'},
+                                 content=chunk,
+                                 timeout=client.transport.upload_timeout)
+    return resp
+
+
+def _read_chunk(path: Path, offset: int, size: int) -> bytes:
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+async def async_fetch_upload_resumable(client: AsyncPlayPublisherClient,
+                                       url: str,
+                                       path: Path,
+                                       chunk_size: int = DEFAULT_CHUNK_SIZE,
+                                       max_retries: int | None = None) -> httpx.Response:
+    """
+    Uploads the file to `url` (a media upload endpoint) with the resumable protocol, in chunks of `chunk_size`
+    bytes read in threads so that they do not block the other uploads.
+    Same retries as `fetch_upload_bundle_resumable`: a failed chunk is sent again from the last byte acknowledged
+    by the server, never the whole file. The session is not stored since `publish` always uses a new edit.
+    """
+    if max_retries is None:
+        max_retries = client.transport.retry.max_retries
+    size = path.stat().st_size
+    resp = await async_fetch_start_resumable_upload(client, url, size)
+    if resp.status_code != codes.OK:
+        return resp
+    session_uri = resp.headers['Location']
+
+    offset, retries = 0, 0
+    check_status = False
+    while True:
+        try:
+            if check_status:
+                resp = await async_fetch_upload_status(client, session_uri, size)
+            else:
+                chunk = await asyncio.to_thread(_read_chunk, path, offset, chunk_size)
+                resp = await async_fetch_upload_chunk(client, session_uri, chunk, offset, size)
+                incr('android.bytes_uploaded', len(chunk))
+            raise_for_chunk(client.transport.retry, resp, offset, sent_chunk=not check_status)
+        except (httpx.TransportError, httpx.HTTPStatusError) as e:
+            if retries >= max_retries:
+                raise
+            delay = client.transport.retry.get_delay(
+                retries, e.response if isinstance(e, httpx.HTTPStatusError) else None)
+            retries += 1
+            incr('android.upload_retries')
+            logger.warning(f'[{client.package_name}] Chunk upload of {path} failed ({e}), '
+                           f'retrying in {delay:.1f}s ({retries}/{max_retries})...')
+            await asyncio.sleep(delay)
+            # Asking the server how many bytes it received before sending the next chunk
+            check_status = True
+            continue
+
+        check_status = False
+        if resp.status_code != codes.PERMANENT_REDIRECT:
+            return resp
+        acknowledged = get_upload_offset(resp)
+        if acknowledged > offset:
+            retries = 0
+        offset = acknowledged
+
+
+async def async_fetch_upload_bundle(client: AsyncPlayPublisherClient,
+                                    edit_id: str,
+                                    bundle_path: Path):
+    resp = await async_fetch_upload_resumable(client, f'{client.upload_url}/edits/{edit_id}/bundles', bundle_path)
+    return resp
+
+
+async def async_fetch_list_bundles(client: AsyncPlayPublisherClient, edit_id: str):
+    resp = await client.request('GET', f'{client.url}/edits/{edit_id}/bundles')
+    return resp
+
+
+async def async_fetch_upload_deobfuscation_file(client: AsyncPlayPublisherClient,
+                                                edit_id: str,
+                                                version_code: int,
+                                                file_type: DeobfuscationFileType,
+                                                path: Path):
+    resp = await async_fetch_upload_resumable(client, f'{client.upload_url}/edits/{edit_id}/apks/{version_code}'
+                                                      f'/deobfuscationFiles/{file_type}', path)
+    return resp
+
+
+async def async_fetch_patch_release(client: AsyncPlayPublisherClient, edit_id: str, release: Release):
+    resp = await client.request('PUT', f'{client.url}/edits/{edit_id}/tracks/{release.track}',
+                                json=release.data)
+    return resp
+
+
+async def async_fetch_commit(client: AsyncPlayPublisherClient, edit_id: str):
+    resp = await client.request('POST', f'{client.commit_url}/edits/{edit_id}:commit', idempotent=False)
+    return resp
+
+
+async def _gather(*aws: Awaitable[T]) -> list[T]:
+    """
+    Same as `asyncio.gather`, cancelling the other tasks as soon as one of them fails
+    """
+    tasks = [asyncio.ensure_future(x) for x in aws]
+    try:
+        return list(await asyncio.gather(*tasks))
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+async def _upload_artifact(client: AsyncPlayPublisherClient,
+                           edit_id: str,
+                           artifact: Artifact,
+                           bundle_hash: Awaitable[str],
+                           bundles: list[dict]) -> int:
+    expected_hash = await bundle_hash
+    if data := find_uploaded_bundle(bundles, expected_hash):
+        logger.info(f'[{client.package_name}] {artifact.bundle} already uploaded (version: {data["versionCode"]}), '
+                    f'skipping the upload')
+        incr('android.uploads_skipped')
+    else:
+        logger.info(f'[{client.package_name}] Starting upload of {artifact.bundle!r} ...')
+        with span('android.upload'):
+            data = check_response(await async_fetch_upload_bundle(client, edit_id, artifact.bundle))
+        # The API returns the SHA-256 of the bundle it received
+        if data.get('sha256', expected_hash) != expected_hash:
+            raise ValueError(f'{artifact.bundle} was corrupted during the upload (sha256: {data["sha256"]})')
+
+    # The deobfuscation files are attached to the version code of the bundle
+    version_code = data['versionCode']
+    with span('android.upload_deobfuscation_files'):
+        for resp in await _gather(*[async_fetch_upload_deobfuscation_file(client, edit_id, version_code,
+                                                                          file_type, path)
+                                    for file_type, path in artifact.deobfuscation_files]):
+            check_response(resp)
+    return version_code
+
+
+async def publish(client: AsyncPlayPublisherClient,
+                  artifacts: list[Artifact],
+                  changelog: Path,
+                  track: Track) -> UploadResult:
+    """
+    Publishes the artifacts in a single edit, overlapping the steps that do not depend on each other:
+     - the changelog is parsed and the bundles hashed in threads while the token is refreshed and the edit created
+     - the bundles are uploaded concurrently (unless already on the Play Console), each one followed
+       by its deobfuscation files (resumable uploads, see `async_fetch_upload_resumable`)
+     - the track is updated once every upload is done, then the edit is committed
+    Any failure cancels the pending steps. `client` must be bound to the package.
+    """
+    result = UploadResult(client.package_name)
+    start = time.perf_counter()
+    hashes = [asyncio.ensure_future(asyncio.to_thread(get_file_hash, x.bundle)) for x in artifacts]
+
+    async def _parse_changelog():
+        with span('changelog.parse'):
+            return await asyncio.to_thread(get_last_release, changelog)
+
+    edit_id = ''
+
+    async def _upload():
+        nonlocal edit_id
+        with span('android.insert_edit'):
+            data = check_response(await async_fetch_insert_edit(client, 30))
+        edit_id = result.edit_id = data['id']
+        logger.info(f'[{client.package_name}] Edit created with id {edit_id!r}, track: {track}')
+        # Bundles already on the Play Console (when a release is retried) are not uploaded again
+        with span('android.list_bundles'):
+            bundles = check_response(await async_fetch_list_bundles(client, edit_id)).get('bundles', [])
+        result.version_codes = await _gather(*[_upload_artifact(client, edit_id, artifact, bundle_hash, bundles)
+                                               for artifact, bundle_hash in zip(artifacts, hashes)])
+
+    last_release_task = asyncio.ensure_future(_parse_changelog())
+    try:
+        await _gather(last_release_task, _upload())
+        last_release = last_release_task.result()
+        release = Release(track, last_release, version_codes=result.version_codes)
+        with span('android.patch_release'):
+            check_response(await async_fetch_patch_release(client, edit_id, release))
+        with span('android.commit'):
+            check_response(await async_fetch_commit(client, edit_id))
+        logger.info(f'[{client.package_name}] Release {last_release.version} sent !')
+    except UploadFailedException as e:
+        result.error = f'{e.message} (code: {e.status_code})'
+    except Exception as e:
+        # Reported in the summary instead of aborting the other packages (unexpected responses, token errors...)
+        logger.debug(f'[{client.package_name}] Publish failed', exc_info=True)
+        result.error = f'{type(e).__name__}: {e}' if str(e) else type(e).__name__
+    finally:
+        for task in [last_release_task, *hashes]:
+            task.cancel()
+    result.duration = time.perf_counter() - start
+    return result
+
+
+async def upload_package(client: AsyncPlayPublisherClient, upload: PackageUpload) -> UploadResult:
+    """
+    Runs a full edit lifecycle (insert, upload of every bundle, track update and commit) for one package
+    `client` must be bound to the package (see `AsyncPlayPublisherClient.with_package`)
+    """
+    return await publish(client, [Artifact(x) for x in upload.bundles], upload.changelog, upload.track)
+
+
+async def upload_packages(client: AsyncPlayPublisherClient,
+                          uploads: list[PackageUpload],
+                          concurrency: int = DEFAULT_CONCURRENCY) -> list[UploadResult]:
+    """
+    Publishes every package concurrently, at most `concurrency` at a time.
+    Packages share the connection pool and the token of `client`.
+    Results are returned in the order of `uploads`.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _upload(upload: PackageUpload):
+        async with semaphore:
+            return await upload_package(client.with_package(upload.package_name), upload)
+
+    return list(await asyncio.gather(*[_upload(x) for x in uploads]))
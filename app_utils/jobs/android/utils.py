@@ -1,31 +1,26 @@
-import functools
 import json
 import time
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum
 from json import JSONDecodeError
 from pathlib import Path
-from typing import Callable, ParamSpec, Concatenate, Literal
+from typing import Literal
 from uuid import uuid4
 
 import httpx
-import jwt
 from httpx import codes
 
-from app_utils.jobs.changelog import parse_markdown, Release as _Release
+from app_utils.jobs.changelog import get_last_release, Release as _Release
 from app_utils.logs import logger
+from app_utils.metrics import span, incr
+from app_utils.utils import get_file_hash
+from .client import PlayPublisherClient
+from .transport import RetryPolicy
 
-TOKEN_FILE = Path.home() / '.android_play_api'
-
-# https://developers.google.com/identity/protocols/oauth2/scopes#androidpublisher
-SCOPE = 'https://www.googleapis.com/auth/androidpublisher'
-CLIENT_EMAIL = None
-PRIVATE_KEY_ID_FROM_JSON = None
-PRIVATE_KEY_FROM_JSON = None
-
-URL = 'https://www.googleapis.com/androidpublisher/v3/applications/{PACKAGE_NAME}'
-UPLOAD_URL = 'https://www.googleapis.com/upload/androidpublisher/v3/applications/{PACKAGE_NAME}'
-COMMIT_URL = 'https://androidpublisher.googleapis.com/androidpublisher/v3/applications/{PACKAGE_NAME}'
+# Resumable chunks must be a multiple of 256 KiB
+# See https://developers.google.com/android-publisher/upload#resumable
+CHUNK_ALIGNMENT = 256 * 1024
+DEFAULT_CHUNK_SIZE = 32 * CHUNK_ALIGNMENT
 
 
 class UploadFailedException(Exception):
@@ -34,8 +29,21 @@ class UploadFailedException(Exception):
         self.status_code = status_code
 
 
+def check_response(resp: httpx.Response) -> dict:
+    """
+    Returns the JSON of the response, raises an `UploadFailedException` with the API error if it failed
+    """
+    data = resp.json()
+    # Resumable uploads may complete with `201 Created`
+    if resp.status_code not in (codes.OK, codes.CREATED):
+        raise UploadFailedException(data['error']['message'], resp.status_code)
+    return data
+
+
 Track = Literal['alpha', 'beta', 'internal', 'production']
 
+DEFAULT_COUNTRIES = ['France']
+
 
 class Status(Enum):
     unspecified = 'STATUS_UNSPECIFIED'
@@ -50,22 +58,28 @@ class Release:
     track: Track
     release: _Release
     status: Status = Status.completed
+    # Version codes of the uploaded bundles, defaults to the version code of the changelog release
+    version_codes: list[int] | None = None
+    # Fraction of the users receiving a staged rollout (required by in progress / halted releases)
+    user_fraction: float | None = None
+    # Countries where the release is available (ignored for the internal track), None for every country
+    countries: list[str] | None = field(default_factory=lambda: list(DEFAULT_COUNTRIES))
 
     @property
     def data(self):
         country_targeting = {
-            "countries": [
-                'France'
-            ],
+            "countries": self.countries,
             "includeRestOfWorld": False
-        } if self.track != 'internal' else None
+        } if self.countries and self.track != 'internal' else None
+        # Only staged rollouts accept a user fraction
+        user_fraction = self.user_fraction if self.status in (Status.in_progress, Status.halted) else None
         data = {
             "track": self.track,
             "releases": [
                 {
                     # "name": VERSION_NAME,
-                    "versionCodes": self.release.version_code,
-                    "userFraction": 1 if self.status != Status.completed else None,
+                    "versionCodes": self.version_codes or self.release.version_code,
+                    "userFraction": user_fraction,
                     "countryTargeting": country_targeting,
                     "releaseNotes": [x.data for x in self.release.release_notes],
                     "status": self.status.value
@@ -75,147 +89,340 @@ class Release:
         return data
 
 
-def _get_auth_header(token: str) -> dict:
-    return {'Authorization': f'Bearer {token}'}
+def fetch_insert_edit(client: PlayPublisherClient, expiry: int = 60 * 10):
+    """
+    See https://developers.google.com/android-publisher/api-ref/rest/v3/edits#AppEdit
+    """
+    data = {
+        'id': str(uuid4()),
+        'expiryTimeSeconds': expiry
+    }
+    resp = client.request('POST', f'{client.url}/edits', json=data)
+    return resp
+
+
+def fetch_upload_bundle(client: PlayPublisherClient,
+                        edit_id: str,
+                        bundle_path: Path):
+    content = bundle_path.read_bytes()
+    resp = client.request('POST', f"{client.upload_url}/edits/{edit_id}/bundles",
+                          params={'uploadType': 'media'},
+                          headers={'Content-Type': 'application/octet-stream'},
+                          content=content,
+                          upload=True,
+                          # Sending the whole bundle again is left to the caller (see the resumable upload)
+                          idempotent=False)
+    incr('android.bytes_uploaded', len(content))
+    return resp
 
 
-P = ParamSpec('P')
+def fetch_list_bundles(client: PlayPublisherClient, edit_id: str):
+    resp = client.request('GET', f'{client.url}/edits/{edit_id}/bundles')
+    return resp
 
 
-def retry_refresh_token():
+def find_uploaded_bundle(bundles: list[dict], bundle_hash: str, version_code: int | None = None) -> dict | None:
     """
+    Returns the bundle of `bundles` (from `edits.bundles.list`) with the SHA-256 `bundle_hash`.
+    Raises an `UploadFailedException` if `version_code` is already used by another bundle, since the upload
+    would be rejected as a duplicate.
     """
+    for bundle in bundles:
+        if bundle.get('sha256') == bundle_hash:
+            return bundle
+        if version_code is not None and bundle.get('versionCode') == version_code:
+            raise UploadFailedException(f'Version code {version_code} is already used by another bundle '
+                                        f'(sha256: {bundle.get("sha256")})', codes.CONFLICT)
+    return None
+
+
+def fetch_existing_bundle(client: PlayPublisherClient,
+                          edit_id: str,
+                          bundle_path: Path,
+                          version_code: int | None = None) -> dict | None:
+    """
+    Returns the bundle of the edit matching the local file, to skip its upload when a release is retried
+    """
+    resp = fetch_list_bundles(client, edit_id)
+    data = resp.json()
+    if resp.status_code != codes.OK:
+        raise UploadFailedException(data['error']['message'], resp.status_code)
+    bundles = data.get('bundles', [])
+    # Not hashing the bundle when there is nothing to compare it to
+    return find_uploaded_bundle(bundles, get_file_hash(bundle_path), version_code) if bundles else None
+
+
+def fetch_start_resumable_upload(client: PlayPublisherClient,
+                                 edit_id: str,
+                                 bundle_size: int):
+    resp = client.request('POST', f"{client.upload_url}/edits/{edit_id}/bundles",
+                          params={'uploadType': 'resumable'},
+                          headers={'X-Upload-Content-Type': 'application/octet-stream',
+                                   'X-Upload-Content-Length': str(bundle_size)})
+    return resp
 
-    def wrapper(func: Callable[Concatenate[httpx.Client, P], httpx.Response]):
-        @functools.wraps(func)
-        def wrapped(client: httpx.Client, *args: P.args, **kwargs: P.kwargs):
-            for i in range(2):
-                resp = func(client, *args, **kwargs)
-                if resp.status_code == codes.UNAUTHORIZED:
-                    token = refresh_token(client)
-                    client.headers.update(_get_auth_header(token))
-                else:
-                    break
-            else:
-                raise NotImplementedError(f'Got no response')
-
-            return resp
 
-        return wrapped
+def fetch_upload_status(client: PlayPublisherClient, session_uri: str, bundle_size: int):
+    # The session URI identifies the upload, no token is required
+    resp = client.http.put(session_uri, headers={'Content-Range': f'bytes */{bundle_size}'},
+                           timeout=client.transport.timeout)
+    return resp
 
-    return wrapper
 
+def fetch_upload_chunk(client: PlayPublisherClient,
+                       session_uri: str,
+                       chunk: bytes,
+                       offset: int,
+                       bundle_size: int):
+    resp = client.http.put(session_uri,
+                           headers={'Content-Type': 'application/octet-stream',
+                                    'Content-Range': f'bytes {offset}-{offset + len(chunk) - 1}/{bundle_size}'},
+                           content=chunk,
+                           timeout=client.transport.upload_timeout)
+    return resp
 
-def _gen_jwt():
-    if not PRIVATE_KEY_FROM_JSON:
-        raise ValueError('PRIVATE_KEY_FROM_JSON must be set')
 
-    iat = time.time()
-    exp = iat + 3600
+def _get_session_file(bundle_path: Path) -> Path:
+    return bundle_path.with_name(f'{bundle_path.name}.upload')
 
-    payload = {'iss': CLIENT_EMAIL,
-               'sub': CLIENT_EMAIL,
-               'aud': 'https://oauth2.googleapis.com/token',
-               'scope': SCOPE,
-               'iat': iat,
-               'exp': exp}
 
-    additional_headers = {'kid': PRIVATE_KEY_ID_FROM_JSON}
-    signed_jwt = jwt.encode(payload, PRIVATE_KEY_FROM_JSON, headers=additional_headers,
-                            algorithm='RS256')
-    return signed_jwt
+def _load_session(bundle_path: Path, edit_id: str | None = None) -> dict | None:
+    """
+    Returns the session (`edit_id` and `uri`) of a previous interrupted upload of the same bundle
+    (same size and modification time, and same edit if `edit_id` is given), if any.
+    """
+    session_file = _get_session_file(bundle_path)
+    if not session_file.exists():
+        return None
+    try:
+        session = json.loads(session_file.read_text())
+    except JSONDecodeError:
+        return None
+    stat = bundle_path.stat()
+    if (session.get('size'), session.get('mtime')) != (stat.st_size, stat.st_mtime):
+        return None
+    if edit_id is not None and session.get('edit_id') != edit_id:
+        return None
+    return session
+
+
+def _save_session(bundle_path: Path, edit_id: str, session_uri: str):
+    stat = bundle_path.stat()
+    _get_session_file(bundle_path).write_text(json.dumps({
+        'edit_id': edit_id,
+        'uri': session_uri,
+        'size': stat.st_size,
+        'mtime': stat.st_mtime
+    }))
+
+
+def get_upload_offset(resp: httpx.Response) -> int:
+    """
+    Returns the number of bytes acknowledged by the server from a `308 Resume Incomplete` response
+    (`Range: bytes=0-42` means 43 bytes were received)
+    """
+    _range = resp.headers.get('Range')
+    if not _range:
+        return 0
+    return int(_range.rsplit('-', 1)[-1]) + 1
 
 
-def fetch_access_token(client: httpx.Client, signed_jwt: str) -> str:
-    resp = client.post('https://oauth2.googleapis.com/token', data={
-        'grant_type': 'urn:ietf:params:oauth:grant-type:jwt-bearer',
-        'assertion': signed_jwt
-    })
-    data = resp.json()
-    return data['access_token']
+def raise_for_chunk(retry: RetryPolicy, resp: httpx.Response, offset: int, sent_chunk: bool):
+    """
+    Raises an `httpx.HTTPStatusError` if the chunk upload failed and should be retried:
+    429 / 5xx responses, or a chunk sent at `offset` without any new byte acknowledged by the server
+    """
+    if retry.is_retryable(resp):
+        raise httpx.HTTPStatusError(f'Got status {resp.status_code}', request=resp.request, response=resp)
+    if sent_chunk and resp.status_code == codes.PERMANENT_REDIRECT and get_upload_offset(resp) <= offset:
+        raise httpx.HTTPStatusError(f'No byte acknowledged from {offset}', request=resp.request, response=resp)
 
 
-def refresh_token(client: httpx.Client):
-    logger.info('Refreshing token...')
-    signed_jwt = _gen_jwt()
-    token = fetch_access_token(client, signed_jwt)
-    TOKEN_FILE.write_text(token)
-    logger.info('Token refreshed !')
-    return token
+def _format_throughput(nb_bytes: int, duration: float) -> str:
+    return f'{nb_bytes / max(duration, 1e-6) / 1024 / 1024:.2f} MiB/s'
 
 
-@retry_refresh_token()
-def fetch_insert_edit(client: httpx.Client, expiry: int = 60 * 10):
+def fetch_upload_bundle_resumable(client: PlayPublisherClient,
+                                  edit_id: str,
+                                  bundle_path: Path,
+                                  chunk_size: int = DEFAULT_CHUNK_SIZE,
+                                  max_retries: int | None = None) -> httpx.Response:
     """
-    See https://developers.google.com/android-publisher/api-ref/rest/v3/edits#AppEdit
+    Uploads the bundle in chunks of `chunk_size` bytes streamed from the disk.
+    The session URI is stored next to the bundle (`<bundle>.upload`) so that an interrupted
+    upload can be resumed from the last acknowledged byte by running the command again (in the same edit,
+    see `get_interrupted_edit_id`).
+    Failed chunks (connection errors, 429 / 5xx, or no byte acknowledged) are retried with the backoff of
+    `client.transport.retry`, from the last byte acknowledged by the server rather than from the start.
+    `max_retries` (defaults to the one of the policy) is the number of consecutive failures allowed without progress.
+    See https://developers.google.com/android-publisher/upload#resumable
     """
-    data = {
-        'id': str(uuid4()),
-        'expiryTimeSeconds': expiry
-    }
-    resp = client.post(f'{URL}/edits', json=data)
+    if chunk_size <= 0 or chunk_size % CHUNK_ALIGNMENT:
+        raise ValueError(f'chunk_size must be a positive multiple of {CHUNK_ALIGNMENT}')
+
+    if max_retries is None:
+        max_retries = client.transport.retry.max_retries
+    bundle_size = bundle_path.stat().st_size
+    session = _load_session(bundle_path, edit_id)
+    session_uri = session['uri'] if session else None
+    offset = 0
+
+    if session_uri:
+        resp = fetch_upload_status(client, session_uri, bundle_size)
+        if resp.status_code in (codes.OK, codes.CREATED):
+            _get_session_file(bundle_path).unlink(missing_ok=True)
+            return resp
+        if resp.status_code == codes.PERMANENT_REDIRECT:
+            offset = get_upload_offset(resp)
+            logger.info(f'Resuming upload from byte {offset}/{bundle_size}')
+        else:
+            logger.info(f'Previous upload session expired (code: {resp.status_code})')
+            session_uri = None
+
+    if not session_uri:
+        resp = fetch_start_resumable_upload(client, edit_id, bundle_size)
+        if resp.status_code != codes.OK:
+            return resp
+        session_uri = resp.headers['Location']
+        _save_session(bundle_path, edit_id, session_uri)
+
+    start, start_offset = time.perf_counter(), offset
+    retries = 0
+    check_status = False
+    with open(bundle_path, 'rb') as f:
+        while True:
+            try:
+                if check_status:
+                    resp = fetch_upload_status(client, session_uri, bundle_size)
+                else:
+                    f.seek(offset)
+                    chunk = f.read(chunk_size)
+                    resp = fetch_upload_chunk(client, session_uri, chunk, offset, bundle_size)
+                    incr('android.bytes_uploaded', len(chunk))
+                raise_for_chunk(client.transport.retry, resp, offset, sent_chunk=not check_status)
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                if retries >= max_retries:
+                    raise
+                delay = client.transport.retry.get_delay(
+                    retries, e.response if isinstance(e, httpx.HTTPStatusError) else None)
+                retries += 1
+                incr('android.upload_retries')
+                logger.warning(f'Chunk upload failed ({e}), retrying in {delay:.1f}s ({retries}/{max_retries})...')
+                time.sleep(delay)
+                # Asking the server how many bytes it received before sending the next chunk
+                check_status = True
+                continue
+
+            check_status = False
+            if resp.status_code != codes.PERMANENT_REDIRECT:
+                break
+            acknowledged = get_upload_offset(resp)
+            if acknowledged > offset:
+                # The retries (and the backoff) only count the failures since the last progress
+                retries = 0
+            offset = acknowledged
+            logger.info(f'Uploaded {offset}/{bundle_size} bytes '
+                        f'({_format_throughput(offset - start_offset, time.perf_counter() - start)})')
+
+    if resp.status_code in (codes.OK, codes.CREATED):
+        _get_session_file(bundle_path).unlink(missing_ok=True)
+        logger.info(f'Upload done in {time.perf_counter() - start:.2f}s '
+                    f'({_format_throughput(bundle_size - start_offset, time.perf_counter() - start)})')
     return resp
 
 
-@retry_refresh_token()
-def fetch_upload_bundle(session: httpx.Client,
-                        edit_id: str,
-                        bundle_path: Path):
-    resp = session.post(f"{UPLOAD_URL}/edits/{edit_id}/bundles",
-                        params={'uploadType': 'media'},
-                        headers={'Content-Type': 'application/octet-stream'},
-                        content=bundle_path.read_bytes())
+def fetch_get_edit(client: PlayPublisherClient, edit_id: str):
+    resp = client.request('GET', f'{client.url}/edits/{edit_id}')
     return resp
 
 
-@retry_refresh_token()
-def fetch_patch_release(client: httpx.Client, edit_id: str, release: Release):
-    resp = client.put(f'{URL}/edits/{edit_id}/tracks/{release.track}',
-                      json=release.data)
+def get_interrupted_edit_id(client: PlayPublisherClient, bundle_path: Path) -> str | None:
+    """
+    Returns the edit of an interrupted resumable upload of the bundle (see `fetch_upload_bundle_resumable`),
+    if it is still open, so that the upload resumes without having to pass its edit id
+    """
+    session = _load_session(bundle_path)
+    if session is None:
+        return None
+    edit_id = session['edit_id']
+    with span('android.get_edit'):
+        resp = fetch_get_edit(client, edit_id)
+    if resp.status_code != codes.OK:
+        logger.warning(f'Edit {edit_id!r} of the interrupted upload of {bundle_path} is no longer open '
+                       f'(code: {resp.status_code}), starting a new upload')
+        _get_session_file(bundle_path).unlink(missing_ok=True)
+        return None
+    logger.warning(f'Resuming the interrupted upload of {bundle_path} (edit: {edit_id!r})')
+    return edit_id
+
+
+def fetch_patch_release(client: PlayPublisherClient, edit_id: str, release: Release):
+    resp = client.request('PUT', f'{client.url}/edits/{edit_id}/tracks/{release.track}',
+                          json=release.data)
     return resp
 
 
-@retry_refresh_token()
-def fetch_commit(client: httpx.Client, edit_id: str):
-    resp = client.post(f'{COMMIT_URL}/edits/{edit_id}:commit')
+def fetch_commit(client: PlayPublisherClient, edit_id: str):
+    # A commit whose response was lost may have been applied, it is not sent again
+    resp = client.request('POST', f'{client.commit_url}/edits/{edit_id}:commit', idempotent=False)
     return resp
 
 
-def upload_bundle(client: httpx.Client,
+def upload_bundle(client: PlayPublisherClient,
                   path: Path,
                   changelog: Path,
                   track: Track,
                   edit_id: str | None = None,
-                  skip_upload: bool = False):
-    releases = parse_markdown(changelog)
-    last_release = releases[0]
+                  skip_upload: bool = False,
+                  resumable: bool = False,
+                  chunk_size: int = DEFAULT_CHUNK_SIZE):
+    last_release = get_last_release(changelog)
 
     logger.info(f'Starting bundle upload edit (version: {last_release.version}), track: {track}')
 
+    if not edit_id and resumable and not skip_upload:
+        edit_id = get_interrupted_edit_id(client, path)
+
     if not edit_id:
-        resp = fetch_insert_edit(client, 30)
+        with span('android.insert_edit'):
+            resp = fetch_insert_edit(client, 30)
         resp = resp.json()
         _edit_id = resp['id']
         logger.info(f'Edit created with id {_edit_id!r}')
     else:
         _edit_id = edit_id
 
+    existing_bundle = None
     if not skip_upload:
+        with span('android.list_bundles'):
+            existing_bundle = fetch_existing_bundle(client, _edit_id, path, last_release.version_code)
+        if existing_bundle:
+            logger.info(f'{path} already uploaded (version: {existing_bundle["versionCode"]}), skipping the upload')
+            incr('android.uploads_skipped')
+
+    if not skip_upload and not existing_bundle:
         logger.info(f'Starting upload of {path!r} ...')
-        resp = fetch_upload_bundle(client, _edit_id, path)
+        with span('android.upload'):
+            if resumable:
+                resp = fetch_upload_bundle_resumable(client, _edit_id, path, chunk_size=chunk_size)
+            else:
+                resp = fetch_upload_bundle(client, _edit_id, path)
         data = resp.json()
-        if resp.status_code != codes.OK:
+        # Resumable uploads may complete with `201 Created`
+        if resp.status_code not in (codes.OK, codes.CREATED):
             raise UploadFailedException(data['error']['message'], resp.status_code)
 
         logger.info('Uploaded version: {versionCode}'.format(**data))
 
     release = Release(track, last_release)
-    resp = fetch_patch_release(client, _edit_id, release)
+    with span('android.patch_release'):
+        resp = fetch_patch_release(client, _edit_id, release)
     data = resp.json()
     if resp.status_code != codes.OK:
         raise UploadFailedException(data['error']['message'], resp.status_code)
 
-    resp = fetch_commit(client, _edit_id)
+    with span('android.commit'):
+        resp = fetch_commit(client, _edit_id)
     try:
         data = resp.json()
     except JSONDecodeError:
@@ -226,28 +433,3 @@ def upload_bundle(client: httpx.Client,
         raise UploadFailedException(data['error']['message'], resp.status_code)
 
     logger.info(f'Release sent ! ({data})')
-
-
-def _load_config(package_name: str, config_path: Path | None = None) -> str | None:
-    global URL, PRIVATE_KEY_FROM_JSON, PRIVATE_KEY_ID_FROM_JSON, CLIENT_EMAIL, UPLOAD_URL, COMMIT_URL
-    URL = URL.format(PACKAGE_NAME=package_name)
-    UPLOAD_URL = UPLOAD_URL.format(PACKAGE_NAME=package_name)
-    COMMIT_URL = COMMIT_URL.format(PACKAGE_NAME=package_name)
-
-    if config_path:
-        config = json.loads(config_path.read_text())
-        PRIVATE_KEY_FROM_JSON = config['private_key']
-        PRIVATE_KEY_ID_FROM_JSON = config['private_key_id']
-        CLIENT_EMAIL = config['client_email']
-
-    token = TOKEN_FILE.read_text() if TOKEN_FILE.exists() else None
-
-    return token
-
-
-def init_token(client: httpx.Client,
-               package: str,
-               config: Path | None = None):
-    token = _load_config(package, config)
-    if token:
-        client.headers.update(_get_auth_header(token))
@@ -1,18 +1,53 @@
+import functools
+import hashlib
+import json
 import re
 from dataclasses import dataclass, asdict, field
 from pathlib import Path
+from typing import Iterator
 
 from piou import Option
 
 from app_utils.logs import logger
+from app_utils.metrics import span, incr
+from app_utils.utils import get_cache_dir, get_file_hash
 
 _version_reg = re.compile(r'^##\s+\[v(?P<version>\d+\.\d+\.\d+)\]$')
 _lang_reg = re.compile(r'-\s+\*\*(?P<lang>\w{2}\-\w{2})\*\*:')
 
-_header_reg = re.compile(r'###\s+[^\w]*\s*(?P<header>[\w\s]+)',
-                         flags=re.UNICODE)
 _remove_extra_spaces_reg = re.compile(r'\s{2,}')
 
+# Markdown elements supported by the Play Store release notes, rendered in a single pass
+_markdown_reg = re.compile(
+    r'^###\s+(?P<emoji>[^\w\n]*?)\s*(?P<header>\w[^\n]*?)\s*$'
+    # Emphasis must not start or end with a space (`2 * 3 * 4` is not italic)
+    r'|\*\*(?P<bold>[^*\s](?:[^*\n]*[^*\s])?)\*\*'
+    r'|(?<![\w*])\*(?P<italic>[^*\s](?:[^*\n]*[^*\s])?)\*(?![\w*])'
+    r'|(?<!\w)_(?P<italic_>[^_\s](?:[^_\n]*[^_\s])?)_(?!\w)'
+    # URLs may contain balanced parentheses (https://en.wikipedia.org/wiki/Kotlin_(programming_language))
+    r'|\[(?P<link>[^]\n]+)\]\((?P<url>[^()\s]+(?:\([^()\s]*\)[^()\s]*)*)\)',
+    flags=re.MULTILINE)
+
+
+def _render_markdown_match(match: re.Match) -> str:
+    if header := match.group('header'):
+        emoji = match.group('emoji')
+        return f'{emoji} <b>{header}</b>' if emoji else f'<b>{header}</b>'
+    if bold := match.group('bold'):
+        return f'<b>{bold}</b>'
+    if italic := match.group('italic') or match.group('italic_'):
+        return f'<i>{italic}</i>'
+    return f'<a href="{match.group("url")}">{match.group("link")}</a>'
+
+
+@functools.lru_cache(maxsize=1024)
+def render_html(text: str) -> str:
+    """
+    Converts the markdown of a release note to the HTML accepted by the Play Store:
+    headers (`### 🐛 Bug fixed` -> `🐛 <b>Bug fixed</b>`), bold, italic and links
+    """
+    return _markdown_reg.sub(_render_markdown_match, text)
+
 
 @dataclass
 class ReleaseNote:
@@ -20,12 +55,8 @@ class ReleaseNote:
     text: str
 
     @property
-    def html_text(self):
-        text = self.text
-        matches = [x.strip() for x in _header_reg.findall(self.text)]
-        for match in matches:
-            text = text.replace(match, f'<b>{match}</b>').replace('### ', '')
-        return text
+    def html_text(self) -> str:
+        return render_html(self.text)
 
     @property
     def data(self):
@@ -55,57 +86,204 @@ class Release:
                               for x in self.release_notes]
 
 
-def parse_markdown(path: Path) -> list[Release]:
-    file = path if isinstance(str, Path) else Path(path)
-
-    def _reset_lang():
-        nonlocal current_lang
-        if current_version and current_lang:
-            current_lang['text'] = '\n'.join(current_lang.pop('lines'))
-            current_version['languages'].append(current_lang)
-        current_lang = {}
-
-    def _reset():
-        nonlocal current_version
-        _reset_lang()
-        if current_version:
-            versions.append(current_version)
-            current_version = {}
+def iter_releases(path: Path) -> Iterator[Release]:
+    """
+    Parses the changelog line by line, yielding each release (newest first) as soon as its
+    section is complete: callers only interested in the first releases can stop early.
+    """
+    file = Path(path)
 
     if not file.exists():
         logger.error(f'No file found @ {file}')
 
+    version: str | None = None
+    release_notes: list[ReleaseNote] = []
+    lang: str | None = None
+    lang_lines: list[str] = []
+
+    def _close_lang():
+        if lang:
+            release_notes.append(ReleaseNote(language=lang, text='\n'.join(lang_lines)))
+
     with open(file, 'r') as f:
-        lines = [x.strip() for x in f.readlines() if x.strip()]
+        for line in f:
+            l = line.strip()
+            if not l:
+                continue
+
+            if l.startswith('## '):
+                if version:
+                    _close_lang()
+                    yield Release(version=version, release_notes=release_notes)
+                match = _version_reg.match(l)
+                if match is None:
+                    raise ValueError(f'No match found for line {l!r}')
+                version, release_notes, lang, lang_lines = match.group('version'), [], None, []
+
+            if version:
+                lang_match = _lang_reg.match(l)
+                if lang_match:
+                    _close_lang()
+                    lang, lang_lines = lang_match.group('lang'), []
+                elif lang:
+                    lang_lines.append(_remove_extra_spaces_reg.sub(' ', l))
 
-    versions = []
-    current_version = {}
-    current_lang = {}
+    if version:
+        _close_lang()
+        yield Release(version=version, release_notes=release_notes)
 
-    for l in lines:
-        if l.startswith('## '):
-            _reset()
-            version = _version_reg.match(l)
-            if version is None:
-                raise ValueError(f'No match found for line {l!r}')
-            current_version['version'] = version.group('version')
-            current_version['languages'] = []
 
-        if current_version:
-            lang = _lang_reg.match(l)
+def get_release(path: Path, version: str) -> Release | None:
+    """
+    Returns the release `version`, the changelog is read up to its section
+    """
+    return next((x for x in iter_releases(path) if x.version == version), None)
+
+
+def parse_markdown(path: Path) -> list[Release]:
+    return list(iter_releases(path))
+
+
+@dataclass
+class Changelog:
+    """
+    Parsed changelog, indexed by version and by version code.
+    `complete` is False when only the newest release was parsed.
+    """
+    releases: list[Release]
+    complete: bool = True
+
+    def __post_init__(self):
+        self._by_version = {x.version: x for x in self.releases}
+        self._by_version_code = {x.version_code: x for x in self.releases}
+
+    @property
+    def last(self) -> Release:
+        if not self.releases:
+            raise ValueError('No release found')
+        return self.releases[0]
 
-            if lang:
-                _reset_lang()
-                current_lang = {'lang': lang.group('lang'), 'lines': []}
-            elif current_lang:
-                current_lang['lines'].append(_remove_extra_spaces_reg.sub(' ', l))
+    def get(self, version: str) -> Release | None:
+        return self._by_version.get(version)
 
-    _reset()
+    def get_by_version_code(self, version_code: int) -> Release | None:
+        return self._by_version_code.get(version_code)
 
-    return [Release(version=x['version'],
-                    release_notes=[ReleaseNote(language=lang['lang'], text=lang['text']) for lang in
-                                   x.pop('languages')])
-            for x in versions]
+
+# Parsed changelogs of the current process, by path, with their stat key and head hash (see `_read_cache`)
+_CHANGELOGS: dict[Path, tuple[tuple[int, int, int], str, Changelog]] = {}
+
+
+def _get_cache_path(path: Path) -> Path:
+    return get_cache_dir('changelog') / f'{hashlib.sha256(str(path).encode()).hexdigest()}.json'
+
+
+def _get_stat_key(path: Path) -> tuple[int, int, int]:
+    # The change time cannot be preserved by the tools copying the modification time
+    stat = path.stat()
+    return stat.st_mtime_ns, stat.st_ctime_ns, stat.st_size
+
+
+def _get_head_hash(path: Path) -> str:
+    """
+    SHA-256 of the changelog up to its second release: the only part read by `get_last_release`
+    """
+    head_hash = hashlib.sha256()
+    with open(path, 'rb') as f:
+        nb_releases = 0
+        for line in f:
+            if line.lstrip().startswith(b'## '):
+                nb_releases += 1
+                if nb_releases > 1:
+                    break
+            head_hash.update(line)
+    return head_hash.hexdigest()
+
+
+def _read_cache(path: Path) -> Changelog | None:
+    """
+    Returns the parsed changelog from the memory or the disk cache, if the file did not change.
+    The newest release section must always be the same (a version bump may keep the size and, on coarse
+    filesystems, the modification time), then:
+     - a complete changelog must have the same stat (modification / change time and size) or the same content
+     - a partial changelog (see `get_last_release`) only contains the newest release, nothing else is checked
+    """
+    stat_key = _get_stat_key(path)
+    head_hash = _get_head_hash(path)
+    if path in _CHANGELOGS and _CHANGELOGS[path][:2] == (stat_key, head_hash):
+        return _CHANGELOGS[path][2]
+
+    cache_path = _get_cache_path(path)
+    if not cache_path.exists():
+        return None
+    try:
+        data = json.loads(cache_path.read_text())
+    except json.JSONDecodeError:
+        return None
+    if data.get('head_hash') != head_hash:
+        return None
+    if data['complete'] and tuple(data.get('stat', ())) != stat_key:
+        # Only the complete changelogs store their hash
+        if data['stat'][2] != stat_key[2] or data.get('hash') is None or data['hash'] != get_file_hash(path):
+            return None
+        # Same content (eg: new checkout), refreshing the stat
+        data['stat'] = stat_key
+        cache_path.write_text(json.dumps(data))
+
+    changelog = Changelog([Release(**x) for x in data['releases']], complete=data['complete'])
+    _CHANGELOGS[path] = (stat_key, head_hash, changelog)
+    return changelog
+
+
+def _write_cache(path: Path, changelog: Changelog, file_hash: str | None = None):
+    """
+    `file_hash` allows finding the changelog again once its stat changed. It is skipped for
+    the partial changelogs of `get_last_release`, which only read the first section of the file.
+    """
+    stat_key, head_hash = _get_stat_key(path), _get_head_hash(path)
+    _CHANGELOGS[path] = (stat_key, head_hash, changelog)
+    _get_cache_path(path).write_text(json.dumps({
+        'path': str(path),
+        'stat': stat_key,
+        'head_hash': head_hash,
+        'hash': file_hash,
+        'complete': changelog.complete,
+        'releases': [x.data for x in changelog.releases]
+    }))
+
+
+def load_changelog(path: Path) -> Changelog:
+    """
+    Returns the parsed changelog, from the cache if the file did not change since it was last parsed
+    """
+    path = Path(path).resolve()
+    changelog = _read_cache(path)
+    if changelog is None or not changelog.complete:
+        with span('changelog.parse'):
+            changelog = Changelog(parse_markdown(path))
+        _write_cache(path, changelog, get_file_hash(path))
+    else:
+        incr('changelog.cache_hits')
+    return changelog
+
+
+def get_last_release(path: Path) -> Release:
+    """
+    Returns the newest release from the cache or, if the changelog changed,
+    by parsing only its first section
+    """
+    path = Path(path).resolve()
+    changelog = _read_cache(path)
+    if changelog is None:
+        with span('changelog.parse'):
+            release = next(iter_releases(path), None)
+        if release is None:
+            raise ValueError(f'No release found in {path}')
+        changelog = Changelog([release], complete=False)
+        _write_cache(path, changelog)
+    else:
+        incr('changelog.cache_hits')
+    return changelog.last
 
 
 def print_release_infos(release: Release):
@@ -124,18 +302,17 @@ def run_changelog(
         path: Path = Option(..., '--path', '-p', help='Changelog path'),
         show_last: bool = Option(False, '-l', '--last', help='Prints the last version'),
         show_releases: bool = Option(False, '-a', '--all-releases', help='Prints all available releases'),
-        release_version: bool = Option(False, '-r', '--release', help='Release version')
+        release_version: str | None = Option(None, '-r', '--release', help='Prints the release of this version')
 ):
-    releases = parse_markdown(path)
     if show_last:
-        print_release_infos(releases[0])
+        print_release_infos(get_last_release(path))
     elif show_releases:
-        for release in releases:
+        for release in load_changelog(path).releases:
             print(release.version)
     elif release_version:
-        release = [x for x in releases if x.version == release_version]
+        release = load_changelog(path).get(release_version)
         if release:
-            print_release_infos(release[0])
+            print_release_infos(release)
         else:
             print('[red]release not found[/red]')
     else:
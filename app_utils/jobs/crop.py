@@ -1,31 +1,154 @@
+import importlib.util
+import json
+import os
+import re
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Literal, Iterator
 
 from piou import Option
 
-from app_utils.utils import exec_cmd
+from app_utils.logs import logger
+from app_utils.metrics import span, incr
+from app_utils.utils import run_cmd, bounded_map, get_file_hash
 
+CropBackend = Literal['pillow', 'convert']
 
-def crop_image(input_path: str, output_path: str, crop_dim: str):
+# Offsets (top, bottom) removing the status and navigation bars, by screenshot size
+CROP_PRESETS: dict[tuple[int, int], tuple[int, int]] = {
+    (1080, 2400): (117, 125),
+    (1080, 2340): (64, 132),
+}
+
+# Maximum duration (s) of a `convert` call
+CONVERT_TIMEOUT = 60
+
+# Stores the source mtime / size / hash and the crop parameters of each cropped image
+CROP_MANIFEST_NAME = '.crop-manifest.json'
+
+_crop_dim_reg = re.compile(r'^(?P<width>\d+)x(?P<height>\d+)\+(?P<x>\d+)\+(?P<y>\d+)$')
+
+
+def crop_image(input_path: str, output_path: str, crop_dim: str, timeout: float | None = CONVERT_TIMEOUT):
     """
     Make sure you have imagemagick installed https://imagemagick.org/script/download.php#linux
     """
-    exec_cmd(['convert', input_path, '-crop', crop_dim, output_path])
+    run_cmd(['convert', input_path, '-crop', crop_dim, output_path], timeout=timeout)
+
+
+def _get_crop_box(crop_dim: str, image_size: tuple[int, int]) -> tuple[int, int, int, int]:
+    """
+    Converts an ImageMagick geometry (WxH+X+Y) to a Pillow box, clipped to the image like `convert -crop` does
+    """
+    match = _crop_dim_reg.match(crop_dim)
+    if match is None:
+        raise ValueError(f'Invalid crop dimensions {crop_dim!r}, expected WxH+X+Y')
+    width, height, x, y = (int(match.group(k)) for k in ('width', 'height', 'x', 'y'))
+    image_width, image_height = image_size
+    return x, y, min(x + width, image_width), min(y + height, image_height)
+
+
+def crop_image_pillow(input_path: str, output_path: str, crop_dim: str):
+    """
+    Same as `crop_image`, in process
+    """
+    # Import here to avoid error
+    from PIL import Image, JpegImagePlugin
+
+    with Image.open(input_path) as image:
+        params = {}
+        if image.format == 'JPEG' and isinstance(image, JpegImagePlugin.JpegImageFile):
+            # Keeping the quantization tables of the source to get the same quality as the input
+            params = {'qtables': image.quantization,
+                      'subsampling': JpegImagePlugin.get_sampling(image)}
+        image.crop(_get_crop_box(crop_dim, image.size)).save(output_path, format=image.format, **params)
+
+
+def _get_backend(backend: CropBackend) -> CropBackend:
+    if backend == 'pillow' and importlib.util.find_spec('PIL') is None:
+        logger.warning('Pillow is not installed, falling back to imagemagick')
+        return 'convert'
+    return backend
+
+
+def get_image_size(path: Path) -> tuple[int, int]:
+    """
+    Reads the size from the image header, without decoding it
+    """
+    # Import here to avoid error
+    from PIL import Image
+
+    with Image.open(path) as image:
+        return image.size
+
+
+def get_crop_dim(image_size: tuple[int, int],
+                 from_top: int | None = None,
+                 from_bottom: int | None = None) -> str:
+    """
+    Returns the crop geometry of an image, the offsets not specified are taken from `CROP_PRESETS`
+    """
+    width, height = image_size
+    preset_top, preset_bottom = CROP_PRESETS.get(image_size, (0, 0))
+    from_top = preset_top if from_top is None else from_top
+    from_bottom = preset_bottom if from_bottom is None else from_bottom
+    return f'{width}x{height - from_bottom - from_top}+0+{from_top}'
+
+
+def iter_images(folder: Path, extensions: list[str], exclude: Path | None = None) -> Iterator[Path]:
+    """
+    Walks `folder` once, yielding the files matching one of the `extensions` (outside of `exclude`)
+    """
+    _extensions = {f'.{x.lower().lstrip(".")}' for x in extensions}
+    for p in folder.rglob('*'):
+        if p.suffix.lower() in _extensions and p.is_file() and (exclude is None or exclude not in p.parents):
+            yield p
+
+
+def _get_params(image_dim: str | None, from_top: int | None, from_bottom: int | None, backend: CropBackend) -> str:
+    """
+    Crop parameters stored in the manifest: changing them crops all the images again
+    """
+    presets = sorted([list(size), list(offsets)] for size, offsets in CROP_PRESETS.items())
+    return json.dumps([image_dim, from_top, from_bottom, backend, presets])
+
+
+def _load_crop_manifest(output_folder: Path) -> dict[str, dict]:
+    path = output_folder / CROP_MANIFEST_NAME
+    if not path.exists():
+        return {}
+    try:
+        return json.loads(path.read_text())
+    except json.JSONDecodeError:
+        return {}
+
+
+def _save_crop_manifest(output_folder: Path, manifest: dict[str, dict]):
+    (output_folder / CROP_MANIFEST_NAME).write_text(json.dumps(manifest, indent=2, sort_keys=True))
 
 
 def run_crop(
         folder: Path = Option(..., '-f', '--folder', help='Path of the folder containing the images to crop'),
         output_folder: Path = Option(..., '-o', '--output', help='Path where the crop images will be '),
         extensions: list[str] = Option(['png', 'jpg', 'jpeg'], '--extensions', help='Extension file to look for'),
-        image_dim: str = Option(..., '--dim', help='Images dimensions of the form WxH'),
-        from_top: int = Option(0, '-t', '--top', help='Crop from the top'),
-        from_bottom: int = Option(0, '-b', '--bottom', help='Crop from the top'),
+        image_dim: str | None = Option(None, '--dim',
+                                       help='Images dimensions of the form WxH (default: read from each image)'),
+        from_top: int | None = Option(None, '-t', '--top', help='Crop from the top (default: from the presets)'),
+        from_bottom: int | None = Option(None, '-b', '--bottom',
+                                         help='Crop from the bottom (default: from the presets)'),
+        backend: CropBackend = Option('pillow', '--backend',
+                                      help='Crop in process with Pillow or with imagemagick (convert)'),
+        jobs: int | None = Option(None, '-j', '--jobs', help='Number of images cropped at the same time'),
+        incremental: bool = Option(False, '-i', '--incremental',
+                                   help='Keeps the output folder and only crops the new or modified images'),
 ):
     """
-    First, to get the size of the image run
-        identify path-to-my-image | awk '{print $3}'
-    Then
+    Crops every image of the folder. The size of each image is read from its header
+    and the offsets are chosen from the presets below, unless specified.
+        python crop.py -f ~/Downloads/Screenshots
         python crop.py -f ~/Downloads/Screenshots --dim "1080x2400" -t 117 -b 125
+    With --incremental, only the images added or modified since the last run are cropped.
 
     Formats:
         "1080x2400":  -t 117 -b 125
@@ -35,16 +158,69 @@ def run_crop(
         raise FileNotFoundError('Input folder does not exists')
 
     output_folder = output_folder or folder.parent / (folder.name + '_cropped')
-    if output_folder.exists():
+    if output_folder.exists() and not incremental:
         shutil.rmtree(output_folder)
-    output_folder.mkdir(exist_ok=False)
+    output_folder.mkdir(exist_ok=incremental)
+
+    _backend = _get_backend(backend)
+    _image_size: tuple[int, int] | None = None
+    if image_dim:
+        width, height = image_dim.split('x')
+        _image_size = int(width), int(height)
+    if _image_size is None and importlib.util.find_spec('PIL') is None:
+        raise ValueError('Pillow is required to read the image sizes, please specify --dim')
+
+    params = _get_params(image_dim, from_top, from_bottom, _backend)
+    manifest = _load_crop_manifest(output_folder) if incremental else {}
+    sources = set()
+
+    def _iter_changed() -> Iterator[Path]:
+        for p in iter_images(folder, extensions, exclude=output_folder):
+            key = str(p.relative_to(folder))
+            sources.add(key)
+            entry = manifest.get(key)
+            stat = p.stat()
+            if (entry and entry['params'] == params
+                    and (entry['size'], entry['mtime']) == (stat.st_size, stat.st_mtime)
+                    and (output_folder / key).exists()):
+                continue
+            yield p
+
+    def _crop(p: Path) -> tuple[str, dict, bool]:
+        key = str(p.relative_to(folder))
+        _file_output = output_folder / key
+        stat = p.stat()
+        entry = {'size': stat.st_size, 'mtime': stat.st_mtime, 'hash': get_file_hash(p), 'params': params}
+        # Touched but unchanged
+        previous = manifest.get(key)
+        if (previous and (previous['hash'], previous['params']) == (entry['hash'], params)
+                and _file_output.exists()):
+            return key, entry, False
+
+        _file_output.parent.mkdir(parents=True, exist_ok=True)
+        with span('crop.image'):
+            crop_dim = get_crop_dim(_image_size or get_image_size(p), from_top, from_bottom)
+            if _backend == 'convert':
+                crop_image(str(p), str(_file_output), crop_dim)
+            else:
+                crop_image_pillow(str(p), str(_file_output), crop_dim)
+        incr('crop.bytes_read', stat.st_size)
+        return key, entry, True
 
-    _width, _height = image_dim.split('x')
-    crop_dim = f'{_width}x{int(_height) - from_bottom - from_top}+0+{from_top}'
+    nb_cropped = 0
+    _jobs = jobs or min(32, (os.cpu_count() or 1) + 4)
+    with ThreadPoolExecutor(max_workers=_jobs) as executor:
+        for key, entry, cropped in bounded_map(executor, _crop, _iter_changed(), max_pending=2 * _jobs):
+            manifest[key] = entry
+            nb_cropped += cropped
+            logger.debug(f'Cropped {key}' if cropped else f'Unchanged {key}')
 
-    for ext in extensions:
-        for p in folder.glob(f'**/*.{ext}'):
-            _file_output = Path(str(p).replace(str(folder), str(output_folder)))
-            if not _file_output.parent.exists():
-                _file_output.parent.mkdir(parents=True)
-            crop_image(str(p), str(_file_output), crop_dim)
+    if incremental:
+        for key in manifest.keys() - sources:
+            logger.debug(f'Removing {key} (source deleted)')
+            (output_folder / key).unlink(missing_ok=True)
+            del manifest[key]
+    _save_crop_manifest(output_folder, manifest)
+    incr('crop.cropped', nb_cropped)
+    incr('crop.unchanged', len(sources) - nb_cropped)
+    logger.info(f'{nb_cropped} image(s) cropped')
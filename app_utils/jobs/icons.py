@@ -1,10 +1,19 @@
+import hashlib
+import io
+import json
 import logging
+import os
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, asdict
+from functools import lru_cache
 from pathlib import Path
+from typing import Callable
 
 from piou import Option
 
 from app_utils.logs import logger
+from app_utils.metrics import span, incr
 
 Sizes = namedtuple('Sizes', ['size', 'formats'])
 
@@ -14,14 +23,194 @@ _DEFAULT_SIZES = {
 }
 
 
+@dataclass
+class Profile:
+    """
+    Named set of output sizes, written in `folder` (relative to the output folder)
+    """
+    sizes: dict[str, Sizes]
+    folder: str = ''
+    webp: bool = False
+
+
+_DEFAULT_PROFILES = {
+    'default': Profile(_DEFAULT_SIZES)
+}
+
+# Stores the hash of each rendered svg in the output folder to skip the unchanged ones
+MANIFEST_NAME = '.icons-manifest.json'
+
+
+def load_profiles(path: Path) -> dict[str, Profile]:
+    """
+    Loads the size profiles from a JSON or TOML file of the form:
+        [profiles.app]
+        sizes = { "" = { size = 28, formats = [1, 2, 3] }, ".android" = { size = 22, formats = [1, 2, 3, 4] } }
+
+        [profiles.favicon]
+        folder = "web"
+        webp = true
+        sizes = { "-favicon" = { size = 16, formats = [1, 2] } }
+    """
+    if path.suffix == '.toml':
+        try:
+            import tomllib
+        except ImportError:
+            # Python < 3.11, tomli is an optional dependency
+            try:
+                import tomli as tomllib  # pyright: ignore[reportMissingImports]
+            except ImportError:
+                raise ImportError('Please install tomli or use a JSON profile file') from None
+        data = tomllib.loads(path.read_text())
+    else:
+        data = json.loads(path.read_text())
+
+    return {name: Profile(sizes={ext: Sizes(x['size'], x['formats']) for ext, x in profile['sizes'].items()},
+                          folder=profile.get('folder', ''),
+                          webp=profile.get('webp', False))
+            for name, profile in data['profiles'].items()}
+
+
+def get_outputs(file: Path, profiles: dict[str, Profile]) -> dict[str, int]:
+    """
+    Returns the path (relative to the output folder) and the size of each image to render for `file`
+    """
+    outputs = {}
+    for profile in profiles.values():
+        for ext, _default_size in profile.sizes.items():
+            for _format in _default_size.formats:
+                _file_ext = (f'@{_format}x' if _format > 1 else '') + ext
+                _output_file = str(Path(profile.folder) / (file.name.replace(file.suffix, '') + _file_ext))
+                outputs[_output_file + '.png'] = _default_size.size * _format
+                if profile.webp:
+                    outputs[_output_file + '.webp'] = _default_size.size * _format
+    return outputs
+
+
+@lru_cache(maxsize=32)
+def _parse_svg(path: str, file_hash: str):
+    """
+    Parses the svg once per process, `file_hash` invalidates the cache when the file changes
+    """
+    # Import here to avoid error
+    from cairosvg.parser import Tree
+    return Tree(url=path)
+
+
+def _group_by_size(outputs: dict[str, int]) -> dict[int, list[str]]:
+    sizes = {}
+    for _output_file, output_size in outputs.items():
+        sizes.setdefault(output_size, []).append(_output_file)
+    return sizes
+
+
+def write_image(png: bytes, path: Path):
+    """
+    Writes the rendered png, converted to WebP if `path` ends with `.webp`
+    """
+    if path.suffix == '.webp':
+        # Import here to avoid error
+        from PIL import Image
+        with Image.open(io.BytesIO(png)) as image:
+            image.save(path, 'WEBP', lossless=True)
+    else:
+        path.write_bytes(png)
+
+
+def render_icon(file: Path, output_folder: Path, outputs: dict[str, int], file_hash: str = ''):
+    # Import here to avoid error
+    from cairosvg.surface import PNGSurface
+
+    tree = _parse_svg(str(file), file_hash)
+    # Rasterising each size once, even if it is used by several profiles / formats
+    for output_size, _output_files in _group_by_size(outputs).items():
+        png = io.BytesIO()
+        PNGSurface(tree, png, 96,
+                   output_width=output_size,
+                   output_height=output_size).finish()
+        for _output_file in _output_files:
+            logger.info(f'\tsize: {output_size:<4} | file: {_output_file}')
+            write_image(png.getvalue(), output_folder / _output_file)
+
+
+def _split_tasks(tasks: list[tuple[Path, dict[str, int], str]], jobs: int):
+    """
+    Yields one task per svg, or one task per output size when there are fewer svgs than workers
+    (each worker then parses the svg once)
+    """
+    for file, outputs, file_hash in tasks:
+        if len(tasks) >= jobs:
+            yield file, outputs, file_hash
+        else:
+            for _size, _outputs in _group_by_size(outputs).items():
+                yield file, {x: _size for x in _outputs}, file_hash
+
+
+def render_icons(tasks: list[tuple[Path, dict[str, int], str]],
+                 output_folder: Path,
+                 jobs: int = 1,
+                 renderer: Callable[[Path, Path, dict[str, int], str], None] | None = None):
+    """
+    Renders the `(svg, outputs, hash)` tasks with `renderer` (defaults to `render_icon`),
+    using a pool of `jobs` processes if `jobs` > 1. The renderer is pickled for the worker processes,
+    it must be a module level function.
+    """
+    renderer = renderer or render_icon
+    if jobs <= 1 or len(tasks) == 0:
+        for file, outputs, file_hash in tasks:
+            renderer(file, output_folder, outputs, file_hash)
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(renderer, file, output_folder, outputs, file_hash)
+                   for file, outputs, file_hash in _split_tasks(tasks, jobs)]
+        for future in futures:
+            future.result()
+
+
+def _hash_profiles(profiles: dict[str, Profile]) -> str:
+    data = {name: asdict(profile) for name, profile in profiles.items()}
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+def _load_manifest(output_folder: Path, sizes_hash: str) -> dict[str, dict]:
+    """
+    Returns the svg entries of the manifest ({svg name: {'hash': ..., 'outputs': [...]}}).
+    Entries rendered with another size table are kept so that their outputs can be pruned.
+    """
+    path = output_folder / MANIFEST_NAME
+    if not path.exists():
+        return {}
+    try:
+        manifest = json.loads(path.read_text())
+    except json.JSONDecodeError:
+        return {}
+    files = manifest.get('files', {})
+    if manifest.get('sizes') != sizes_hash:
+        for entry in files.values():
+            entry['hash'] = None
+    return files
+
+
+def _save_manifest(output_folder: Path, sizes_hash: str, files: dict[str, dict]):
+    (output_folder / MANIFEST_NAME).write_text(json.dumps({'sizes': sizes_hash, 'files': files},
+                                                          indent=2, sort_keys=True))
+
+
+def _remove_outputs(output_folder: Path, outputs: set[str]):
+    for _output in outputs:
+        logger.debug(f'\tremoving stale output {_output}')
+        (output_folder / _output).unlink(missing_ok=True)
+
+
 def run_icons(
         icons_folder: Path | None = Option(None, '--folder', help='Folder containing svg icons to convert'),
         icon: Path | None = Option(None, '-f', '--file', help='Svg icon to convert'),
-        output_folder=Option(..., '-o', '--output', help='Folder where to write the output')
+        output_folder: Path = Option(..., '-o', '--output', help='Folder where to write the output'),
+        force: bool = Option(False, '--force', help='Renders all the icons, even the unchanged ones'),
+        jobs: int | None = Option(None, '-j', '--jobs', help='Number of rendering processes (default: CPU count)'),
+        profiles_path: Path | None = Option(None, '--profiles', help='JSON / TOML file describing the sizes to render')
 ):
-    # Import here to avoid error
-    from cairosvg import svg2png
-
     files = []
     if icons_folder:
         files += list(icons_folder.glob('*.svg'))
@@ -32,14 +221,37 @@ def run_icons(
         logging.error('Please specify either --folder or --file')
         return
 
+    profiles = load_profiles(profiles_path) if profiles_path else _DEFAULT_PROFILES
+    sizes_hash = _hash_profiles(profiles)
+    for profile in profiles.values():
+        (output_folder / profile.folder).mkdir(parents=True, exist_ok=True)
+    manifest = _load_manifest(output_folder, sizes_hash)
+
+    # Outputs of the svgs removed from the folder
+    if icons_folder and not icon:
+        for _removed in manifest.keys() - {x.name for x in files}:
+            _remove_outputs(output_folder, set(manifest.pop(_removed)['outputs']))
+
+    tasks = []
     for file in files:
-        for ext, _default_size in _DEFAULT_SIZES.items():
-            for _format in _default_size.formats:
-                _file_ext = (f'@{_format}x' if _format > 1 else '') + ext
-                _output_file = file.name.replace(file.suffix, '') + _file_ext + '.png'
-                output_size = _default_size.size * _format
-                logger.info(f'\tsize: {output_size:<4} | ext: {_file_ext}')
-                svg2png(url=str(file),
-                        output_height=output_size,
-                        output_width=output_size,
-                        write_to=str(output_folder / _output_file))
+        file_hash = hashlib.sha256(file.read_bytes()).hexdigest()
+        outputs = get_outputs(file, profiles)
+        previous = manifest.get(file.name)
+        if (not force and previous and previous['hash'] == file_hash
+                and all((output_folder / x).exists() for x in outputs)):
+            continue
+
+        logger.info(f'Rendering {file.name}')
+        tasks.append((file, outputs, file_hash))
+        if previous:
+            _remove_outputs(output_folder, set(previous['outputs']) - outputs.keys())
+        manifest[file.name] = {'hash': file_hash, 'outputs': sorted(outputs)}
+
+    with span('icons.render'):
+        render_icons(tasks, output_folder, jobs=jobs or os.cpu_count() or 1)
+    incr('icons.rendered', len(tasks))
+    incr('icons.unchanged', len(files) - len(tasks))
+    incr('icons.outputs', sum(len(x) for _, x, _ in tasks))
+
+    _save_manifest(output_folder, sizes_hash, manifest)
+    logger.info(f'{len(tasks)} icon(s) rendered, {len(files) - len(tasks)} unchanged')
@@ -0,0 +1,139 @@
+import re
+from dataclasses import dataclass, field
+
+# Multi-line objects of the types needed to find the build settings of a target.
+# Xcode writes each object as `ID /* comment */ = {` ... `};` at the same indentation.
+_OBJECT_REG = re.compile(
+    r'^(?P<indent>[ \t]*)(?P<id>[0-9A-Fa-f]{24})(?: /\*[^\n]*?\*/)? = \{\n\s*'
+    r'isa = (?P<isa>PBXNativeTarget|PBXProject|XCConfigurationList|XCBuildConfiguration);'
+    r'(?P<body>.*?)^(?P=indent)\};',
+    flags=re.MULTILINE | re.DOTALL)
+_ID_REG = re.compile(r'[0-9A-Fa-f]{24}')
+_CONFIGURATION_LIST_REG = re.compile(r'^\s*buildConfigurationList = (?P<id>[0-9A-Fa-f]{24})', flags=re.MULTILINE)
+_CONFIGURATIONS_REG = re.compile(r'^\s*buildConfigurations = \((?P<ids>.*?)\);', flags=re.MULTILINE | re.DOTALL)
+_BUILD_SETTINGS_REG = re.compile(r'^(?P<indent>\s*)buildSettings = \{(?P<settings>.*?)^(?P=indent)\};',
+                                 flags=re.MULTILINE | re.DOTALL)
+_NAME_REG = re.compile(r'^\s*name = (?P<name>"[^"]*"|[^;]+);', flags=re.MULTILINE)
+_SETTING_REG = re.compile(r'^(?P<prefix>\s*(?P<key>[A-Z_][A-Z0-9_]*) = )(?P<value>"[^"\n]*"|[^;\n(]*);',
+                          flags=re.MULTILINE)
+
+
+@dataclass
+class BuildConfiguration:
+    """
+    `settings` is the span of the text of the buildSettings block (without the braces)
+    """
+    id: str
+    name: str
+    settings: tuple[int, int]
+    target: str | None = None
+
+
+@dataclass
+class SettingChange:
+    target: str | None
+    configuration: str
+    setting: str
+    old: str
+    new: str
+
+
+@dataclass
+class PbxProject:
+    """
+    Build configurations of a project.pbxproj, keyed by target name (None for the project level ones)
+    """
+    text: str
+    configurations: dict[str | None, list[BuildConfiguration]] = field(default_factory=dict)
+
+    @property
+    def targets(self) -> list[str]:
+        return [x for x in self.configurations if x is not None]
+
+
+def _unquote(value: str) -> str:
+    return value[1:-1] if value.startswith('"') else value.strip()
+
+
+def parse_pbxproj(text: str) -> PbxProject:
+    """
+    Locates the buildSettings block of every configuration in a single scan of the file
+    """
+    configurations: dict[str, BuildConfiguration] = {}
+    lists: dict[str, list[str]] = {}
+    owners: dict[str, str | None] = {}
+
+    for obj in _OBJECT_REG.finditer(text):
+        isa, body = obj.group('isa'), obj.group('body')
+        body_start = obj.start('body')
+        match isa:
+            case 'XCBuildConfiguration':
+                settings = _BUILD_SETTINGS_REG.search(body)
+                name = _NAME_REG.search(body[settings.end():] if settings else body)
+                if settings and name:
+                    configurations[obj.group('id')] = BuildConfiguration(
+                        id=obj.group('id'),
+                        name=_unquote(name.group('name')),
+                        settings=(body_start + settings.start('settings'), body_start + settings.end('settings')))
+            case 'XCConfigurationList':
+                if ids := _CONFIGURATIONS_REG.search(body):
+                    lists[obj.group('id')] = _ID_REG.findall(ids.group('ids'))
+            case 'PBXNativeTarget' | 'PBXProject':
+                if config_list := _CONFIGURATION_LIST_REG.search(body):
+                    name = _NAME_REG.search(body) if isa == 'PBXNativeTarget' else None
+                    owners[config_list.group('id')] = _unquote(name.group('name')) if name else None
+
+    project = PbxProject(text)
+    for list_id, config_ids in lists.items():
+        target = owners.get(list_id)
+        for config_id in config_ids:
+            if config := configurations.get(config_id):
+                config.target = target
+                project.configurations.setdefault(target, []).append(config)
+    return project
+
+
+def update_build_settings(text: str,
+                          settings: dict[str, str],
+                          targets: list[str] | None = None,
+                          configurations: list[str] | None = None) -> tuple[str, list[SettingChange]]:
+    """
+    Sets the values of the existing `settings` in the buildSettings blocks of `targets` (all the targets
+    and the project level configurations by default), for the `configurations` (all by default).
+    Only these blocks are rewritten, the rest of the file is copied as is.
+    Returns the new text and the settings found (changed or not).
+    """
+    project = parse_pbxproj(text)
+    if targets is not None:
+        unknown = set(targets) - set(project.targets)
+        if unknown:
+            raise ValueError(f'Unknown target(s) {", ".join(sorted(unknown))} '
+                             f'(available: {", ".join(project.targets)})')
+
+    selected = sorted((config
+                       for target, configs in project.configurations.items()
+                       if targets is None or target in targets
+                       for config in configs
+                       if configurations is None or config.name in configurations),
+                      key=lambda x: x.settings)
+
+    changes = []
+    parts = []
+    position = 0
+
+    for config in selected:
+        start, end = config.settings
+
+        def _replace(match: re.Match) -> str:
+            key = match.group('key')
+            if key not in settings:
+                return match.group(0)
+            changes.append(SettingChange(config.target, config.name, key, _unquote(match.group('value')),
+                                         settings[key]))
+            return f'{match.group("prefix")}{settings[key]};'
+
+        parts += [text[position:start], _SETTING_REG.sub(_replace, text[start:end])]
+        position = end
+
+    parts.append(text[position:])
+    return ''.join(parts), changes
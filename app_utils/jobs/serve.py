@@ -0,0 +1,46 @@
+import importlib.util
+from pathlib import Path
+
+from piou import Option
+
+from app_utils.daemon import DEFAULT_SOCKET, JobServer
+from app_utils.logs import logger
+
+
+def _warm_up():
+    """
+    Imports every command and the optional dependencies once, and keeps one connection pool
+    for the Play Publisher API
+    """
+    # Import here to avoid circular import
+    from app_utils.__main__ import get_cli
+    from app_utils.jobs.android.client import enable_shared_http
+
+    get_cli()
+    enable_shared_http()
+    for module in ('cairosvg', 'PIL.Image'):
+        if importlib.util.find_spec(module.split('.')[0]) is not None:
+            try:
+                importlib.import_module(module)
+            except OSError as e:
+                # cairosvg raises if the cairo library is missing
+                logger.warning(f'Could not load {module}: {e}')
+
+
+def run_serve(
+        socket_path: str = Option(str(DEFAULT_SOCKET), '--socket', help='Path of the Unix socket to listen on'),
+):
+    """
+    Keeps a warm process running the commands sent by `client`, so that they skip the interpreter startup
+    and the imports, and reuse the parsed changelogs, svgs, tokens and HTTP connections:
+        cli serve &
+        cli client changelog -p CHANGELOG.md -l
+    Jobs are run one at a time, from the working directory of the client.
+    """
+    _warm_up()
+    with JobServer(Path(socket_path)) as server:
+        logger.info(f'Listening on {socket_path}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -1,12 +1,20 @@
+import glob
+import os
 import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Literal
 
 from piou import Option
 
-from app_utils.jobs.changelog import parse_markdown
+from app_utils.jobs.changelog import get_last_release, Release
+from app_utils.jobs.pbxproj import update_build_settings, SettingChange
 from app_utils.logs import logger
+from app_utils.metrics import span, incr
+from app_utils.utils import write_atomic
+
+_ANDROID_VERSION_REG = re.compile(r'ext\.version(?P<part>Major|Minor|Patch) = \d+')
 
 
 def update_android_version(project: Path, version: str):
@@ -15,46 +23,85 @@ def update_android_version(project: Path, version: str):
     logger.info(f'Last version found: {version}')
 
     _major, _minor, _patch = version.split('.')
-    text = build_file.read_text()
-    replacements = [
-        ('ext.versionMajor', _major),
-        ('ext.versionMinor', _minor),
-        ('ext.versionPatch', _patch)
-    ]
-
-    for _to_replace, _version in replacements:
-        text = re.sub(rf'{re.escape(_to_replace)} = \d+', f'{_to_replace} = {_version}', text)
+    parts = {'Major': _major, 'Minor': _minor, 'Patch': _patch}
+    text = _ANDROID_VERSION_REG.sub(lambda m: f'ext.version{m.group("part")} = {parts[m.group("part")]}',
+                                    build_file.read_text())
 
-    build_file.write_text(text)
+    write_atomic(build_file, text)
     logger.info(f'Build file updated @{build_file}')
 
 
-_MARKET_VERSION_REG = re.compile(r'(MARKETING_VERSION) = \d+\.\d+(\.\d+)?;')
-_CURRENT_PROJECT_VERSION_REG = re.compile(r'(CURRENT_PROJECT_VERSION) = \d+;')
-
-
 def update_ios_version(project: Path,
                        version: str,
                        version_code: int,
-                       project_name: str):
+                       project_name: str,
+                       targets: list[str] | None = None) -> list[SettingChange]:
+    """
+    Updates the MARKETING_VERSION and CURRENT_PROJECT_VERSION of the `targets` (all by default)
+    """
     pbxproj_path = project / 'ios' / f'{project_name}.xcodeproj' / 'project.pbxproj'
 
     _major, _minor, _patch = version.split('.')
-    text = pbxproj_path.read_text()
-
-    if not _MARKET_VERSION_REG.findall(text):
-        raise NotImplementedError(f'Could not find MARKETING_VERSION in {pbxproj_path!r}')
-    text = _MARKET_VERSION_REG.sub(fr'\1 = {_major}.{_minor}.{_patch};', text)
+    text, changes = update_build_settings(pbxproj_path.read_text(),
+                                          {'MARKETING_VERSION': f'{_major}.{_minor}.{_patch}',
+                                           'CURRENT_PROJECT_VERSION': str(version_code)},
+                                          targets=targets)
+    for _setting in ('MARKETING_VERSION', 'CURRENT_PROJECT_VERSION'):
+        if not any(x.setting == _setting for x in changes):
+            raise NotImplementedError(f'Could not find {_setting} in {pbxproj_path!r}')
+
+    for change in changes:
+        if change.old != change.new:
+            logger.info(f'\t{change.target or "(project)"} [{change.configuration}] '
+                        f'{change.setting}: {change.old} -> {change.new}')
+    write_atomic(pbxproj_path, text)
+    logger.info(f'Project.pbxproj updated @{pbxproj_path} '
+                f'({sum(x.old != x.new for x in changes)} setting(s) changed)')
+    return changes
+
+
+def get_ios_project_name(project: Path) -> str:
+    """
+    Returns the name of the only `.xcodeproj` of the `ios` folder
+    """
+    names = [x.stem for x in (project / 'ios').glob('*.xcodeproj')]
+    if len(names) != 1:
+        raise ValueError(f'Expected one .xcodeproj in {project / "ios"}, found {len(names)}, please specify --name')
+    return names[0]
 
-    if not _CURRENT_PROJECT_VERSION_REG.findall(text):
-        raise NotImplementedError(f'Could not find CURRENT_PROJECT_VERSION in {pbxproj_path!r}')
-    text = _CURRENT_PROJECT_VERSION_REG.sub(fr'\1 = {version_code};', text)
 
-    pbxproj_path.write_text(text)
-    logger.info(f'Project.pbxproj updated @{pbxproj_path}')
+AppType = Literal['ios', 'android']
 
 
-AppType = Literal['ios', 'android']
+def update_version(project: Path,
+                   app_type: AppType,
+                   release: Release,
+                   project_name: str | None = None,
+                   targets: list[str] | None = None):
+    with span(f'update_version.{app_type}'):
+        match app_type:
+            case 'android':
+                update_android_version(project, version=release.version)
+            case 'ios':
+                update_ios_version(project, version=release.version,
+                                   version_code=release.version_code,
+                                   project_name=project_name or get_ios_project_name(project),
+                                   targets=targets)
+            case _:
+                raise NotImplementedError(f'Got invalid app_type {app_type!r}')
+    incr('update_version.files')
+
+
+def iter_projects(patterns: list[str]) -> list[Path]:
+    """
+    Expands the project paths / glob patterns, keeping the folders only (once each)
+    """
+    projects = {}
+    for pattern in patterns:
+        for path in sorted(glob.glob(os.path.expanduser(pattern))) if glob.has_magic(pattern) else [pattern]:
+            if Path(path).is_dir():
+                projects.setdefault(Path(path).resolve(), None)
+    return list(projects)
 
 
 def run_update_version(
@@ -66,32 +113,64 @@ def run_update_version(
         project_name: str | None = Option(None, '--name',
                                           help='Project name (iOS only)'),
         version_path: str | None = Option(None, '--version', help='Path where to store the version built'),
+        targets: list[str] | None = Option(None, '--targets', help='iOS targets to update (default: all)'),
 ):
     """
     Utility to update the version depending on the platform using the CHANGELOG.md file:
      - **Android**: updates the versionMajor/Minor/Patch in *app/build.gradle*
      - **iOS**: updates the MARKETING_VERSION and CURRENT_PROJECT_VERSION *ios/app.xcodeproj/project.pbxproj*
+       of every target, or only of --targets
     """
 
-    releases = parse_markdown(changelog)
+    last_release = get_last_release(changelog)
 
     output_version = Path(version_path) if version_path else None
 
-    last_release = releases[0]
     last_version = last_release.version
-    match app_type:
-        case 'android':
-            update_android_version(project_path, version=last_version)
-        case 'ios':
-            if project_name is None:
-                logger.error('Please specify a project name (--name)')
-                sys.exit(1)
-            update_ios_version(project_path, version=last_release.version,
-                               version_code=last_release.version_code,
-                               project_name=project_name)
-        case _:
-            raise NotImplementedError(f'Got invalid app_type {app_type!r}')
+    if app_type == 'ios' and project_name is None:
+        logger.error('Please specify a project name (--name)')
+        sys.exit(1)
+    update_version(project_path, app_type, last_release, project_name=project_name, targets=targets)
 
     if output_version:
         logger.info(f'Creating version file @{output_version} ({last_version})')
         output_version.write_text(last_version)
+
+
+def run_update_versions(
+        projects: list[str] = Option(..., '--projects', help='Paths (or glob patterns) of the RN projects'),
+        changelog: Path = Option('/project/CHANGELOG.md', '--changelog', help='Changelog path'),
+        app_types: list[AppType] = Option(['android', 'ios'], '--types', help='Platforms to update'),
+        jobs: int | None = Option(None, '-j', '--jobs', help='Number of files updated at the same time'),
+        targets: list[str] | None = Option(None, '--targets', help='iOS targets to update (default: all)'),
+):
+    """
+    Same as update-version for several projects and platforms at once, with the changelog parsed once.
+    The iOS project name of each project is found from its ios/*.xcodeproj folder.
+        app-utils update-versions --projects "apps/*" --changelog CHANGELOG.md
+    """
+    last_release = get_last_release(changelog)
+    logger.info(f'Last version found: {last_release.version}')
+
+    _projects = iter_projects(projects)
+    if not _projects:
+        logger.error(f'No project found for {projects!r}')
+        sys.exit(1)
+
+    def _update(task: tuple[Path, AppType]) -> str | None:
+        project, app_type = task
+        try:
+            update_version(project, app_type, last_release, targets=targets)
+        except (OSError, ValueError, NotImplementedError) as e:
+            logger.error(f'[{project.name}] Could not update {app_type} version: {e}')
+            return f'{project} ({app_type})'
+        return None
+
+    tasks = [(project, app_type) for project in _projects for app_type in app_types]
+    with ThreadPoolExecutor(max_workers=jobs or min(32, (os.cpu_count() or 1) + 4)) as executor:
+        errors = [x for x in executor.map(_update, tasks) if x]
+
+    logger.info(f'{len(tasks) - len(errors)} file(s) updated in {len(_projects)} project(s)')
+    if errors:
+        logger.error(f'Failed: {", ".join(errors)}')
+        sys.exit(1)
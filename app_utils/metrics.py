@@ -0,0 +1,90 @@
+"""
+Durations of the stages of the jobs (spans) and counters (bytes sent, retries, files processed...),
+written to a JSON file with the `--metrics-json` option of the cli:
+    {
+        "started_at": 1700000000.0,
+        "duration": 12.3,
+        "spans": {"android.upload": {"count": 1, "total": 10.2, "max": 10.2, "errors": 0}},
+        "counters": {"android.bytes_uploaded": 52428800}
+    }
+Spans recorded in worker processes (icons rendering with several jobs) are not collected.
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Iterator
+
+
+@dataclass
+class SpanStats:
+    count: int = 0
+    total: float = 0
+    max: float = 0
+    errors: int = 0
+
+
+class Metrics:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.spans: dict[str, SpanStats] = {}
+        self.counters: dict[str, float] = {}
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.output: Path | None = None
+
+    def reset(self, output: Path | None = None):
+        with self._lock:
+            self.spans, self.counters = {}, {}
+            self.started_at, self._start = time.time(), time.perf_counter()
+            self.output = output
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """
+        Times the block, which is counted as an error if it raises
+        """
+        start = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self.record(name, time.perf_counter() - start, failed)
+
+    def record(self, name: str, duration: float, failed: bool = False):
+        with self._lock:
+            stats = self.spans.setdefault(name, SpanStats())
+            stats.count += 1
+            stats.total += duration
+            stats.max = max(stats.max, duration)
+            stats.errors += failed
+
+    def incr(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {'started_at': self.started_at,
+                    'duration': time.perf_counter() - self._start,
+                    'spans': {name: asdict(stats) for name, stats in sorted(self.spans.items())},
+                    'counters': dict(sorted(self.counters.items()))}
+
+    def flush(self):
+        """
+        Writes the metrics to `output` (if set)
+        """
+        if self.output is not None:
+            self.output.write_text(json.dumps(self.to_dict(), indent=2))
+            self.output = None
+
+
+metrics = Metrics()
+span = metrics.span
+incr = metrics.incr
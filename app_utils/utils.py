@@ -1,17 +1,148 @@
+import hashlib
+import shlex
 import subprocess
 import os
+import threading
+from collections import deque
+from pathlib import Path
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Iterable, Iterator, TypeVar
 
+T = TypeVar('T')
+R = TypeVar('R')
 
-def exec_cmd(cmd: str | list[str],
+
+# Number of output lines kept to describe a failed command
+_ERROR_TAIL = 20
+
+
+class CommandError(Exception):
+    def __init__(self, cmd: list[str], returncode: int | None, output: list[str], timeout: float | None = None):
+        self.cmd = cmd
+        self.returncode = returncode
+        self.output = output
+        self.timeout = timeout
+        reason = f'timed out after {timeout}s' if timeout is not None else f'failed with code {returncode}'
+        super().__init__('\n'.join([f'{shlex.join(cmd)} {reason}', *output]))
+
+
+def run_cmd(cmd: list[str],
+            *,
+            timeout: float | None = None,
+            cwd: Path | None = None,
+            env: dict[str, str] | None = None,
+            on_line: Callable[[str], None] | None = None,
+            encoding: str = 'utf-8'):
+    """
+    Runs `cmd` without a shell and passes each line of its output (stdout and stderr) to `on_line`
+    (logged at debug level by default). Raises a `CommandError` if the command fails or takes more than `timeout`.
+    """
+    # Import here to avoid loading rich (used by app_utils.logs) with app_utils.utils
+    from app_utils.logs import logger
+
+    name = Path(cmd[0]).name
+    on_line = on_line or (lambda _line: logger.debug(f'[{name}] {_line}'))
+    tail: deque[str] = deque(maxlen=_ERROR_TAIL)
+    timed_out = threading.Event()
+
+    with subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                          cwd=cwd, env=env, encoding=encoding, errors='replace') as process:
+
+        def _kill():
+            timed_out.set()
+            process.kill()
+
+        timer = threading.Timer(timeout, _kill) if timeout is not None else None
+        if timer:
+            timer.start()
+        # Always set, stdout is a pipe
+        assert process.stdout is not None
+        try:
+            for line in process.stdout:
+                line = line.rstrip('\n')
+                tail.append(line)
+                on_line(line)
+            returncode = process.wait()
+        finally:
+            if timer:
+                timer.cancel()
+
+    if timed_out.is_set():
+        raise CommandError(cmd, returncode, list(tail), timeout=timeout)
+    if returncode != 0:
+        raise CommandError(cmd, returncode, list(tail))
+
+
+def run_cmds(cmds: Iterable[list[str]],
              *,
-             encoding: str = 'utf-8') -> str:
-    default_shell = os.getenv('SHELL', '/bin/bash')
-
-    stdout, stderr = subprocess.Popen(cmd,
-                                      shell=True,
-                                      stdout=subprocess.PIPE,
-                                      stderr=subprocess.PIPE,
-                                      executable=default_shell).communicate()
-    if stderr:
-        raise Exception(stderr.decode(encoding))
-    return stdout.decode(encoding)
+             jobs: int | None = None,
+             timeout: float | None = None) -> Iterator[tuple[list[str], CommandError | None]]:
+    """
+    Runs the commands with at most `jobs` (default: CPU count) at a time, yielding each command
+    with its error (None if it succeeded) in completion order
+    """
+
+    def _run(cmd: list[str]) -> tuple[list[str], CommandError | None]:
+        try:
+            run_cmd(cmd, timeout=timeout)
+        except CommandError as e:
+            return cmd, e
+        return cmd, None
+
+    _jobs = jobs or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=_jobs) as executor:
+        yield from bounded_map(executor, _run, cmds, max_pending=2 * _jobs)
+
+
+def write_atomic(path: Path, text: str):
+    """
+    Writes `text` to a temporary file next to `path` and renames it, so that `path` is never half-written
+    """
+    tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    try:
+        tmp_path.write_text(text)
+        if path.exists():
+            tmp_path.chmod(path.stat().st_mode & 0o7777)
+        tmp_path.replace(path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def get_file_hash(path: Path) -> str:
+    """
+    SHA-256 of the file, read in chunks
+    """
+    file_hash = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(1024 * 1024):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def get_cache_dir(name: str) -> Path:
+    """
+    Returns (and creates) the cache folder `name`, under $APP_UTILS_CACHE_DIR or $XDG_CACHE_HOME/app-utils
+    """
+    root = os.getenv('APP_UTILS_CACHE_DIR') or Path(os.getenv('XDG_CACHE_HOME') or Path.home() / '.cache') / 'app-utils'
+    path = Path(root) / name
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def bounded_map(executor: Executor,
+                func: Callable[[T], R],
+                items: Iterable[T],
+                max_pending: int) -> Iterator[R]:
+    """
+    Same as `executor.map` but consumes `items` lazily: at most `max_pending` tasks are
+    submitted at a time. Results are yielded in completion order.
+    """
+    pending: set[Future] = set()
+    for item in items:
+        if len(pending) >= max_pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+        pending.add(executor.submit(func, item))
+    for future in wait(pending).done:
+        yield future.result()
@@ -0,0 +1,95 @@
+"""
+Runs the benchmarks of the jobs on synthetic inputs and reports their throughput and peak memory
+
+    python -m benchmarks -o results.json
+    python -m benchmarks --only changelog crop --scale 0.2
+    python -m benchmarks --compare results.json
+
+The JSON output can be diffed between versions: each result has a `name`, the number of `items`
+processed (`unit`), the `duration` (s), the `throughput` (items/s) and the `peak_memory` (bytes).
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import traceback
+from importlib.metadata import version, PackageNotFoundError
+from pathlib import Path
+
+BENCHMARKS = ['changelog', 'update_version', 'crop', 'icons', 'upload']
+
+
+def _get_version() -> str | None:
+    try:
+        return version('app-utils')
+    except PackageNotFoundError:
+        return None
+
+
+def run_benchmarks(names: list[str], scale: float) -> tuple[list[dict], dict[str, str]]:
+    results, skipped = [], {}
+    with tempfile.TemporaryDirectory() as tmp:
+        # Keeps the changelog cache of the user untouched
+        os.environ['APP_UTILS_CACHE_DIR'] = str(Path(tmp) / 'cache')
+        for name in names:
+            folder = Path(tmp) / name
+            folder.mkdir()
+            try:
+                module = importlib.import_module(f'benchmarks.{name}')
+                results += [x.to_dict() for x in module.run(folder, scale)]
+            except (ImportError, OSError) as e:
+                # Missing optional dependency (Pillow, cairo, imagemagick...)
+                skipped[name] = f'{type(e).__name__}: {e}'.splitlines()[0]
+            except Exception:
+                traceback.print_exc()
+                skipped[name] = 'failed'
+    return results, skipped
+
+
+def _format_memory(nb_bytes: int) -> str:
+    return f'{nb_bytes / 1024 ** 2:.1f} MiB'
+
+
+def print_results(results: list[dict], skipped: dict[str, str], previous: dict[str, dict] | None = None):
+    for result in results:
+        line = (f'{result["name"]:<26} {result["throughput"]:>12.1f} {result["unit"] + "/s":<12}'
+                f' {result["duration"]:>8.3f} s  peak {_format_memory(result["peak_memory"]):>10}')
+        if previous and (before := previous.get(result['name'])) and before['throughput']:
+            line += f'  x{result["throughput"] / before["throughput"]:.2f}'
+        print(line)
+    for name, reason in skipped.items():
+        print(f'{name:<26} skipped ({reason})')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=BENCHMARKS)
+    parser.add_argument('--scale', type=float, default=1, help='Multiplies the size of the inputs')
+    parser.add_argument('-o', '--output', type=Path, help='Writes the results to this JSON file')
+    parser.add_argument('--compare', type=Path, help='JSON results of a previous run, prints the speedups')
+    args = parser.parse_args()
+
+    results, skipped = run_benchmarks(args.only, args.scale)
+
+    previous = None
+    if args.compare:
+        previous = {x['name']: x for x in json.loads(args.compare.read_text())['results']}
+    print_results(results, skipped, previous)
+
+    if args.output:
+        args.output.write_text(json.dumps({
+            'version': _get_version(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'scale': args.scale,
+            'results': results,
+            'skipped': skipped,
+        }, indent=2))
+    sys.exit(1 if 'failed' in skipped.values() else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+"""
+Parsing and HTML rendering of a large changelog
+"""
+from pathlib import Path
+
+from app_utils.jobs.changelog import parse_markdown, render_html, get_last_release, _CHANGELOGS
+from app_utils.utils import get_cache_dir
+from .generators import gen_changelog
+from .utils import BenchResult, measure
+
+
+def run(folder: Path, scale: float) -> list[BenchResult]:
+    nb_releases = int(2000 * scale)
+    path = folder / 'CHANGELOG.md'
+    gen_changelog(path, nb_releases)
+
+    releases = parse_markdown(path)
+    texts = [note.text for release in releases for note in release.release_notes]
+
+    def _render():
+        for text in texts:
+            render_html.__wrapped__(text)
+
+    return [
+        measure('changelog.parse', lambda: parse_markdown(path), nb_releases, 'releases'),
+        measure('changelog.render', _render, len(texts), 'notes'),
+        # Cold cache: only the first release is parsed
+        measure('changelog.last_release', lambda: get_last_release(path), 1, 'releases',
+                setup=lambda: (_CHANGELOGS.clear(), [x.unlink() for x in get_cache_dir('changelog').glob('*.json')])),
+    ]
@@ -0,0 +1,24 @@
+"""
+Cropping of full size screenshots, with each backend
+"""
+import shutil
+from pathlib import Path
+
+from app_utils.jobs.crop import run_crop
+from .generators import gen_screenshots
+from .utils import BenchResult, measure
+
+
+def run(folder: Path, scale: float) -> list[BenchResult]:
+    nb_images = int(50 * scale)
+    input_folder, output_folder = folder / 'screenshots', folder / 'cropped'
+    input_folder.mkdir()
+    gen_screenshots(input_folder, nb_images)
+
+    backends = ['pillow'] + (['convert'] if shutil.which('convert') else [])
+    return [measure(f'crop.{backend}',
+                    lambda: run_crop(folder=input_folder, output_folder=output_folder, extensions=['png'],
+                                     image_dim=None, from_top=None, from_bottom=None, backend=backend,
+                                     jobs=None, incremental=False),
+                    nb_images, 'images')
+            for backend in backends]
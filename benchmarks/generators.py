@@ -0,0 +1,95 @@
+"""
+Synthetic inputs of the benchmarks
+"""
+from pathlib import Path
+
+
+def gen_changelog(path: Path, nb_releases: int):
+    sections = []
+    for i in range(nb_releases, 0, -1):
+        sections.append(f'## [v{i // 100}.{i // 10 % 10}.{i % 10}]\n'
+                        f' - **fr-FR**:\n     ### 🔥 Nouveautés\n     - Une **nouvelle** page _rapide_ ({i})\n'
+                        f' - **en-US**:\n     ### 🔥 New\n     - A **new** *fast* page, see [docs](https://example.com/{i})\n')
+    path.write_text('# Changelog\n\n' + '\n'.join(sections))
+
+
+def gen_svgs(folder: Path, nb_icons: int):
+    for i in range(nb_icons):
+        paths = ''.join(f'<path d="M{j} {i % 24} L24 {j} L{24 - j} 24 Z" fill="#{(i * 97 + j * 13) % 0xffffff:06x}"/>'
+                        for j in range(0, 24, 3))
+        (folder / f'icon_{i}.svg').write_text(
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="24" height="24" viewBox="0 0 24 24">'
+            f'<circle cx="12" cy="12" r="{4 + i % 8}" fill="none" stroke="#333" stroke-width="2"/>{paths}</svg>')
+
+
+def gen_screenshots(folder: Path, nb_images: int, size: tuple[int, int] = (1080, 2400)):
+    # Import here to avoid error
+    from PIL import Image
+
+    # Screenshots are mostly flat areas: a gradient compresses like a real one
+    image = Image.linear_gradient('L').resize(size).convert('RGB')
+    for i in range(nb_images):
+        image.save(folder / f'screenshot_{i}.png')
+
+
+def _gen_id(*values: int) -> str:
+    return ''.join(f'{x:08X}' for x in values)[:24].ljust(24, '0')
+
+
+def gen_pbxproj(path: Path, nb_targets: int, nb_files: int = 50):
+    """
+    Writes a project.pbxproj with `nb_targets` targets (Debug / Release configurations) and
+    `nb_files` files per target, laid out like Xcode does
+    """
+    files, targets, configurations, lists = [], [], [], []
+    for t in range(nb_targets):
+        name = f'Target{t}'
+        for f in range(nb_files):
+            files.append(f'\t\t{_gen_id(1, t, f)} /* File{f}.m in Sources */ = '
+                         f'{{isa = PBXBuildFile; fileRef = {_gen_id(2, t, f)} /* File{f}.m */; }};\n')
+        list_id = _gen_id(3, t, 0)
+        targets.append(f'\t\t{_gen_id(4, t, 0)} /* {name} */ = {{\n'
+                       f'\t\t\tisa = PBXNativeTarget;\n'
+                       f'\t\t\tbuildConfigurationList = {list_id} /* Build configuration list for PBXNativeTarget "{name}" */;\n'
+                       f'\t\t\tbuildPhases = (\n\t\t\t);\n'
+                       f'\t\t\tname = {name};\n'
+                       f'\t\t\tproductName = {name};\n'
+                       f'\t\t}};\n')
+        config_ids = []
+        for c, config in enumerate(('Debug', 'Release')):
+            config_id = _gen_id(5, t, c)
+            config_ids.append(f'\t\t\t\t{config_id} /* {config} */,\n')
+            configurations.append(f'\t\t{config_id} /* {config} */ = {{\n'
+                                  f'\t\t\tisa = XCBuildConfiguration;\n'
+                                  f'\t\t\tbuildSettings = {{\n'
+                                  f'\t\t\t\tCURRENT_PROJECT_VERSION = 1;\n'
+                                  f'\t\t\t\tLD_RUNPATH_SEARCH_PATHS = (\n'
+                                  f'\t\t\t\t\t"$(inherited)",\n'
+                                  f'\t\t\t\t\t"@executable_path/Frameworks",\n'
+                                  f'\t\t\t\t);\n'
+                                  f'\t\t\t\tMARKETING_VERSION = 1.0.0;\n'
+                                  f'\t\t\t\tPRODUCT_NAME = "$(TARGET_NAME)";\n'
+                                  f'\t\t\t}};\n'
+                                  f'\t\t\tname = {config};\n'
+                                  f'\t\t}};\n')
+        lists.append(f'\t\t{list_id} /* Build configuration list for PBXNativeTarget "{name}" */ = {{\n'
+                     f'\t\t\tisa = XCConfigurationList;\n'
+                     f'\t\t\tbuildConfigurations = (\n{"".join(config_ids)}\t\t\t);\n'
+                     f'\t\t\tdefaultConfigurationName = Release;\n'
+                     f'\t\t}};\n')
+
+    path.write_text('// !$*UTF8*$!\n{\n\tarchiveVersion = 1;\n\tobjects = {\n\n'
+                    f'/* Begin PBXBuildFile section */\n{"".join(files)}/* End PBXBuildFile section */\n\n'
+                    f'/* Begin PBXNativeTarget section */\n{"".join(targets)}/* End PBXNativeTarget section */\n\n'
+                    f'/* Begin XCBuildConfiguration section */\n{"".join(configurations)}'
+                    f'/* End XCBuildConfiguration section */\n\n'
+                    f'/* Begin XCConfigurationList section */\n{"".join(lists)}/* End XCConfigurationList section */\n'
+                    '\t};\n}\n')
+
+
+def gen_bundle(path: Path, size: int):
+    with open(path, 'wb') as f:
+        block = bytes(range(256)) * 4096
+        for _ in range(size // len(block)):
+            f.write(block)
+        f.write(block[:size % len(block)])
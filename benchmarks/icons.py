@@ -0,0 +1,26 @@
+"""
+Rendering of many svg icons to the default sizes
+"""
+import shutil
+from pathlib import Path
+
+from app_utils.jobs.icons import render_icons, get_outputs, _DEFAULT_PROFILES, _parse_svg
+from .generators import gen_svgs
+from .utils import BenchResult, measure
+
+
+def run(folder: Path, scale: float) -> list[BenchResult]:
+    nb_icons = int(50 * scale)
+    input_folder, output_folder = folder / 'svgs', folder / 'icons'
+    input_folder.mkdir()
+    gen_svgs(input_folder, nb_icons)
+    tasks = [(x, get_outputs(x, _DEFAULT_PROFILES), x.name) for x in sorted(input_folder.glob('*.svg'))]
+
+    def _setup():
+        _parse_svg.cache_clear()
+        shutil.rmtree(output_folder, ignore_errors=True)
+        output_folder.mkdir()
+
+    # In process, the memory of the worker processes would not be measured
+    return [measure('icons.render', lambda: render_icons(tasks, output_folder, jobs=1), nb_icons, 'icons',
+                    setup=_setup)]
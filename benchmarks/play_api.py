@@ -0,0 +1,135 @@
+"""
+Local HTTP server emulating the Play Publisher API endpoints used by the uploads,
+so that the benchmarks go through real sockets without reaching Google
+"""
+import itertools
+import json
+import threading
+from http import HTTPStatus
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+import httpx
+
+_READ_CHUNK_SIZE = 1024 * 1024
+
+
+class _PlayApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: 'PlayApiServer'
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, data: dict | None = None, headers: dict | None = None):
+        body = json.dumps(data or {}).encode()
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def _skip_body(self) -> int:
+        remaining = size = int(self.headers.get('Content-Length') or 0)
+        while remaining:
+            remaining -= len(self.rfile.read(min(remaining, _READ_CHUNK_SIZE)))
+        return size
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        package_name, _, path = url.path.split('/applications/', 1)[-1].partition('/')
+        parts = path.split('/')
+        match parts:
+            case ['edits']:
+                self._read_body()
+                self._send(HTTPStatus.OK, {'id': f'{package_name}-edit-{next(self.server.ids)}'})
+            case ['edits', _, 'bundles'] if parse_qs(url.query).get('uploadType') == ['resumable']:
+                session_id = next(self.server.ids)
+                self.server.sessions[session_id] = 0
+                self._send(HTTPStatus.OK, headers={'Location': f'{self.server.base_url}/sessions/{session_id}'})
+            case ['edits', _, 'bundles']:
+                self.server.received += self._skip_body()
+                self._send(HTTPStatus.OK, {'versionCode': next(self.server.ids)})
+            case ['edits', edit_id] if edit_id.endswith(':commit'):
+                self._send(HTTPStatus.OK, {'id': edit_id.removesuffix(':commit')})
+            case _:
+                self._send(HTTPStatus.NOT_FOUND, {'error': {'message': 'Not found'}})
+
+    def do_GET(self):
+        if self.path.endswith('/bundles'):
+            # Every benchmark run uploads its bundles again
+            self._send(HTTPStatus.OK, {'bundles': []})
+        else:
+            self._send(HTTPStatus.NOT_FOUND, {'error': {'message': 'Not found'}})
+
+    def do_PUT(self):
+        if self.path.startswith('/sessions/'):
+            session_id = int(self.path.rsplit('/', 1)[-1])
+            _range, total = self.headers['Content-Range'].removeprefix('bytes ').split('/')
+            size = self._skip_body()
+            self.server.received += size
+            self.server.sessions[session_id] += size
+            if self.server.sessions[session_id] >= int(total):
+                self._send(HTTPStatus.OK, {'versionCode': next(self.server.ids)})
+            else:
+                self._send(HTTPStatus.PERMANENT_REDIRECT,
+                           headers={'Range': f'bytes=0-{self.server.sessions[session_id] - 1}'})
+        elif '/tracks/' in self.path:
+            self._send(HTTPStatus.OK, json.loads(self._read_body()))
+        else:
+            self._send(HTTPStatus.NOT_FOUND, {'error': {'message': 'Not found'}})
+
+
+class PlayApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _PlayApiHandler)
+        self.ids = itertools.count(1000)
+        self.sessions: dict[int, int] = {}
+        self.received = 0
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+
+def _to_local(request: httpx.Request, base_url: str) -> httpx.Request:
+    # The clients build the Google URLs, they are sent to the local server instead
+    local = httpx.URL(base_url)
+    request.url = request.url.copy_with(scheme=local.scheme, host=local.host, port=local.port)
+    return request
+
+
+class LocalTransport(httpx.HTTPTransport):
+    def __init__(self, base_url: str, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        return super().handle_request(_to_local(request, self.base_url))
+
+
+class AsyncLocalTransport(httpx.AsyncHTTPTransport):
+    def __init__(self, base_url: str, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await super().handle_async_request(_to_local(request, self.base_url))
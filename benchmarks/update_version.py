@@ -0,0 +1,22 @@
+"""
+Update of the versions of a large project.pbxproj
+"""
+from pathlib import Path
+
+from app_utils.jobs.pbxproj import update_build_settings
+from .generators import gen_pbxproj
+from .utils import BenchResult, measure
+
+
+def run(folder: Path, scale: float) -> list[BenchResult]:
+    path = folder / 'project.pbxproj'
+    gen_pbxproj(path, nb_targets=int(200 * scale))
+    text = path.read_text()
+    settings = {'MARKETING_VERSION': '1.2.3', 'CURRENT_PROJECT_VERSION': '1002003'}
+    size = len(text.encode()) / 1024 ** 2
+
+    return [
+        measure('pbxproj.update', lambda: update_build_settings(text, settings), size, 'MiB'),
+        measure('pbxproj.update_target', lambda: update_build_settings(text, settings, targets=['Target0']),
+                size, 'MiB'),
+    ]
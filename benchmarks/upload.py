@@ -0,0 +1,54 @@
+"""
+Bundle uploads to a local Play Publisher API (see `play_api.py`)
+"""
+import asyncio
+import json
+from pathlib import Path
+
+import httpx
+
+from app_utils.jobs.android.client import PlayPublisherClient, AsyncPlayPublisherClient
+from app_utils.jobs.android.upload_many import load_manifest, upload_packages
+from app_utils.jobs.android.utils import upload_bundle
+from .generators import gen_bundle, gen_changelog
+from .play_api import PlayApiServer, LocalTransport, AsyncLocalTransport
+from .utils import BenchResult, measure
+
+_MIB = 1024 ** 2
+
+
+def run(folder: Path, scale: float) -> list[BenchResult]:
+    bundle_size = int(64 * scale) * _MIB
+    bundle_path, changelog = folder / 'app.aab', folder / 'CHANGELOG.md'
+    gen_bundle(bundle_path, bundle_size)
+    gen_changelog(changelog, 10)
+
+    nb_packages = int(20 * scale)
+    small_bundle = folder / 'small.aab'
+    gen_bundle(small_bundle, 4 * _MIB)
+    (folder / 'manifest.json').write_text(json.dumps({'packages': [
+        {'package': f'com.app.{i}', 'bundles': ['small.aab'] * 2, 'changelog': 'CHANGELOG.md', 'track': 'internal'}
+        for i in range(nb_packages)
+    ]}))
+    uploads = load_manifest(folder / 'manifest.json')
+
+    with PlayApiServer() as server:
+        def _upload(resumable: bool):
+            with PlayPublisherClient('com.app', token='token',
+                                     http=httpx.Client(transport=LocalTransport(server.base_url))) as client:
+                upload_bundle(client, bundle_path, changelog, 'internal', resumable=resumable)
+                client.http.close()
+
+        async def _upload_many():
+            transport = AsyncLocalTransport(server.base_url)
+            async with httpx.AsyncClient(transport=transport) as http:
+                results = await upload_packages(AsyncPlayPublisherClient('', token='token', http=http), uploads)
+            if not all(x.ok for x in results):
+                raise RuntimeError(next(x.error for x in results if not x.ok))
+
+        return [
+            measure('upload.bundle', lambda: _upload(False), bundle_size / _MIB, 'MiB'),
+            measure('upload.bundle_resumable', lambda: _upload(True), bundle_size / _MIB, 'MiB',
+                    setup=lambda: bundle_path.with_name(f'{bundle_path.name}.upload').unlink(missing_ok=True)),
+            measure('upload.many', lambda: asyncio.run(_upload_many()), nb_packages, 'packages'),
+        ]
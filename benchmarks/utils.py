@@ -0,0 +1,50 @@
+import time
+import tracemalloc
+from dataclasses import dataclass
+from typing import Callable
+
+
+@dataclass
+class BenchResult:
+    name: str
+    items: float
+    unit: str
+    duration: float
+    # Peak of the memory allocated by Python during the run (allocations of the C libraries
+    # and of the worker processes are not counted)
+    peak_memory: int
+
+    @property
+    def throughput(self) -> float:
+        return self.items / self.duration if self.duration else 0
+
+    def to_dict(self) -> dict:
+        return {'name': self.name, 'items': self.items, 'unit': self.unit,
+                'duration': round(self.duration, 6), 'throughput': round(self.throughput, 3),
+                'peak_memory': self.peak_memory}
+
+
+def measure(name: str,
+            func: Callable[[], object],
+            items: float,
+            unit: str,
+            setup: Callable[[], object] | None = None) -> BenchResult:
+    """
+    Times one run of `func`, then runs it again with tracemalloc to get its peak memory
+    (tracemalloc slows the run down, so both are not measured at once)
+    """
+    if setup:
+        setup()
+    start = time.perf_counter()
+    func()
+    duration = time.perf_counter() - start
+
+    if setup:
+        setup()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return BenchResult(name, items, unit, duration, peak_memory)
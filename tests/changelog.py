@@ -45,3 +45,106 @@ def test_release(data, expected):
     release = Release(**data)
     assert release.version_code == expected['version_code']
     assert release.release_notes[0].html_text == expected['html']
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('### 🔥 New\n- New **session** page', '🔥 <b>New</b>\n- New <b>session</b> page'),
+    ('### Nouveautés\n- *Plus* _rapide_ sur snake_case', '<b>Nouveautés</b>\n- <i>Plus</i> <i>rapide</i> sur snake_case'),
+    ('- See [the docs](https://example.com/docs)', '- See <a href="https://example.com/docs">the docs</a>'),
+    ('- 2 * 3 * 4 = 24, a _ b _ c and *a *b', '- 2 * 3 * 4 = 24, a _ b _ c and *a *b'),
+    ('- [Kotlin](https://en.wikipedia.org/wiki/Kotlin_(language)) (*new*)',
+     '- <a href="https://en.wikipedia.org/wiki/Kotlin_(language)">Kotlin</a> (<i>new</i>)'),
+])
+def test_render_html(text, expected):
+    from app_utils.jobs.changelog import render_html
+    assert render_html(text) == expected
+
+
+def test_iter_releases_lazy(tmp_path):
+    from app_utils.jobs.changelog import iter_releases, get_last_release, get_release, parse_markdown
+
+    path = tmp_path / 'CHANGELOG.md'
+    path.write_text((DATA_FOLDER / 'CHANGELOG.md').read_text() + '\n## invalid section\n')
+
+    # Only the sections before the requested release are parsed
+    assert get_last_release(path).version == '0.4.23'
+    assert get_release(path, '0.4.22').release_notes[1].text == '### 🐛 Bug fixed\n- Bug during session creation'
+    assert [x.version for x, _ in zip(iter_releases(path), range(2))] == ['0.4.23', '0.4.22']
+    with pytest.raises(ValueError):
+        parse_markdown(path)
+
+
+def test_load_changelog_cache(tmp_path, monkeypatch):
+    import os
+    from app_utils.jobs import changelog
+    from app_utils.jobs.changelog import load_changelog, get_last_release
+
+    path = tmp_path / 'CHANGELOG.md'
+    path.write_text((DATA_FOLDER / 'CHANGELOG.md').read_text())
+
+    nb_parsed = 0
+    _iter_releases = changelog.iter_releases
+
+    def iter_releases_mock(_path):
+        nonlocal nb_parsed
+        nb_parsed += 1
+        yield from _iter_releases(_path)
+
+    monkeypatch.setattr('app_utils.jobs.changelog.iter_releases', iter_releases_mock)
+
+    # Only the first section is parsed, then cached
+    assert get_last_release(path).version == '0.4.23'
+    assert nb_parsed == 1
+    monkeypatch.setattr('app_utils.jobs.changelog._CHANGELOGS', {})
+    assert get_last_release(path).version == '0.4.23'
+    assert nb_parsed == 1
+
+    _changelog = load_changelog(path)
+    assert nb_parsed == 2
+    assert _changelog.get('0.4.22').version_code == 4022
+    assert _changelog.get_by_version_code(4021).version == '0.4.21'
+    assert _changelog.get('1.0.0') is None
+
+    # New process, touched file: found in the disk cache from its hash
+    monkeypatch.setattr('app_utils.jobs.changelog._CHANGELOGS', {})
+    os.utime(path, (0, 0))
+    assert [x.version for x in load_changelog(path).releases] == ['0.4.23', '0.4.22', '0.4.21']
+    assert nb_parsed == 2
+
+    path.write_text(path.read_text().replace('0.4.23', '0.4.24'))
+    assert get_last_release(path).version == '0.4.24'
+    assert nb_parsed == 3
+
+
+def test_get_last_release_no_hash(tmp_path, monkeypatch):
+    from app_utils.jobs.changelog import get_last_release, load_changelog
+
+    path = tmp_path / 'CHANGELOG.md'
+    path.write_text((DATA_FOLDER / 'CHANGELOG.md').read_text())
+    hashed = []
+    monkeypatch.setattr('app_utils.jobs.changelog.get_file_hash', lambda _path: hashed.append(_path) or 'hash')
+
+    # Only the first section is read
+    assert get_last_release(path).version == '0.4.23'
+    assert hashed == []
+    load_changelog(path)
+    assert len(hashed) == 1
+
+
+def test_changelog_cache_same_stat(tmp_path, monkeypatch):
+    from app_utils.jobs.changelog import load_changelog, get_last_release
+
+    path = tmp_path / 'CHANGELOG.md'
+    path.write_text((DATA_FOLDER / 'CHANGELOG.md').read_text())
+    # Coarse timestamps: a version bump of the same size keeps the stat
+    monkeypatch.setattr('app_utils.jobs.changelog._get_stat_key', lambda _path: (0, 0, 0))
+
+    assert get_last_release(path).version == '0.4.23'
+    assert load_changelog(path).last.version == '0.4.23'
+    path.write_text(path.read_text().replace('0.4.23', '0.4.24'))
+    assert get_last_release(path).version == '0.4.24'
+
+    monkeypatch.setattr('app_utils.jobs.changelog._CHANGELOGS', {})
+    path.write_text(path.read_text().replace('0.4.24', '0.4.25'))
+    assert get_last_release(path).version == '0.4.25'
+    assert load_changelog(path).last.version == '0.4.25'
@@ -1,17 +1,170 @@
+import hashlib
+import json
 import shutil
 from pathlib import Path
 
+import httpx
 import pytest
+from httpx import codes
 
 DATA_FOLDER = Path(__file__).parent / 'data'
 
 
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path_factory, monkeypatch):
+    path = tmp_path_factory.mktemp('cache')
+    monkeypatch.setenv('APP_UTILS_CACHE_DIR', str(path))
+    monkeypatch.setattr('app_utils.jobs.changelog._CHANGELOGS', {})
+    yield path
+
+
 @pytest.fixture(scope='function')
 def project_path(tmp_path):
     path = tmp_path / 'myApp'
     shutil.copytree(DATA_FOLDER / 'myApp', path)
     yield path
 
+
 @pytest.fixture
 def static_folder():
     return DATA_FOLDER
+
+
+class ResumableUploadServer:
+    """
+    Emulates the resumable upload protocol of the Play Publisher API
+    (see https://developers.google.com/android-publisher/upload#resumable)
+    `fail_at` contains the indexes of the chunk requests that should fail with a connection error
+    """
+
+    def __init__(self, version_code: int = 1010004, fail_at: set[int] | None = None):
+        self.version_code = version_code
+        self.fail_at = fail_at or set()
+        self.sessions: dict[str, bytearray] = {}
+        self.nb_chunks = 0
+
+    def _resume_incomplete(self, received: int) -> httpx.Response:
+        headers = {'Range': f'bytes=0-{received - 1}'} if received else {}
+        return httpx.Response(codes.PERMANENT_REDIRECT, headers=headers)
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        if request.method == 'POST' and request.url.params.get('uploadType') == 'resumable':
+            session_uri = f'https://upload.mock/sessions/{len(self.sessions)}'
+            self.sessions[session_uri] = bytearray()
+            return httpx.Response(codes.OK, headers={'Location': session_uri})
+
+        session_uri = str(request.url)
+        if request.method != 'PUT' or session_uri not in self.sessions:
+            return httpx.Response(codes.NOT_FOUND, json={'error': {'message': 'Not found'}})
+
+        data = self.sessions[session_uri]
+        _range, total = request.headers['Content-Range'].removeprefix('bytes ').split('/')
+        if _range != '*':
+            self.nb_chunks += 1
+            if self.nb_chunks in self.fail_at:
+                raise httpx.ConnectError('Connection reset', request=request)
+            start = int(_range.split('-')[0])
+            if start == len(data):
+                data.extend(request.read())
+        if len(data) == int(total):
+            return httpx.Response(codes.OK, json={'versionCode': self.version_code})
+        return self._resume_incomplete(len(data))
+
+
+@pytest.fixture
+def upload_server():
+    return ResumableUploadServer()
+
+
+class PlayApiServer:
+    """
+    Emulates the edits endpoints of the Play Publisher API used by the uploads
+    """
+
+    def __init__(self, failing_packages: set[str] | None = None):
+        self.failing_packages = failing_packages or set()
+        # Returns a wrong SHA-256 for the uploaded bundles
+        self.corrupt = False
+        self.bundles: dict[str, list[int]] = {}
+        # Bundles returned by edits.bundles.list, by edit
+        self.bundle_infos: dict[str, list[dict]] = {}
+        self.nb_uploads = 0
+        self.deobfuscation_files: dict[tuple[str, int], list[str]] = {}
+        self.tracks: dict[tuple[str, str], dict] = {}
+        self.commits: list[str] = []
+        # Content received by the resumable upload sessions
+        self.sessions: dict[str, bytearray] = {}
+        self._version_code = 1000
+
+    @staticmethod
+    def _error(message: str, status_code: int = codes.FORBIDDEN) -> httpx.Response:
+        return httpx.Response(status_code, json={'error': {'message': message}})
+
+    def _upload_chunk(self, request: httpx.Request) -> httpx.Response:
+        session_id = request.url.params['upload_id']
+        if session_id not in self.sessions:
+            return self._error('Not found', codes.NOT_FOUND)
+        data = self.sessions[session_id]
+        _range, total = request.headers['Content-Range'].removeprefix('bytes ').split('/')
+        if _range != '*' and int(_range.split('-')[0]) == len(data):
+            data.extend(request.read())
+        if len(data) < int(total):
+            headers = {'Range': f'bytes=0-{len(data) - 1}'} if data else {}
+            return httpx.Response(codes.PERMANENT_REDIRECT, headers=headers)
+        # Same response as a media upload of the whole content
+        url = request.url.copy_remove_param('upload_id').copy_set_param('uploadType', 'media')
+        return self(httpx.Request('POST', url, content=bytes(data)))
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path.split('/applications/', 1)[-1]
+        package_name, _, path = path.partition('/')
+        if package_name in self.failing_packages:
+            return self._error(f'Package {package_name} not allowed')
+
+        if request.url.params.get('uploadType') == 'resumable':
+            if request.method == 'PUT':
+                return self._upload_chunk(request)
+            session_id = str(len(self.sessions))
+            self.sessions[session_id] = bytearray()
+            # Like the Play Publisher API, the session URI is the upload URL with an upload id
+            session_uri = str(request.url.copy_set_param('upload_id', session_id))
+            return httpx.Response(codes.OK, headers={'Location': session_uri})
+
+        match request.method, path.split('/'):
+            case 'POST', ['edits']:
+                return httpx.Response(codes.OK, json={'id': f'{package_name}-edit'})
+            case 'GET', ['edits', edit_id]:
+                if edit_id in self.commits:
+                    return self._error(f'Edit {edit_id} already committed', codes.NOT_FOUND)
+                return httpx.Response(codes.OK, json={'id': edit_id})
+            case 'POST', ['edits', edit_id, 'bundles']:
+                sha256 = hashlib.sha256(b'' if self.corrupt else request.read()).hexdigest()
+                self.nb_uploads += 1
+                self._version_code += 1
+                self.bundles.setdefault(edit_id, []).append(self._version_code)
+                self.bundle_infos.setdefault(edit_id, []).append({'versionCode': self._version_code, 'sha256': sha256})
+                return httpx.Response(codes.OK, json={'versionCode': self._version_code, 'sha256': sha256})
+            case 'GET', ['edits', edit_id, 'bundles']:
+                return httpx.Response(codes.OK, json={'kind': 'androidpublisher#bundlesListResponse',
+                                                      'bundles': self.bundle_infos.get(edit_id, [])})
+            case 'POST', ['edits', edit_id, 'apks', version_code, 'deobfuscationFiles', file_type]:
+                request.read()
+                if int(version_code) not in self.bundles.get(edit_id, []):
+                    return self._error(f'Unknown version code {version_code}', codes.NOT_FOUND)
+                self.deobfuscation_files.setdefault((edit_id, int(version_code)), []).append(file_type)
+                return httpx.Response(codes.OK, json={'deobfuscationFile': {'symbolType': file_type}})
+            case 'GET', ['edits', edit_id, 'tracks']:
+                return httpx.Response(codes.OK, json={'tracks': [x for (_package_name, _), x in self.tracks.items()
+                                                                 if _package_name == package_name]})
+            case 'PUT', ['edits', edit_id, 'tracks', track]:
+                self.tracks[(package_name, track)] = json.loads(request.read())
+                return httpx.Response(codes.OK, json=self.tracks[(package_name, track)])
+            case 'POST', ['edits', edit_id] if edit_id.endswith(':commit'):
+                self.commits.append(edit_id.removesuffix(':commit'))
+                return httpx.Response(codes.OK, json={'id': edit_id})
+        return self._error('Not found', codes.NOT_FOUND)
+
+
+@pytest.fixture
+def play_api():
+    return PlayApiServer()
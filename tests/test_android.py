@@ -1,6 +1,9 @@
+import json
 import shutil
+from pathlib import Path
 
 import httpx
+import pytest
 from httpx import codes
 
 
@@ -10,6 +13,9 @@ def test_upload_bundle(tmp_path, static_folder,
     def fetch_insert_edit_mock(client, expiry):
         return httpx.Response(codes.OK, json={'id': 'new-edit-id'})
 
+    def fetch_list_bundles_mock(client, edit_id):
+        return httpx.Response(codes.OK, json={'kind': 'androidpublisher#bundlesListResponse'})
+
     def fetch_upload_bundle(client, edit_id, bundle_path):
         return httpx.Response(codes.OK, json={'versionCode': 1010004})
 
@@ -21,6 +27,8 @@ def test_upload_bundle(tmp_path, static_folder,
 
     monkeypatch.setattr('app_utils.jobs.android.utils.fetch_insert_edit',
                         fetch_insert_edit_mock)
+    monkeypatch.setattr('app_utils.jobs.android.utils.fetch_list_bundles',
+                        fetch_list_bundles_mock)
     monkeypatch.setattr('app_utils.jobs.android.utils.fetch_upload_bundle',
                         fetch_upload_bundle)
     monkeypatch.setattr('app_utils.jobs.android.utils.fetch_patch_release',
@@ -29,6 +37,7 @@ def test_upload_bundle(tmp_path, static_folder,
                         fetch_commit_mock)
 
     from app_utils.jobs.android.utils import upload_bundle
+    from app_utils.jobs.android.client import PlayPublisherClient
 
     shutil.copyfile(static_folder / 'CHANGELOG.md',
                     tmp_path / 'CHANGELOG.md')
@@ -36,7 +45,668 @@ def test_upload_bundle(tmp_path, static_folder,
     bundle_path = tmp_path
     changelog_path = tmp_path / 'CHANGELOG.md'
 
-    upload_bundle(httpx.Client(),
+    upload_bundle(PlayPublisherClient('com.app', token='token'),
                   path=bundle_path,
                   changelog=changelog_path,
                   track='internal')
+
+
+def test_upload_bundle_resumable(tmp_path, upload_server, monkeypatch):
+    from app_utils.jobs.android.utils import fetch_upload_bundle_resumable, CHUNK_ALIGNMENT
+    from app_utils.jobs.android.client import PlayPublisherClient
+
+    monkeypatch.setattr('app_utils.jobs.android.utils.time.sleep', lambda _: None)
+    upload_server.fail_at = {2}
+
+    bundle_path = tmp_path / 'app.aab'
+    bundle = bytes(range(256)) * (CHUNK_ALIGNMENT * 3 // 256 + 10)
+    bundle_path.write_bytes(bundle)
+
+    with PlayPublisherClient('com.app', token='token',
+                             http=httpx.Client(transport=httpx.MockTransport(upload_server))) as client:
+        resp = fetch_upload_bundle_resumable(client, 'edit-id', bundle_path,
+                                             chunk_size=CHUNK_ALIGNMENT)
+
+    assert resp.status_code == codes.OK
+    assert resp.json() == {'versionCode': 1010004}
+    assert list(upload_server.sessions.values()) == [bundle]
+    assert not (tmp_path / 'app.aab.upload').exists()
+
+
+def test_upload_bundle_resumable_spread_failures(tmp_path, upload_server, monkeypatch):
+    from app_utils.jobs.android.utils import fetch_upload_bundle_resumable, CHUNK_ALIGNMENT
+    from app_utils.jobs.android.client import PlayPublisherClient
+
+    delays = []
+    monkeypatch.setattr('app_utils.jobs.android.utils.time.sleep', delays.append)
+    # Every chunk fails once
+    upload_server.fail_at = {1, 3, 5, 7}
+
+    bundle_path = tmp_path / 'app.aab'
+    bundle = b'\x01' * CHUNK_ALIGNMENT * 4
+    bundle_path.write_bytes(bundle)
+
+    with PlayPublisherClient('com.app', token='token',
+                             http=httpx.Client(transport=httpx.MockTransport(upload_server))) as client:
+        resp = fetch_upload_bundle_resumable(client, 'edit-id', bundle_path,
+                                             chunk_size=CHUNK_ALIGNMENT, max_retries=1)
+
+    assert resp.status_code == codes.OK
+    assert list(upload_server.sessions.values()) == [bundle]
+    # The backoff restarts after each acknowledged chunk
+    assert len(delays) == 4 and max(delays) <= client.transport.retry.backoff_base
+
+
+def test_upload_bundle_resume_session(tmp_path, upload_server, monkeypatch):
+    from app_utils.jobs.android.utils import fetch_upload_bundle_resumable, CHUNK_ALIGNMENT
+    from app_utils.jobs.android.client import PlayPublisherClient
+
+    monkeypatch.setattr('app_utils.jobs.android.utils.time.sleep', lambda _: None)
+    upload_server.fail_at = {3}
+
+    bundle_path = tmp_path / 'app.aab'
+    bundle = b'\x01' * CHUNK_ALIGNMENT * 4
+    bundle_path.write_bytes(bundle)
+
+    with PlayPublisherClient('com.app', token='token',
+                             http=httpx.Client(transport=httpx.MockTransport(upload_server))) as client:
+        with pytest.raises(httpx.ConnectError):
+            fetch_upload_bundle_resumable(client, 'edit-id', bundle_path,
+                                          chunk_size=CHUNK_ALIGNMENT, max_retries=0)
+        assert (tmp_path / 'app.aab.upload').exists()
+
+        resp = fetch_upload_bundle_resumable(client, 'edit-id', bundle_path,
+                                             chunk_size=CHUNK_ALIGNMENT)
+
+    assert resp.status_code == codes.OK
+    # The second run resumed the same session and only sent the 2 remaining chunks
+    assert len(upload_server.sessions) == 1
+    assert upload_server.nb_chunks == 5
+    assert list(upload_server.sessions.values()) == [bundle]
+
+
+def test_async_upload_resumable(tmp_path, upload_server, monkeypatch):
+    import asyncio
+    from app_utils.jobs.android.upload_many import async_fetch_upload_resumable
+    from app_utils.jobs.android.utils import CHUNK_ALIGNMENT
+    from app_utils.jobs.android.client import AsyncPlayPublisherClient
+
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr('app_utils.jobs.android.upload_many.asyncio.sleep', sleep)
+    upload_server.fail_at = {3}
+    path = tmp_path / 'mapping.txt'
+    content = bytes(range(256)) * (CHUNK_ALIGNMENT * 4 // 256)
+    path.write_bytes(content)
+
+    async def _run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(upload_server)) as http:
+            client = AsyncPlayPublisherClient('com.app', token='token', http=http)
+            return await async_fetch_upload_resumable(client, f'{client.upload_url}/edits/edit-id/bundles', path,
+                                                      chunk_size=CHUNK_ALIGNMENT)
+
+    resp = asyncio.run(_run())
+    assert resp.status_code == codes.OK
+    assert list(upload_server.sessions.values()) == [content]
+    # Only the failed chunk was sent again
+    assert upload_server.nb_chunks == 5
+    assert len(delays) == 1
+
+
+def test_upload_bundle_resumable_stalled(tmp_path, upload_server, monkeypatch):
+    from app_utils.jobs.android.utils import fetch_upload_bundle_resumable, CHUNK_ALIGNMENT
+    from app_utils.jobs.android.client import PlayPublisherClient
+
+    monkeypatch.setattr('app_utils.jobs.android.utils.time.sleep', lambda _: None)
+    bundle_path = tmp_path / 'app.aab'
+    bundle_path.write_bytes(b'\x01' * CHUNK_ALIGNMENT * 2)
+
+    def handler(request: httpx.Request):
+        resp = upload_server(request)
+        # The chunks are rejected without error
+        if resp.status_code == codes.PERMANENT_REDIRECT:
+            request.read()
+            return httpx.Response(codes.PERMANENT_REDIRECT)
+        return resp
+
+    with PlayPublisherClient('com.app', token='token',
+                             http=httpx.Client(transport=httpx.MockTransport(handler))) as client:
+        with pytest.raises(httpx.HTTPStatusError):
+            fetch_upload_bundle_resumable(client, 'edit-id', bundle_path,
+                                          chunk_size=CHUNK_ALIGNMENT, max_retries=2)
+    # The first chunk and its 2 retries
+    assert upload_server.nb_chunks == 3
+
+
+def test_upload_bundle_resume_edit(tmp_path, static_folder, upload_server, play_api, monkeypatch):
+    from app_utils.jobs.android.utils import upload_bundle, CHUNK_ALIGNMENT
+    from app_utils.jobs.android.client import PlayPublisherClient
+    from app_utils.jobs.android.transport import TransportConfig, RetryPolicy
+
+    monkeypatch.setattr('app_utils.jobs.android.utils.time.sleep', lambda _: None)
+    bundle_path = tmp_path / 'app.aab'
+    bundle = b'\x01' * CHUNK_ALIGNMENT * 3
+    bundle_path.write_bytes(bundle)
+    upload_server.fail_at = {2}
+    requests = []
+
+    def handler(request: httpx.Request):
+        requests.append((request.method, request.url.path.rsplit('/', 1)[-1]))
+        if request.url.params.get('uploadType') == 'resumable' or request.url.host == 'upload.mock':
+            resp = upload_server(request)
+            # Resumable uploads may complete with 201
+            if request.method == 'PUT' and resp.status_code == codes.OK:
+                return httpx.Response(codes.CREATED, json=resp.json())
+            return resp
+        return play_api(request)
+
+    http = httpx.Client(transport=httpx.MockTransport(handler))
+    client = PlayPublisherClient('com.app', token='token', http=http,
+                                 transport=TransportConfig(retry=RetryPolicy(max_retries=0)))
+    with pytest.raises(httpx.ConnectError):
+        upload_bundle(client, bundle_path, static_folder / 'CHANGELOG.md', 'internal', resumable=True,
+                      chunk_size=CHUNK_ALIGNMENT)
+
+    # Running the command again resumes the upload in the same edit
+    requests.clear()
+    client = PlayPublisherClient('com.app', token='token', http=http)
+    upload_bundle(client, bundle_path, static_folder / 'CHANGELOG.md', 'internal', resumable=True,
+                  chunk_size=CHUNK_ALIGNMENT)
+    assert ('POST', 'edits') not in requests
+    assert len(upload_server.sessions) == 1
+    assert list(upload_server.sessions.values()) == [bundle]
+    assert upload_server.nb_chunks == 4
+    assert play_api.commits == ['com.app-edit']
+    assert not (tmp_path / 'app.aab.upload').exists()
+
+
+def test_upload_many(tmp_path, static_folder, play_api):
+    import asyncio
+    from app_utils.jobs.android.upload_many import load_manifest, upload_packages
+    from app_utils.jobs.android.client import AsyncPlayPublisherClient
+
+    shutil.copyfile(static_folder / 'CHANGELOG.md', tmp_path / 'CHANGELOG.md')
+    for name in ['a.aab', 'b.aab', 'c.aab']:
+        (tmp_path / name).write_bytes(name.encode() * 1000)
+    (tmp_path / 'manifest.json').write_text(json.dumps({'packages': [
+        {'package': 'com.app.a', 'bundles': ['a.aab', 'b.aab'], 'changelog': 'CHANGELOG.md', 'track': 'internal'},
+        {'package': 'com.app.b', 'bundles': ['c.aab'], 'changelog': 'CHANGELOG.md', 'track': 'beta'},
+        {'package': 'com.app.c', 'bundles': ['c.aab'], 'changelog': 'CHANGELOG.md', 'track': 'beta'},
+    ]}))
+    play_api.failing_packages = {'com.app.c'}
+
+    # Requests in flight by package (the bundles of a package are uploaded concurrently)
+    in_flight: dict[str, int] = {}
+    max_in_flight = 0
+
+    async def handler(request: httpx.Request):
+        nonlocal max_in_flight
+        package_name = request.url.path.split('/applications/', 1)[-1].split('/')[0]
+        in_flight[package_name] = in_flight.get(package_name, 0) + 1
+        max_in_flight = max(sum(x > 0 for x in in_flight.values()), max_in_flight)
+        await asyncio.sleep(0.01)
+        in_flight[package_name] -= 1
+        return play_api(request)
+
+    async def _run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http:
+            client = AsyncPlayPublisherClient('', token='token', http=http)
+            return await upload_packages(client, load_manifest(tmp_path / 'manifest.json'), concurrency=2)
+
+    results = asyncio.run(_run())
+
+    assert [(x.package_name, x.ok) for x in results] == [('com.app.a', True),
+                                                         ('com.app.b', True),
+                                                         ('com.app.c', False)]
+    assert sorted(results[0].version_codes) == sorted(play_api.bundles['com.app.a-edit'])
+    assert len(results[0].version_codes) == 2
+    assert results[2].error == 'Package com.app.c not allowed (code: 403)'
+    assert sorted(play_api.commits) == ['com.app.a-edit', 'com.app.b-edit']
+    assert play_api.tracks[('com.app.a', 'internal')]['releases'][0]['versionCodes'] == results[0].version_codes
+    assert max_in_flight == 2
+
+
+def test_upload_many_unexpected_error(tmp_path, static_folder, play_api):
+    import asyncio
+    from app_utils.jobs.android.upload_many import PackageUpload, upload_packages
+    from app_utils.jobs.android.client import AsyncPlayPublisherClient
+
+    (tmp_path / 'app.aab').write_bytes(b'bundle' * 1000)
+
+    def handler(request: httpx.Request):
+        resp = play_api(request)
+        if '/com.app.b/' in request.url.path and request.method == 'PUT' and resp.status_code == codes.OK:
+            # Unexpected response without version code
+            return httpx.Response(codes.OK, json={})
+        return resp
+
+    async def _run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http:
+            client = AsyncPlayPublisherClient('', token='token', http=http)
+            return await upload_packages(client, [
+                PackageUpload(x, [tmp_path / 'app.aab'], static_folder / 'CHANGELOG.md', 'internal')
+                for x in ['com.app.a', 'com.app.b']])
+
+    results = asyncio.run(_run())
+
+    assert [(x.package_name, x.ok) for x in results] == [('com.app.a', True), ('com.app.b', False)]
+    assert results[1].error == "KeyError: 'versionCode'"
+    assert play_api.commits == ['com.app.a-edit']
+
+
+def test_token_cache(tmp_path):
+    from app_utils.jobs.android.token import TokenCache, Token
+
+    refreshes = []
+
+    def refresh(expires_in: int = 3600):
+        refreshes.append(expires_in)
+        return Token.from_response({'access_token': f'token-{len(refreshes)}', 'expires_in': expires_in})
+
+    cache = TokenCache(tmp_path / 'tokens')
+    assert cache.get_or_refresh('a@app.com', refresh).access_token == 'token-1'
+    assert cache.get_or_refresh('a@app.com', refresh).access_token == 'token-1'
+    # Tokens are shared with other processes through the file
+    assert TokenCache(tmp_path / 'tokens').get('a@app.com').access_token == 'token-1'
+    # Each account has its own token
+    assert cache.get_or_refresh('b@app.com', refresh).access_token == 'token-2'
+    # Rejected tokens are refreshed
+    assert cache.get_or_refresh('a@app.com', refresh, rejected='token-1').access_token == 'token-3'
+    # Tokens about to expire are refreshed
+    cache.get_or_refresh('c@app.com', lambda: refresh(60))
+    assert cache.get('c@app.com') is None
+    assert cache.get_or_refresh('c@app.com', refresh).access_token == 'token-5'
+    assert len(refreshes) == 5
+
+    (tmp_path / 'legacy').write_text('bare-token')
+    assert TokenCache(tmp_path / 'legacy').get(None) is None
+
+
+def test_proactive_token_refresh(tmp_path):
+    from app_utils.jobs.android.client import PlayPublisherClient, ServiceAccount
+    from app_utils.jobs.android.token import TokenCache
+    from app_utils.jobs.android.utils import fetch_insert_edit
+
+    requests = []
+
+    def handler(request: httpx.Request):
+        requests.append(request)
+        if request.url.host == 'oauth2.googleapis.com':
+            return httpx.Response(codes.OK, json={'access_token': 'new-token', 'expires_in': 3599})
+        if request.headers.get('Authorization') != 'Bearer new-token':
+            return httpx.Response(codes.UNAUTHORIZED, json={})
+        return httpx.Response(codes.OK, json={'id': 'edit-id'})
+
+    account = ServiceAccount('a@app.com', 'key-id', 'private-key')
+    account.gen_jwt = lambda: 'signed-jwt'
+    with PlayPublisherClient('com.app', account,
+                             token='stale-token',
+                             cache=TokenCache(tmp_path / 'tokens'),
+                             http=httpx.Client(transport=httpx.MockTransport(handler))) as client:
+        assert fetch_insert_edit(client).json() == {'id': 'edit-id'}
+        assert fetch_insert_edit(client.with_package('com.app.b')).json() == {'id': 'edit-id'}
+
+    # No request was sent with the stale token and the token was only fetched once
+    assert [x.url.host for x in requests] == ['oauth2.googleapis.com', 'www.googleapis.com', 'www.googleapis.com']
+    assert requests[2].url.path == '/androidpublisher/v3/applications/com.app.b/edits'
+
+
+def test_async_token_refresh_accounts(tmp_path):
+    import asyncio
+    from urllib.parse import parse_qs
+    from app_utils.jobs.android.client import AsyncPlayPublisherClient, ServiceAccount
+    from app_utils.jobs.android.token import TokenCache
+
+    refreshes = []
+
+    async def handler(request: httpx.Request):
+        if request.url.host == 'oauth2.googleapis.com':
+            assertion = parse_qs(request.read().decode())['assertion'][0]
+            refreshes.append(assertion)
+            await asyncio.sleep(0.01)
+            return httpx.Response(codes.OK, json={'access_token': f'token-{assertion}', 'expires_in': 3599})
+        return httpx.Response(codes.OK, json={'id': request.headers['Authorization']})
+
+    def get_account(email: str) -> ServiceAccount:
+        account = ServiceAccount(email, 'key-id', 'private-key')
+        account.gen_jwt = lambda: email
+        return account
+
+    async def _run():
+        cache = TokenCache(tmp_path / 'tokens')
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http:
+            # Independent clients with different accounts, refreshing concurrently
+            clients = [AsyncPlayPublisherClient('com.app', get_account(email), http=http, cache=cache)
+                       for email in ['a@x', 'b@x', 'a@x']]
+            return await asyncio.wait_for(asyncio.gather(*[x.request('GET', x.url) for x in clients]), 5)
+
+    responses = asyncio.run(_run())
+    assert [x.json()['id'] for x in responses] == ['Bearer token-a@x', 'Bearer token-b@x', 'Bearer token-a@x']
+    assert sorted(refreshes) == ['a@x', 'b@x']
+
+
+def test_gen_jwt_reused():
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from app_utils.jobs.android.client import ServiceAccount
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    account = ServiceAccount('a@app.com', 'key-id', key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()))
+
+    assert account.gen_jwt() == account.gen_jwt()
+
+
+def test_publish(tmp_path, static_folder, play_api):
+    import asyncio
+    from app_utils.jobs.android.upload_many import publish, Artifact
+    from app_utils.jobs.android.client import AsyncPlayPublisherClient
+
+    for name in ['a.aab', 'b.aab', 'mapping.txt', 'symbols.zip']:
+        (tmp_path / name).write_bytes(name.encode() * 1000)
+    artifacts = [Artifact(tmp_path / 'a.aab', mapping=tmp_path / 'mapping.txt', native_symbols=tmp_path / 'symbols.zip'),
+                 Artifact(tmp_path / 'b.aab', mapping=tmp_path / 'mapping.txt')]
+
+    requests = []
+
+    async def handler(request: httpx.Request):
+        requests.append(request.url.path.rsplit('/edits', 1)[-1])
+        await asyncio.sleep(0.01)
+        return play_api(request)
+
+    async def _run(changelog: Path):
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http:
+            client = AsyncPlayPublisherClient('com.app', token='token', http=http)
+            return await publish(client, artifacts, changelog, 'internal')
+
+    result = asyncio.run(_run(static_folder / 'CHANGELOG.md'))
+    assert result.ok, result.error
+    code_a, code_b = result.version_codes
+    assert play_api.deobfuscation_files == {('com.app-edit', code_a): ['proguard', 'nativeCode'],
+                                            ('com.app-edit', code_b): ['proguard']}
+    assert play_api.tracks[('com.app', 'internal')]['releases'][0]['versionCodes'] == [code_a, code_b]
+    # The track is only updated once every artifact is uploaded
+    assert requests[-2:] == ['/com.app-edit/tracks/internal', '/com.app-edit:commit']
+
+    # The upload stops as soon as the changelog is invalid
+    requests.clear()
+    (tmp_path / 'CHANGELOG.md').write_text('# Changelog\n\n## invalid\n')
+    result = asyncio.run(_run(tmp_path / 'CHANGELOG.md'))
+    assert not result.ok
+    assert not any('tracks' in x or 'commit' in x for x in requests)
+
+    # Retried release: the bundles already on the Play Console are reused
+    nb_uploads = play_api.nb_uploads
+    result = asyncio.run(_run(static_folder / 'CHANGELOG.md'))
+    assert result.ok, result.error
+    assert result.version_codes == [code_a, code_b]
+    assert play_api.nb_uploads == nb_uploads
+
+    play_api.bundle_infos.clear()
+    play_api.corrupt = True
+    result = asyncio.run(_run(static_folder / 'CHANGELOG.md'))
+    assert 'corrupted' in result.error
+
+
+def test_upload_bundle_dedupe(tmp_path, static_folder, play_api):
+    import hashlib
+    from app_utils.jobs.android.utils import upload_bundle, UploadFailedException
+    from app_utils.jobs.android.client import PlayPublisherClient
+
+    bundle_path = tmp_path / 'app.aab'
+    bundle_path.write_bytes(b'bundle' * 1000)
+    client = PlayPublisherClient('com.app', token='token', http=httpx.Client(transport=httpx.MockTransport(play_api)))
+
+    # Retrying the release in the same edit: the bundle is not sent again
+    for _ in range(2):
+        upload_bundle(client, bundle_path, static_folder / 'CHANGELOG.md', 'internal', edit_id='com.app-edit')
+    assert play_api.nb_uploads == 1
+    assert play_api.commits == ['com.app-edit', 'com.app-edit']
+
+    # Another bundle already uses the version code of the release
+    play_api.bundle_infos['other-edit'] = [{'versionCode': 4023, 'sha256': hashlib.sha256(b'other').hexdigest()}]
+    with pytest.raises(UploadFailedException) as e:
+        upload_bundle(client, bundle_path, static_folder / 'CHANGELOG.md', 'internal', edit_id='other-edit')
+    assert e.value.status_code == codes.CONFLICT
+    assert play_api.nb_uploads == 1
+
+
+def test_request_retries(monkeypatch):
+    from app_utils.jobs.android.client import PlayPublisherClient
+    from app_utils.jobs.android.transport import TransportConfig, RetryPolicy
+
+    delays = []
+    monkeypatch.setattr('app_utils.jobs.android.client.time.sleep', delays.append)
+    responses = [httpx.ConnectError('Connection reset'),
+                 httpx.Response(codes.TOO_MANY_REQUESTS, headers={'Retry-After': '3'}),
+                 httpx.Response(codes.SERVICE_UNAVAILABLE),
+                 httpx.Response(codes.OK, json={'id': 'edit-id'})]
+
+    def handler(request: httpx.Request):
+        resp = responses.pop(0)
+        if isinstance(resp, Exception):
+            raise resp
+        return resp
+
+    transport = TransportConfig(retry=RetryPolicy(max_retries=3, backoff_base=0.5))
+    with PlayPublisherClient('com.app', token='token', transport=transport,
+                             http=httpx.Client(transport=httpx.MockTransport(handler))) as client:
+        resp = client.request('POST', f'{client.url}/edits')
+        assert resp.json() == {'id': 'edit-id'}
+        # Retry-After is honored, the other delays are jittered
+        assert delays[1] == 3
+        assert 0 <= delays[0] <= 0.5 and 0 <= delays[2] <= 2
+
+        # Gives up after max_retries
+        responses[:] = [httpx.Response(codes.BAD_GATEWAY)] * 4 + [httpx.Response(codes.OK)]
+        assert client.request('GET', client.url).status_code == codes.BAD_GATEWAY
+        # Client errors are not retried
+        responses[:] = [httpx.Response(codes.BAD_REQUEST), httpx.Response(codes.OK)]
+        assert client.request('GET', client.url).status_code == codes.BAD_REQUEST
+
+
+def test_request_not_idempotent(monkeypatch):
+    from app_utils.jobs.android.client import PlayPublisherClient
+    from app_utils.jobs.android.utils import fetch_commit
+
+    monkeypatch.setattr('app_utils.jobs.android.client.time.sleep', lambda _: None)
+    responses = []
+    commits = []
+
+    def handler(request: httpx.Request):
+        commits.append(request.url.path)
+        resp = responses.pop(0)
+        if isinstance(resp, Exception):
+            raise resp
+        return resp
+
+    with PlayPublisherClient('com.app', token='token',
+                             http=httpx.Client(transport=httpx.MockTransport(handler))) as client:
+        # Not received by the server: sent again
+        responses[:] = [httpx.ConnectError('Connection refused'), httpx.Response(codes.OK, json={})]
+        assert fetch_commit(client, 'edit-id').status_code == codes.OK
+        assert len(commits) == 2
+
+        # The commit may have been applied: not sent again
+        for error in [httpx.ReadTimeout('Timed out'), httpx.RemoteProtocolError('Server disconnected')]:
+            commits.clear()
+            responses[:] = [error, httpx.Response(codes.OK, json={})]
+            with pytest.raises(type(error)):
+                fetch_commit(client, 'edit-id')
+            assert len(commits) == 1
+
+        commits.clear()
+        responses[:] = [httpx.Response(codes.SERVICE_UNAVAILABLE), httpx.Response(codes.OK, json={})]
+        assert fetch_commit(client, 'edit-id').status_code == codes.SERVICE_UNAVAILABLE
+        assert len(commits) == 1
+
+
+def test_async_request_retries(monkeypatch):
+    import asyncio
+    from app_utils.jobs.android.client import AsyncPlayPublisherClient
+    from app_utils.jobs.android.transport import TransportConfig, RetryPolicy
+
+    timeouts = []
+    responses = [httpx.Response(codes.INTERNAL_SERVER_ERROR), httpx.Response(codes.OK)]
+
+    def handler(request: httpx.Request):
+        timeouts.append(request.extensions['timeout'])
+        return responses.pop(0)
+
+    async def _run():
+        transport = TransportConfig(upload_write_timeout=900, retry=RetryPolicy(backoff_base=0))
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as http:
+            client = AsyncPlayPublisherClient('com.app', token='token', http=http, transport=transport)
+            return await client.request('POST', client.upload_url, content=b'bundle', upload=True)
+
+    assert asyncio.run(_run()).status_code == codes.OK
+    assert [x['write'] for x in timeouts] == [900, 900]
+
+
+def test_retry_after():
+    from email.utils import formatdate
+    import time
+    from app_utils.jobs.android.transport import RetryPolicy
+
+    policy = RetryPolicy(max_delay=60)
+    assert policy.get_delay(0, httpx.Response(codes.TOO_MANY_REQUESTS, headers={'Retry-After': '10'})) == 10
+    assert policy.get_delay(0, httpx.Response(codes.TOO_MANY_REQUESTS, headers={'Retry-After': '3600'})) == 60
+    date = formatdate(time.time() + 30, usegmt=True)
+    assert 25 < policy.get_delay(0, httpx.Response(codes.SERVICE_UNAVAILABLE, headers={'Retry-After': date})) <= 30
+    assert policy.get_delay(0, httpx.Response(codes.SERVICE_UNAVAILABLE, headers={'Retry-After': 'soon'})) <= 1
+    assert policy.get_retry_delay(policy.max_retries, httpx.Response(codes.SERVICE_UNAVAILABLE)) is None
+
+
+def test_promote(tmp_path, static_folder, play_api):
+    from app_utils.jobs.android.promote import load_rollout, promote
+    from app_utils.jobs.android.utils import UploadFailedException
+    from app_utils.jobs.android.client import PlayPublisherClient
+
+    (tmp_path / 'rollout.json').write_text(json.dumps({'tracks': [
+        {'track': 'internal'},
+        {'track': 'beta', 'countries': ['France', 'Belgium']},
+        {'track': 'production', 'status': 'in_progress', 'user_fraction': 0.1, 'countries': None},
+    ]}))
+    client = PlayPublisherClient('com.app', token='token', http=httpx.Client(transport=httpx.MockTransport(play_api)))
+
+    edit_id = promote(client, load_rollout(tmp_path / 'rollout.json'), static_folder / 'CHANGELOG.md')
+
+    assert play_api.commits == [edit_id]
+    releases = {track: data['releases'][0] for (_, track), data in play_api.tracks.items()}
+    assert list(releases) == ['internal', 'beta', 'production']
+    assert releases['internal']['countryTargeting'] is None
+    assert releases['beta']['countryTargeting'] == {'countries': ['France', 'Belgium'], 'includeRestOfWorld': False}
+    assert releases['beta']['status'] == 'completed' and releases['beta']['userFraction'] is None
+    assert releases['production']['countryTargeting'] is None
+    assert (releases['production']['status'], releases['production']['userFraction']) == ('IN_PROGRESS', 0.1)
+
+    # The edit cannot be created
+    play_api.failing_packages = {'com.app'}
+    with pytest.raises(UploadFailedException) as e:
+        promote(client, load_rollout(tmp_path / 'rollout.json'), static_folder / 'CHANGELOG.md')
+    assert e.value.status_code == codes.FORBIDDEN
+
+
+def test_release_user_fraction():
+    from app_utils.jobs.android.utils import Release, Status
+    from app_utils.jobs.changelog import Release as _Release
+
+    def get_user_fraction(release: Release):
+        return release.data['releases'][0]['userFraction']
+
+    assert get_user_fraction(Release('beta', _Release('1.0.0'), status=Status.draft)) is None
+    assert get_user_fraction(Release('beta', _Release('1.0.0'), status=Status.draft, user_fraction=0.5)) is None
+    assert get_user_fraction(Release('beta', _Release('1.0.0'), status=Status.halted, user_fraction=0.5)) == 0.5
+
+
+@pytest.mark.parametrize('track', [
+    {'track': 'nightly'},
+    {'track': 'beta', 'status': 'rolling'},
+    {'track': 'beta', 'user_fraction': 0.5},
+    {'track': 'beta', 'status': 'in_progress', 'user_fraction': 1.5},
+    {'track': 'beta', 'status': 'in_progress'},
+    {'track': 'beta', 'status': 'halted'},
+    {'track': 'beta', 'status': 'draft', 'user_fraction': 0.5},
+])
+def test_load_rollout_invalid(tmp_path, track):
+    from app_utils.jobs.android.promote import load_rollout
+
+    (tmp_path / 'rollout.json').write_text(json.dumps({'tracks': [track]}))
+    with pytest.raises(ValueError):
+        load_rollout(tmp_path / 'rollout.json')
+
+
+def test_sync_notes(tmp_path, static_folder, play_api):
+    from app_utils.jobs.android.notes import sync_release_notes
+    from app_utils.jobs.android.client import PlayPublisherClient
+    from app_utils.jobs.changelog import load_changelog
+
+    changelog = load_changelog(static_folder / 'CHANGELOG.md')
+    notes = {x.version: [n.data for n in x.release_notes] for x in changelog.releases}
+    play_api.tracks = {
+        ('com.app', 'internal'): {'track': 'internal', 'releases': [
+            {'versionCodes': ['4023'], 'status': 'completed', 'releaseNotes': notes['0.4.23']}]},
+        ('com.app', 'beta'): {'track': 'beta', 'releases': [
+            {'versionCodes': ['4022'], 'status': 'completed', 'releaseNotes': notes['0.4.22'][:1]},
+            {'versionCodes': ['4021'], 'status': 'inProgress', 'userFraction': 0.2,
+             'releaseNotes': [{'language': 'fr-FR', 'text': 'Typo'}, *notes['0.4.21'][1:]]},
+            # Not in the changelog
+            {'versionCodes': ['1'], 'status': 'halted', 'releaseNotes': []}]},
+    }
+    requests = []
+
+    def handler(request: httpx.Request):
+        requests.append(request.method)
+        return play_api(request)
+
+    client = PlayPublisherClient('com.app', token='token', http=httpx.Client(transport=httpx.MockTransport(handler)))
+
+    changes = sync_release_notes(client, static_folder / 'CHANGELOG.md', dry_run=True)
+    assert [(x.track, x.version, x.languages) for x in changes] == [('beta', '0.4.22', ['en-US']),
+                                                                   ('beta', '0.4.21', ['fr-FR'])]
+    assert not play_api.commits
+
+    requests.clear()
+    sync_release_notes(client, static_folder / 'CHANGELOG.md')
+    # Insert, list, a single track update and the commit
+    assert requests == ['POST', 'GET', 'PUT', 'POST']
+    releases = play_api.tracks[('com.app', 'beta')]['releases']
+    assert [x['releaseNotes'] for x in releases] == [notes['0.4.22'], notes['0.4.21'], []]
+    assert releases[1]['userFraction'] == 0.2
+
+    # Nothing left to sync: nothing is committed
+    assert sync_release_notes(client, static_folder / 'CHANGELOG.md') == []
+    assert len(play_api.commits) == 1
+
+
+def test_shared_http(monkeypatch):
+    from app_utils.jobs.android import client as client_module
+    from app_utils.jobs.android.client import PlayPublisherClient, enable_shared_http, get_shared_http
+    from app_utils.jobs.android.transport import TransportConfig
+
+    monkeypatch.setattr(client_module, '_shared_http', None)
+    assert get_shared_http() is None
+
+    default = enable_shared_http()
+    assert get_shared_http(TransportConfig(read_timeout=5)) is default
+    # The pool limits of the command are kept in the daemon
+    assert get_shared_http(TransportConfig(max_connections=20)) not in (None, default)
+
+    timeouts = []
+
+    def handler(request: httpx.Request):
+        timeouts.append(request.extensions['timeout'])
+        return httpx.Response(codes.OK, json={})
+
+    transport = TransportConfig(read_timeout=5, upload_read_timeout=500)
+    http = httpx.Client(transport=httpx.MockTransport(handler))
+    # Timeouts of the command, not of the shared pool
+    with PlayPublisherClient('com.app', token='token', http=http, transport=transport) as client:
+        client.request('GET', client.url)
+        client.request('POST', client.upload_url, content=b'bundle', upload=True)
+    assert [x['read'] for x in timeouts] == [5, 500]
+    for _http in client_module._shared_http.values():
+        _http.close()
@@ -10,4 +10,106 @@ def test_crop_image(static_folder, tmp_path, monkeypatch):
              extensions=['jpeg'],
              image_dim='100x100',
              from_top=10,
-             from_bottom=20)
+             from_bottom=20,
+             backend='convert',
+             jobs=None,
+             incremental=False)
+
+
+def test_crop_image_pillow(static_folder, tmp_path):
+    from PIL import Image
+    from app_utils.jobs.crop import run_crop
+
+    run_crop(static_folder, output_folder=tmp_path / 'output',
+             extensions=['jpeg'],
+             image_dim='1280x720',
+             from_top=10,
+             from_bottom=20,
+             backend='pillow',
+             jobs=None,
+             incremental=False)
+
+    with Image.open(tmp_path / 'output' / 'image.jpeg') as image:
+        assert image.size == (1280, 690)
+
+
+def test_crop_box():
+    from app_utils.jobs.crop import _get_crop_box
+
+    assert _get_crop_box('100x50+0+10', (100, 100)) == (0, 10, 100, 60)
+    # Clipped to the image like imagemagick
+    assert _get_crop_box('200x200+0+10', (100, 100)) == (0, 10, 100, 100)
+
+
+def test_crop_auto_dim(tmp_path):
+    from PIL import Image
+    from app_utils.jobs.crop import run_crop
+
+    folder = tmp_path / 'screenshots'
+    (folder / 'device').mkdir(parents=True)
+    Image.new('RGB', (1080, 2400)).save(folder / 'a.png')
+    Image.new('RGB', (1080, 2340)).save(folder / 'device' / 'b.JPG')
+    Image.new('RGB', (100, 200)).save(folder / 'c.png')
+    (folder / 'notes.txt').write_text('not an image')
+
+    run_crop(folder, output_folder=tmp_path / 'output',
+             extensions=['png', 'jpg'],
+             image_dim=None,
+             from_top=None,
+             from_bottom=None,
+             backend='pillow',
+             jobs=2,
+             incremental=False)
+
+    sizes = {}
+    for p in (tmp_path / 'output').rglob('*'):
+        if p.suffix.lower() in ('.png', '.jpg'):
+            with Image.open(p) as image:
+                sizes[str(p.relative_to(tmp_path / 'output'))] = image.size
+    assert sizes == {
+        'a.png': (1080, 2400 - 117 - 125),
+        'device/b.JPG': (1080, 2340 - 64 - 132),
+        # No preset
+        'c.png': (100, 200)
+    }
+
+
+def test_crop_incremental(tmp_path, monkeypatch):
+    import os
+    from PIL import Image
+    from app_utils.jobs import crop
+    from app_utils.jobs.crop import run_crop
+
+    cropped = []
+    _crop_image_pillow = crop.crop_image_pillow
+
+    def crop_image_mock(input_path, output_path, crop_dim):
+        cropped.append(os.path.basename(input_path))
+        _crop_image_pillow(input_path, output_path, crop_dim)
+
+    monkeypatch.setattr('app_utils.jobs.crop.crop_image_pillow', crop_image_mock)
+
+    folder, output_folder = tmp_path / 'screenshots', tmp_path / 'output'
+    folder.mkdir()
+    for i in range(3):
+        Image.new('RGB', (100, 200), (i, 0, 0)).save(folder / f'{i}.png')
+
+    def _run(from_top=10):
+        cropped.clear()
+        run_crop(folder, output_folder=output_folder, extensions=['png'], image_dim=None,
+                 from_top=from_top, from_bottom=0, backend='pillow', jobs=2, incremental=True)
+        return sorted(cropped)
+
+    assert _run() == ['0.png', '1.png', '2.png']
+    assert _run() == []
+
+    Image.new('RGB', (100, 200), (0, 0, 255)).save(folder / '3.png')
+    Image.new('RGB', (100, 200), (0, 255, 0)).save(folder / '0.png')
+    (folder / '1.png').unlink()
+    # Touched but unchanged
+    os.utime(folder / '2.png', (0, 0))
+    assert _run() == ['0.png', '3.png']
+    assert sorted(x.name for x in output_folder.glob('*.png')) == ['0.png', '2.png', '3.png']
+
+    # New crop parameters
+    assert _run(from_top=20) == ['0.png', '2.png', '3.png']
@@ -1,3 +1,6 @@
+import json
+
+
 def test_create_icons(static_folder, tmp_path, monkeypatch):
     from app_utils.jobs.icons import run_icons
 
@@ -5,5 +8,108 @@ def test_create_icons(static_folder, tmp_path, monkeypatch):
 
     run_icons(icon=svg_path,
               icons_folder=None,
-              output_folder=tmp_path)
+              output_folder=tmp_path,
+              force=False,
+              jobs=None,
+              profiles_path=None)
     assert list(tmp_path.glob('*.png'))
+
+
+def test_create_icons_incremental(static_folder, tmp_path, monkeypatch):
+    from app_utils.jobs.icons import run_icons, MANIFEST_NAME
+
+    rendered = []
+
+    def render_icon_mock(file, output_folder, outputs, file_hash):
+        rendered.append(file.name)
+        for _output in outputs:
+            (output_folder / _output).write_bytes(b'png')
+
+    monkeypatch.setattr('app_utils.jobs.icons.render_icon', render_icon_mock)
+
+    icons_folder = tmp_path / 'icons'
+    output_folder = tmp_path / 'output'
+    icons_folder.mkdir()
+    output_folder.mkdir()
+    for name in ['a', 'b', 'c']:
+        (icons_folder / f'{name}.svg').write_text((static_folder / 'test.svg').read_text() + f'<!-- {name} -->')
+
+    run_icons(icons_folder=icons_folder, icon=None, output_folder=output_folder, force=False, jobs=1, profiles_path=None)
+    assert sorted(rendered) == ['a.svg', 'b.svg', 'c.svg']
+    assert (output_folder / MANIFEST_NAME).exists()
+    assert len(list(output_folder.glob('*.png'))) == 21
+
+    # Nothing changed
+    rendered.clear()
+    run_icons(icons_folder=icons_folder, icon=None, output_folder=output_folder, force=False, jobs=1, profiles_path=None)
+    assert rendered == []
+
+    # Only the modified / deleted outputs are rendered again, removed svgs are pruned
+    (icons_folder / 'a.svg').write_text('<svg></svg>')
+    (icons_folder / 'c.svg').unlink()
+    (output_folder / 'b@2x.png').unlink()
+    run_icons(icons_folder=icons_folder, icon=None, output_folder=output_folder, force=False, jobs=1, profiles_path=None)
+    assert sorted(rendered) == ['a.svg', 'b.svg']
+    assert not list(output_folder.glob('c*.png'))
+    assert len(list(output_folder.glob('*.png'))) == 14
+
+    rendered.clear()
+    run_icons(icons_folder=icons_folder, icon=None, output_folder=output_folder, force=True, jobs=1, profiles_path=None)
+    assert sorted(rendered) == ['a.svg', 'b.svg']
+
+
+def render_icon_mock(file, output_folder, outputs, file_hash):
+    for _output in outputs:
+        (output_folder / _output).write_text(file_hash)
+
+
+def test_render_icons_jobs(static_folder, tmp_path):
+    from app_utils.jobs.icons import render_icons, get_outputs, _DEFAULT_PROFILES
+
+    svg_path = static_folder / 'test.svg'
+    # A single svg, split by output size between the workers
+    render_icons([(svg_path, get_outputs(svg_path, _DEFAULT_PROFILES), 'hash')], tmp_path,
+                 jobs=4, renderer=render_icon_mock)
+    assert sorted(x.name for x in tmp_path.glob('*.png')) == [
+        'test.android.png', 'test.png',
+        'test@2x.android.png', 'test@2x.png',
+        'test@3x.android.png', 'test@3x.png',
+        'test@4x.android.png'
+    ]
+    assert {x.read_text() for x in tmp_path.glob('*.png')} == {'hash'}
+
+
+def test_create_icons_profiles(static_folder, tmp_path, monkeypatch):
+    from app_utils.jobs.icons import run_icons
+
+    monkeypatch.setattr('app_utils.jobs.icons.render_icon', render_icon_mock)
+
+    profiles_path = tmp_path / 'profiles.json'
+    profiles_path.write_text(json.dumps({'profiles': {
+        'app': {'sizes': {'': {'size': 28, 'formats': [1, 2]}}},
+        'favicon': {'folder': 'web', 'webp': True, 'sizes': {'-favicon': {'size': 16, 'formats': [1, 2]}}}
+    }}))
+    output_folder = tmp_path / 'output'
+    output_folder.mkdir()
+
+    run_icons(icon=static_folder / 'test.svg', icons_folder=None, output_folder=output_folder,
+              force=False, jobs=1, profiles_path=profiles_path)
+    assert sorted(str(x.relative_to(output_folder)) for x in output_folder.rglob('test*')) == [
+        'test.png', 'test@2x.png',
+        'web/test-favicon.png', 'web/test-favicon.webp',
+        'web/test@2x-favicon.png', 'web/test@2x-favicon.webp'
+    ]
+
+
+def test_write_image_webp(tmp_path):
+    import io
+    from PIL import Image
+    from app_utils.jobs.icons import write_image
+
+    png = io.BytesIO()
+    Image.new('RGBA', (16, 16), (255, 0, 0, 255)).save(png, 'PNG')
+    write_image(png.getvalue(), tmp_path / 'icon.webp')
+
+    with Image.open(tmp_path / 'icon.webp') as image:
+        assert image.format == 'WEBP'
+        assert image.size == (16, 16)
@@ -3,3 +3,37 @@ def test_main(capsys):
 
     cli.run_with_args('-h')
     assert capsys.readouterr().out.rstrip()
+
+
+def test_lazy_commands(static_folder):
+    import subprocess
+    import sys
+
+    # Run in a new interpreter to check the modules imported by the command only
+    code = ('import sys\n'
+            'from app_utils.__main__ import get_cli\n'
+            f'args = ["changelog", "-p", {str(static_folder / "CHANGELOG.md")!r}, "-l"]\n'
+            'get_cli(args).run_with_args(*args)\n'
+            'assert "httpx" not in sys.modules and "jwt" not in sys.modules, "httpx / jwt imported"\n'
+            'assert "cairosvg" not in sys.modules, "cairosvg imported"\n')
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert '0.4.23' in result.stdout
+
+
+def test_metrics_json(tmp_path, project_path, static_folder):
+    import json
+    from app_utils.__main__ import get_cli, get_command_name
+    from app_utils.metrics import metrics
+
+    args = ['--metrics-json', str(tmp_path / 'metrics.json'), 'update-versions',
+            '--projects', str(project_path), '--changelog', str(static_folder / 'CHANGELOG.md')]
+    assert get_command_name(args) == 'update-versions'
+    get_cli(args).run_with_args(*args)
+    metrics.flush()
+
+    data = json.loads((tmp_path / 'metrics.json').read_text())
+    assert data['counters']['update_version.files'] == 2
+    assert data['spans']['update_version.ios']['count'] == 1
+    assert data['spans']['update_version.android']['errors'] == 0
+    assert data['duration'] > 0
@@ -0,0 +1,53 @@
+import threading
+
+import pytest
+
+from .conftest import DATA_FOLDER
+
+
+@pytest.fixture
+def job_server(tmp_path):
+    from app_utils.daemon import JobServer
+
+    server = JobServer(tmp_path / 'app-utils.sock')
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def test_serve(job_server):
+    from app_utils.daemon import send_job, is_running
+
+    assert is_running(job_server.socket_path)
+
+    # Relative paths are resolved from the working directory of the client
+    response = send_job(['changelog', '-p', 'CHANGELOG.md', '-l'], job_server.socket_path, cwd=str(DATA_FOLDER))
+    assert response['code'] == 0
+    assert '0.4.23' in response['stdout']
+
+    response = send_job(['changelog', '-p', 'missing.md', '-l'], job_server.socket_path, cwd=str(DATA_FOLDER))
+    assert response['code'] == 1
+    assert 'FileNotFoundError' in response['stderr']
+
+    assert send_job(['unknown'], job_server.socket_path)['code'] != 0
+    assert send_job(['serve'], job_server.socket_path)['code'] == 1
+
+
+def test_server_stale_socket(tmp_path):
+    import socket
+    from app_utils.daemon import JobServer, is_running
+
+    path = tmp_path / 'app-utils.sock'
+    # Socket file left by a killed server
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.bind(str(path))
+    assert path.exists() and not is_running(path)
+
+    with JobServer(path):
+        assert is_running(path)
+        with pytest.raises(RuntimeError):
+            JobServer(path)
+    assert not path.exists()
@@ -0,0 +1,42 @@
+import sys
+
+import pytest
+
+
+def test_run_cmd():
+    from app_utils.utils import run_cmd
+
+    lines = []
+    # No shell: the argument is passed as is
+    run_cmd([sys.executable, '-c', 'import sys; print(sys.argv[1]); print("err", file=sys.stderr)', '$HOME; ls'],
+            on_line=lines.append)
+    assert lines == ['$HOME; ls', 'err']
+
+    # Writing to stderr is not a failure
+    run_cmd([sys.executable, '-c', 'import sys; print("warning", file=sys.stderr)'])
+
+
+def test_run_cmd_errors():
+    from app_utils.utils import run_cmd, CommandError
+
+    with pytest.raises(CommandError) as e:
+        run_cmd([sys.executable, '-c', 'import sys; [print(i) for i in range(100)]; sys.exit(3)'])
+    assert e.value.returncode == 3
+    assert e.value.output == [str(i) for i in range(80, 100)]
+
+    with pytest.raises(CommandError) as e:
+        run_cmd([sys.executable, '-c', 'import time; print("start", flush=True); time.sleep(10)'], timeout=0.5)
+    assert e.value.timeout == 0.5
+    assert e.value.output == ['start']
+
+
+def test_run_cmds():
+    import time
+    from app_utils.utils import run_cmds
+
+    cmds = [[sys.executable, '-c', f'import sys, time; time.sleep(0.5); sys.exit({i % 2})'] for i in range(4)]
+    start = time.perf_counter()
+    results = list(run_cmds(cmds, jobs=4))
+    assert time.perf_counter() - start < 1.5
+    assert sorted(e.returncode for _, e in results if e) == [1, 1]
+    assert {tuple(cmd) for cmd, _ in results} == {tuple(x) for x in cmds}
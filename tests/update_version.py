@@ -1,3 +1,7 @@
+import shutil
+
+import pytest
+
 from .conftest import DATA_FOLDER
 
 
@@ -9,6 +13,7 @@ def test_update_version_android(tmp_path, project_path):
         changelog=DATA_FOLDER / 'CHANGELOG.md',
         project_path=project_path,
         version_path=tmp_path / 'version',
+        targets=None,
     )
 
     with open(project_path / 'android' / 'app' / 'build.gradle', 'r') as f:
@@ -31,7 +36,8 @@ def test_update_version_ios(tmp_path, project_path):
         changelog=DATA_FOLDER / 'CHANGELOG.md',
         project_path=project_path,
         version_path=str(tmp_path / 'version'),
-        project_name='myApp'
+        project_name='myApp',
+        targets=None,
     )
 
     with open(project_path / 'ios' / 'myApp.xcodeproj' / 'project.pbxproj', 'r') as f:
@@ -48,3 +54,61 @@ def test_update_version_ios(tmp_path, project_path):
         assert _curr_prj_line == 'CURRENT_PROJECT_VERSION = 4023;'
 
     assert (tmp_path / 'version').read_text() == '0.4.23'
+
+
+def test_update_versions(tmp_path, project_path):
+    from app_utils.jobs.update_version import run_update_versions
+
+    apps = tmp_path / 'apps'
+    for name in ('app1', 'app2'):
+        shutil.copytree(project_path, apps / name)
+
+    run_update_versions(
+        projects=[str(apps / '*')],
+        changelog=DATA_FOLDER / 'CHANGELOG.md',
+        app_types=['android', 'ios'],
+        jobs=4,
+        targets=None,
+    )
+
+    for name in ('app1', 'app2'):
+        gradle = (apps / name / 'android' / 'app' / 'build.gradle').read_text()
+        assert 'ext.versionMinor = 4' in gradle and 'ext.versionPatch = 23' in gradle
+        pbxproj = (apps / name / 'ios' / 'myApp.xcodeproj' / 'project.pbxproj').read_text()
+        assert 'MARKETING_VERSION = 1.2.3;' not in pbxproj
+        assert 'CURRENT_PROJECT_VERSION = 4023;' in pbxproj
+        # No temporary file left
+        assert not list((apps / name).rglob('*.tmp'))
+
+
+def test_update_versions_missing_project(tmp_path, project_path):
+    from app_utils.jobs.update_version import run_update_versions
+
+    (tmp_path / 'empty' / 'ios').mkdir(parents=True)
+    with pytest.raises(SystemExit):
+        run_update_versions(projects=[str(project_path), str(tmp_path / 'empty')],
+                            changelog=DATA_FOLDER / 'CHANGELOG.md',
+                            app_types=['ios'],
+                            jobs=None,
+                            targets=None)
+    assert 'CURRENT_PROJECT_VERSION = 4023;' in (project_path / 'ios' / 'myApp.xcodeproj' / 'project.pbxproj').read_text()
+
+
+def test_update_build_settings_targets():
+    from app_utils.jobs.pbxproj import parse_pbxproj, update_build_settings
+
+    text = (DATA_FOLDER / 'myApp' / 'ios' / 'myApp.xcodeproj' / 'project.pbxproj').read_text()
+    project = parse_pbxproj(text)
+    assert project.targets == ['myAppTests', 'myApp']
+    assert [x.name for x in project.configurations[None]] == ['Debug', 'Release']
+
+    new_text, changes = update_build_settings(text, {'MARKETING_VERSION': '2.0.0'}, targets=['myApp'],
+                                              configurations=['Release'])
+    assert [(x.target, x.configuration, x.setting, x.old, x.new) for x in changes] == [
+        ('myApp', 'Release', 'MARKETING_VERSION', '1.2.3', '2.0.0')
+    ]
+    assert new_text.count('MARKETING_VERSION = 2.0.0;') == 1
+    assert new_text.replace('MARKETING_VERSION = 2.0.0;', 'MARKETING_VERSION = 1.2.3;') == text
+
+    with pytest.raises(ValueError):
+        update_build_settings(text, {'MARKETING_VERSION': '2.0.0'}, targets=['unknown'])